@@ -1,180 +1,399 @@
 # apotek_runner.py
+#
+# Async core on playwright.async_api (so it can share an event loop with
+# sirs_runner), plus a thin sync wrapper for submit_main and the test scripts.
+# The sync functions run the coroutines on one private event-loop thread; use
+# either the *_async API from your own loop or the sync API, not both.
 
-from playwright.sync_api import TimeoutError as PWTimeoutError, sync_playwright
-from config import APOTEK_URL, APOTEK_SELECTORS
+import asyncio
+import threading
 import time
+import cdp_broker
+import metrics
+from playwright.async_api import TimeoutError as PWTimeoutError
+from config import APOTEK_URL, APOTEK_SELECTORS, APOTEK_DAFTAR_RESEP_URL, CDP_ENDPOINT
 
-_playwright_apo = None
-_browser_apo    = None
-_page_apo       = None
+_cdp_endpoint = CDP_ENDPOINT
+_page_apo     = None
 
-def _now_ms():
-    return int(time.time() * 1000)
+# Optional success element (config 'success_text_selector') shows 'Simpan Berhasil'.
+_JS_SUCCESS_TEXT = """(sel) => {
+    try {
+        const el = document.querySelector(sel);
+        if (!el) return false;
+        return el.textContent && el.textContent.includes('Simpan Berhasil');
+    } catch (e) {
+        return false;
+    }
+}"""
 
-def _adaptive_wait_for_function(page, js_func, arg, fast_timeout=800, long_timeout=7000, poll_interval=0.08):
+
+async def _wait_for_function_raf(page, js_func, arg, timeout: int) -> bool:
     """
-    Try a short fast_timeout first; if not satisfied, extend to long_timeout.
-    Returns True if the function returned truthy within total time, False otherwise.
-    Uses page.evaluate in a tight loop (less overhead than repeated full Playwright waits).
-    `js_func` should be a JS snippet that returns a value when done; we'll call it via evaluate.
-    We call evaluate repeatedly with a small sleep to keep responsiveness.
+    Evaluate `js_func(arg)` in the page on every animation frame until truthy.
+    Returns True when satisfied within `timeout` ms, False otherwise.
     """
-    start = _now_ms()
-    deadline_fast = start + fast_timeout
-    deadline_long = start + long_timeout
+    try:
+        await page.wait_for_function(js_func, arg=arg, polling="raf", timeout=timeout)
+        return True
+    except PWTimeoutError:
+        return False
 
-    # First, fast loop
-    while _now_ms() <= deadline_fast:
-        try:
-            val = page.evaluate(js_func, arg)
-            if val:
-                return True
-        except Exception:
-            # transient page state — ignore and retry
-            pass
-        time.sleep(poll_interval)
 
-    # Second, longer loop
-    while _now_ms() <= deadline_long:
+# Form readiness: card number present, no DevExpress callback in flight, and
+# both true for `settle` ms (so an alert raised by the same callback wins the race).
+_JS_FORM_READY = """({ sel, settle }) => {
+    const reset = () => { window.__apoReadySince = 0; return false; };
+    if (sel) {
+        const el = document.querySelector(sel);
+        if (!el || !(el.value || '').toString().trim()) return reset();
+    }
+    let busy = false;
+    try {
+        const coll = window.ASPxClientControl && ASPxClientControl.GetControlCollection();
+        if (coll) coll.ForEachControl(c => { if (c.InCallback && c.InCallback()) busy = true; });
+    } catch (e) {}
+    if (busy) return reset();
+    const now = performance.now();
+    if (!window.__apoReadySince) window.__apoReadySince = now;
+    return now - window.__apoReadySince >= settle;
+}"""
+
+_JS_CLEAR_VALUE = """(selector) => {
+    const el = document.querySelector(selector);
+    if (el) el.value = '';
+    window.__apoReadySince = 0;
+}"""
+
+# One persistent dialog listener per page; dialogs are queued until a phase consumes them.
+_dialog_queues = {}
+
+
+def _dialogs(page) -> asyncio.Queue:
+    q = _dialog_queues.get(page)
+    if q is None:
+        q = _dialog_queues[page] = asyncio.Queue()
+        page.on("dialog", q.put_nowait)
+    return q
+
+
+async def _drain_dialogs(page):
+    """Accept any dialog left over from a previous row."""
+    q = _dialogs(page)
+    while not q.empty():
         try:
-            val = page.evaluate(js_func, arg)
-            if val:
-                return True
+            await q.get_nowait().accept()
         except Exception:
             pass
-        time.sleep(poll_interval)
 
-    return False
 
+async def _race(waits: dict, timeout: float):
+    """
+    Run the named awaitables concurrently and return (name, result) of the first
+    one to finish successfully, or (None, None) when none does within `timeout` s.
+    The rest are cancelled — no stacked timeouts.
+    """
+    tasks = {asyncio.ensure_future(aw): name for name, aw in waits.items()}
+    pending = set(tasks)
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if not t.cancelled() and t.exception() is None and t.result() is not False:
+                    return tasks[t], t.result()
+        return None, None
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-def init_apotek(cdp_endpoint: str = "http://127.0.0.1:9222"):
-    """Attach to Chrome CDP and navigate to the Apotek BPJS form."""
-    global _playwright_apo, _browser_apo, _page_apo
-    _playwright_apo = sync_playwright().start()
-    _browser_apo    = _playwright_apo.chromium.connect_over_cdp(cdp_endpoint)
-    ctx             = _browser_apo.contexts[0] if _browser_apo.contexts else _browser_apo.new_context()
-    _page_apo       = ctx.pages[0] if ctx.pages else ctx.new_page()
-    # keep default timeout reasonably small — adaptive waits handle slow cases
+
+# === PHASE LATENCY STATS =================================================
+# Seconds per phase and row, recorded as metrics timers "apotek.<phase>":
+# search (SEP → card number / error alert), fill (receipt fields → form idle),
+# save (Simpan → confirmation), total.
+PHASES = ("search", "fill", "save", "total")
+
+_HIST_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0)
+
+
+def phase_report() -> str:
+    """p50/p95/max per phase plus a coarse latency histogram, as printable text."""
+    lines = [f"  {'phase':<8}{'n':>6}{'p50 s':>8}{'p95 s':>8}{'max s':>8}   histogram (≤" +
+             " / ".join(f"{b:g}" for b in _HIST_BUCKETS) + " / more)"]
+    for phase in PHASES:
+        n, _, top = metrics.stats(f"apotek.{phase}")
+        if not n:
+            continue
+        values = metrics.samples(f"apotek.{phase}")  # histogram over the sample when n > metrics.RESERVOIR
+        counts = [0] * (len(_HIST_BUCKETS) + 1)
+        for v in values:
+            counts[next((i for i, b in enumerate(_HIST_BUCKETS) if v <= b), len(_HIST_BUCKETS))] += 1
+        lines.append(
+            f"  {phase:<8}{n:>6}{metrics.percentile(values, 50):>8.2f}"
+            f"{metrics.percentile(values, 95):>8.2f}{top:>8.2f}   " + " ".join(f"{c:>3}" for c in counts)
+        )
+    return "\n".join(lines)
+
+
+async def _connect(cdp_endpoint: str):
+    global _cdp_endpoint
+    _cdp_endpoint = cdp_endpoint
+    return await cdp_broker.connect(cdp_endpoint)
+
+
+async def init_apotek_async(cdp_endpoint: str = CDP_ENDPOINT):
+    """
+    Attach to Chrome CDP and navigate to the Apotek BPJS form — in a tab leased
+    from cdp_broker when it runs, else the first tab of the Chrome session.
+    """
+    global _page_apo
+    browser   = await _connect(cdp_endpoint)
+    _page_apo = await cdp_broker.lease_page(browser, owner="apotek")
+    # keep default timeout reasonably small — the waits below carry their own timeouts
     _page_apo.set_default_timeout(4000)  # 4s
-    _page_apo.goto(APOTEK_URL, timeout=10000)
+    with metrics.timer("nav.apotek"):
+        await _page_apo.goto(APOTEK_URL, timeout=10000)
     print("✅ Connected to Apotek form.")
 
 
-def submit_to_apotek(sep: str, receipt: str, rec_type: str) -> tuple[str, str]:
+async def open_apotek_tab_async(cdp_endpoint: str = CDP_ENDPOINT):
+    """
+    Open a dedicated Apotek tab in the shared (logged-in) context and navigate it to the form.
+    Pass the returned page to submit_to_apotek(page=...); close with close_apotek_tab.
+    """
+    browser = await _connect(cdp_endpoint)
+    page    = await cdp_broker.lease_page(browser, owner="apotek-tab", new_tab=True)
+    page.set_default_timeout(4000)
+    with metrics.timer("nav.apotek"):
+        await page.goto(APOTEK_URL, timeout=10000)
+    return page
+
+
+async def close_apotek_tab_async(page):
+    """Close a tab opened by open_apotek_tab (the CDP connection stays up)."""
+    _dialog_queues.pop(page, None)
+    try:
+        if not await cdp_broker.release_page(page):
+            await page.close()
+    except Exception:
+        pass
+
+
+async def submit_to_apotek_async(sep: str, receipt: str, rec_type: str, page=None, on_phase=None) -> tuple[str, str]:
+    """
+    Submit one SEP/receipt on the Apotek form and return (status, note).
+    Uses the page from init_apotek unless a pool tab is given.
+    on_phase(name) is called as each phase starts (e.g. to checkpoint "save").
+
+    Each phase reacts to whichever signal fires first — an alert from the
+    page's persistent dialog listener or the DOM readiness check — instead
+    of chaining fixed waits:
+      search: SEP + Enter → card number filled and form idle | error alert
+      fill:   receipt type/number → form idle
+      save:   Simpan → confirmation alert | success element (if configured)
+    """
     sel = APOTEK_SELECTORS
+    page = page or _page_apo
+    dialogs = _dialogs(page)
+    row_started = time.monotonic()
+
+    async def fail_with_reset(msg):
+        await page.click(sel['reset_button'])
+        return ("error", msg)
+
     try:
         sep_str      = str(sep)
         receipt_str  = str(receipt)
         rec_type_str = str(rec_type)
+        await _drain_dialogs(page)
 
-        # fill SEP and trigger search (keeps it fast)
-        _page_apo.fill(sel['sep_input'], sep_str)
-        _page_apo.keyboard.press("Enter")
-
-        # Wait adaptively for the card-number input to hold a non-empty value.
-        js_check_value = """(selector) => {
-            const el = document.querySelector(selector);
-            if (!el) return false;
-            const v = el.value;
-            return v !== null && v !== undefined && v.toString().trim().length > 0;
-        }"""
-
-        ok = _adaptive_wait_for_function(
-            _page_apo,
-            js_check_value,
-            sel['no_kartu_input'],
-            fast_timeout=200,    # quick path: 0.7s
-            long_timeout=700,   # slow path: up to 7s
-            poll_interval=0.06
-        )
-
-        if not ok:
+        # --- search ----------------------------------------------------------
+        if on_phase:
+            on_phase("search")
+        t0 = time.monotonic()
+        await page.evaluate(_JS_CLEAR_VALUE, sel['no_kartu_input'])
+        await page.fill(sel['sep_input'], sep_str)
+        await page.keyboard.press("Enter")
+        event, value = await _race({
+            "dialog": dialogs.get(),
+            "ready":  page.wait_for_function(
+                _JS_FORM_READY, arg={"sel": sel['no_kartu_input'], "settle": 150}, polling="raf", timeout=2500
+            ),
+        }, timeout=2.5)
+        metrics.observe("apotek.search", time.monotonic() - t0)
+        if event == "dialog":
+            await value.accept()
+            return await fail_with_reset(value.message)
+        if event is None:
             return ("error", "No card number returned by page")
 
-        # It's common that an immediate dialog (error) appears after search;
-        # try a very short wait first, then a slightly longer one if needed.
-        try:
-            dlg = _page_apo.wait_for_event("dialog", timeout=700)
-            err_msg = dlg.message
-            dlg.accept()
-            _page_apo.click(sel['reset_button'])
-            return ("error", err_msg)
-        except PWTimeoutError:
-            # short wait didn't find dialog; try a longer but still bounded wait
-            try:
-                dlg = _page_apo.wait_for_event("dialog", timeout=700)
-                err_msg = dlg.message
-                dlg.accept()
-                _page_apo.click(sel['reset_button'])
-                return ("error", err_msg)
-            except PWTimeoutError:
-                pass
-
+        # --- fill ------------------------------------------------------------
+        if on_phase:
+            on_phase("fill")
+        t0 = time.monotonic()
         # fill receipt type and receipt number (fill is faster than type with delay)
-        _page_apo.fill(sel['receipt_type_input'], rec_type_str)
-        _page_apo.fill(sel['receipt_input'], receipt_str)
-        # tiny pause to let the page process the filled value (very short)
-        _page_apo.wait_for_timeout(120)
-        _page_apo.click(sel['simpan_button'])
+        await page.fill(sel['receipt_type_input'], rec_type_str)
+        await page.fill(sel['receipt_input'], receipt_str)
+        await _wait_for_function_raf(page, _JS_FORM_READY, {"sel": "", "settle": 0}, timeout=1000)
+        metrics.observe("apotek.fill", time.monotonic() - t0)
 
-        # After clicking save, wait adaptively for dialog confirmation (fast then longer)
-        try:
-            dlg = _page_apo.wait_for_event("dialog", timeout=700)
-            msg = dlg.message
-            dlg.accept()
+        # --- save ------------------------------------------------------------
+        if on_phase:
+            on_phase("save")
+        t0 = time.monotonic()
+        await page.click(sel['simpan_button'])
+        waits = {"dialog": dialogs.get()}
+        success_sel = sel.get('success_text_selector', '')
+        if success_sel:
+            waits["success"] = page.wait_for_function(_JS_SUCCESS_TEXT, arg=success_sel, polling="raf", timeout=6000)
+        event, value = await _race(waits, timeout=6.0)
+        metrics.observe("apotek.save", time.monotonic() - t0)
+
+        if event == "dialog":
+            msg = value.message
+            await value.accept()
             if "Simpan Berhasil" in msg:
                 return ("normal", msg)
-            _page_apo.click(sel['reset_button'])
-            return ("error", msg)
-        except PWTimeoutError:
-            # second-chance wait
-            try:
-                dlg = _page_apo.wait_for_event("dialog", timeout=3500)
-                msg = dlg.message
-                dlg.accept()
-                if "Simpan Berhasil" in msg:
-                    return ("normal", msg)
-                _page_apo.click(sel['reset_button'])
-                return ("error", msg)
-            except PWTimeoutError:
-                # final fallback: try to detect a known success element or assume no dialog -> error
-                try:
-                    # attempt to detect an element that normally contains success text if available
-                    # if selector not present the evaluate returns false quickly
-                    success_js = """(sel) => {
-                        try {
-                            const el = document.querySelector(sel);
-                            if (!el) return false;
-                            return el.textContent && el.textContent.includes('Simpan Berhasil');
-                        } catch (e) {
-                            return false;
-                        }
-                    }"""
-                    # try quickly
-                    success_detected = _adaptive_wait_for_function(
-                        _page_apo,
-                        success_js,
-                        sel.get('success_text_selector', ''),  # optional selector in config
-                        fast_timeout=300,
-                        long_timeout=2000,
-                        poll_interval=0.06
-                    )
-                    if success_detected:
-                        return ("normal", "Simpan Berhasil (detected)")
-                except Exception:
-                    pass
-
-                _page_apo.click(sel['reset_button'])
-                return ("error", "No confirmation alert")
+            return await fail_with_reset(msg)
+        if event == "success":
+            return ("normal", "Simpan Berhasil (detected)")
+        return await fail_with_reset("No confirmation alert")
 
     except Exception as e:
         return ("error", str(e))
+    finally:
+        metrics.observe("apotek.total", time.monotonic() - row_started)
 
 
-def close_apotek():
+# Settled answer of the Daftar Resep filter for `receipt`, or null while the grid
+# is still busy / not filtered yet. The No Resep column is the one holding the
+# filter editor; its cells are compared exactly, so a receipt number inside a
+# longer SEP or card number does not count. {listed: false} needs proof that the
+# filter ran: the empty-data row, or only rows whose No Resep contains `receipt`.
+_JS_RESEP_LISTED = """([filterSel, receipt]) => {
+    const overlay = document.querySelector('div.dxgvLoadingDiv_Glass');
+    if (overlay && overlay.getClientRects().length > 0) return null;
+    let busy = false;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => { if (c.InCallback && c.InCallback()) busy = true; });
+    } catch (e) {}
+    if (busy) return null;
+    const input = document.querySelector(filterSel);
+    const cell  = input && input.closest('td');
+    const grid  = input && input.closest('table[id$="_DXMainTable"]');
+    if (!cell || !grid || (input.value || '').trim() !== receipt) return null;
+    const want  = receipt.toUpperCase();
+    const rows  = Array.from(grid.querySelectorAll('tr[id*="_DXDataRow"]'));
+    const cells = rows.map(tr => tr.cells[cell.cellIndex] ? tr.cells[cell.cellIndex].textContent.trim().toUpperCase() : null);
+    if (cells.includes(want)) return { listed: true };
+    if (rows.length === 0 && grid.querySelector('tr[id$="_DXEmptyRow"]')) return { listed: false };
+    if (rows.length > 0 && cells.every(c => c !== null && c.includes(want))) return { listed: false };
+    return null;
+}"""
+
+
+async def resep_listed_async(receipt: str, page=None, timeout: int = 15000) -> bool | None:
+    """
+    Whether `receipt` already shows up in the Daftar Resep grid, i.e. an earlier
+    Simpan for it went through: True only when the filtered grid, with its
+    callback finished, has a row whose No Resep equals `receipt`. None when
+    that could not be settled either way. The page is taken back to the Apotek
+    form afterwards.
+    """
+    sel = APOTEK_SELECTORS
+    page = page or _page_apo
+    receipt = str(receipt).strip()
+    try:
+        with metrics.timer("nav.daftar_resep"):
+            await page.goto(APOTEK_DAFTAR_RESEP_URL, wait_until="domcontentloaded", timeout=timeout)
+            await page.wait_for_selector(sel['resep_filter'], timeout=timeout)
+        await page.fill(sel['resep_filter'], receipt)
+        await page.keyboard.press("Enter")
+        handle = await page.wait_for_function(_JS_RESEP_LISTED, arg=[sel['resep_filter'], receipt],
+                                              polling=100, timeout=timeout)
+        return bool((await handle.json_value())["listed"])
+    except Exception as e:
+        print(f"⚠️ Daftar Resep check for {receipt} could not be settled: {e}")
+        return None
+    finally:
+        try:
+            with metrics.timer("nav.apotek"):
+                await page.goto(APOTEK_URL, timeout=10000)
+        except Exception:
+            pass
+
+
+async def close_apotek_async():
     """Tear down the Apotek Playwright session."""
-    global _browser_apo, _playwright_apo
-    if _browser_apo:
-        _browser_apo.close()
-    if _playwright_apo:
-        _playwright_apo.stop()
+    global _page_apo
+    await cdp_broker.disconnect(_cdp_endpoint)  # also releases leased tabs
+    _page_apo = None
+    _dialog_queues.clear()
+
+
+# === SYNC WRAPPER ========================================================
+# One background event loop owns every Playwright object; callers from any
+# thread (e.g. the submit_main tab pool) hand it coroutines and block on the
+# result, so browser waits from several tabs overlap on that one loop.
+
+_loop        = None
+_loop_thread = None
+_loop_lock   = threading.Lock()
+
+
+def _run(coro):
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="apotek-loop", daemon=True)
+            _loop_thread.start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+def init_apotek(cdp_endpoint: str = CDP_ENDPOINT):
+    """Attach to Chrome CDP and navigate to the Apotek BPJS form."""
+    _run(init_apotek_async(cdp_endpoint))
+
+
+def open_apotek_tab(cdp_endpoint: str = CDP_ENDPOINT):
+    """Sync wrapper for open_apotek_tab_async."""
+    return _run(open_apotek_tab_async(cdp_endpoint))
+
+
+def close_apotek_tab(page):
+    """Sync wrapper for close_apotek_tab_async."""
+    _run(close_apotek_tab_async(page))
+
+
+def submit_to_apotek(sep: str, receipt: str, rec_type: str, page=None, on_phase=None) -> tuple[str, str]:
+    """Sync wrapper for submit_to_apotek_async (on_phase runs on the event-loop thread)."""
+    return _run(submit_to_apotek_async(sep, receipt, rec_type, page=page, on_phase=on_phase))
+
+
+def resep_listed(receipt: str, page=None) -> bool | None:
+    """Sync wrapper for resep_listed_async."""
+    return _run(resep_listed_async(receipt, page=page))
+
+
+def print_phase_report():
+    """Print per-phase p50/p95 latencies of this run's submissions."""
+    print("⏱  Apotek submit latency per phase:")
+    print(phase_report())
+
+
+def close_apotek():
+    """Tear down the Apotek Playwright session and stop the background loop."""
+    global _loop, _loop_thread
+    if _loop is None:
+        return
+    _run(close_apotek_async())
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop_thread.join(timeout=5)
+    _loop = _loop_thread = None
@@ -1,82 +1,49 @@
 # auto_input_obat_safe_patched.py
-from playwright.sync_api import sync_playwright
-import gspread
-from google.oauth2.service_account import Credentials
-from config import SERVICE_ACCOUNT_PATH
+import cdp_broker
+import json
+import os
+from collections import OrderedDict
+from checkpoint import Checkpoint
+from config import STATE_DIR
+import metrics
+from records import DONE_STATUSES, ObatRecord, ResepRecord, normalize_key, status_of
+from sheets_handler import CoalescingWriter, get_worksheet, read_columns
+from state_store import StateStore
 import time
-
-# ==== RATE-LIMIT SAFE GOOGLE UPDATE HELPERS ====
-import random
-from gspread.exceptions import APIError
 from datetime import datetime
-import concurrent.futures
-
-def safe_update_cell(ws, cell, value, retries=3):
-    """
-    Safe Google Sheets updater with retry & backoff to prevent 429 rate limit.
-    Also writes a timestamp to column F when updating the resep sheet.
-    """
 
-    for attempt in range(retries):
-        try:
-            # primary update
-            ws.update_acell(cell, value)
+# ==== GOOGLE WRITE HELPERS ====
+# All sheet writes go through one background CoalescingWriter: cells from many
+# rows are merged into a single batch_update, paced by a token bucket sized to
+# the Sheets write quota, with exponential backoff on 429. The browser loop
+# never waits on Sheets.
 
-            # if this is the resep sheet, also write timestamp to column F of same row
-            try:
-                # match row number from cell (e.g. "G12" -> "12")
-                row_digits = "".join(ch for ch in str(cell) if ch.isdigit())
-                if row_digits and getattr(ws, "title", "").lower() == SHEET_RESEP.lower():
-                    ts_cell = f"F{row_digits}"
-                    ts_val = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    ws.update_acell(ts_cell, ts_val)
-            except APIError as e_inner:
-                # surface quota errors to outer handler so retry/backoff can happen
-                if "Quota exceeded" in str(e_inner):
-                    raise e_inner
-                # otherwise don't block the main update; log and continue
-                print(f"⚠️ Failed to write timestamp {ts_cell}: {e_inner}")
-
-            time.sleep(1.1)  # Throttle slightly to stay under quota
-            return True
-        except APIError as e:
-            if "Quota exceeded" in str(e):
-                wait = 10 * (attempt + 1) + random.random() * 3
-                print(f"⚠️ Quota exceeded. Cooling down {wait:.1f}s before retry...")
-                time.sleep(wait)
-            else:
-                raise
-    print(f"❌ Failed to update cell {cell} after {retries} retries.")
-    return False
+def classify_obat_message(msg_text) -> str:
+    """Map the Apotek alert text after saving an obat to the sheet status: "done" or "error"."""
+    msg_lower = (msg_text or "").strip().lower()
+    if "obat berhasil disimpan" in msg_lower or "berhasil" in msg_lower:
+        return "done"
+    return "error"
 
-# --- NEW: small, deterministic writer wrapper that preserves ordering ---
-def write_row_sync(ws, row, msg_text, kode_val):
+def queue_obat_result(writer, ws, row, msg_text, kode_val, on_written=None) -> str:
     """
-    Blocking wrapper that writes status and message to Google Sheet using safe_update_cell.
-    Designed to be executed in a worker thread but the caller will wait for completion.
-    Returns status string: "done" or "error".
+    Queue status (H) and message (I) for an obat row and return the status.
+    Returns immediately; the writer keeps per-row ordering and calls
+    on_written(ok) once the cells are on the sheet (or given up).
     """
     msg = (msg_text or "").strip()
-    msg_lower = msg.lower()
-    try:
-        # classify result
-        if "obat berhasil disimpan" in msg_lower or "berhasil" in msg_lower:
-            # success
-            status = "done"
-            print(f" ✅ 200-Success : Updating row {row} for obat {kode_val}")
-        else:
-            # non-success / message may contain error
-            status = "error"
-            print(f" ⚠️  Non-success : Updating row {row} for obat {kode_val} -> '{msg}'")
-
-        # write status and message (H = status, I = message) - keep your previous layout
-        safe_update_cell(ws, f"H{row}", status)
-        safe_update_cell(ws, f"I{row}", msg)
-        # return status for caller to inspect
-        return status
-    except Exception as e:
-        print(f"❌ Exception while writing row {row}: {e}")
-        return "error"
+    status = classify_obat_message(msg)
+    if status == "done":
+        print(f" ✅ 200-Success : Updating row {row} for obat {kode_val}")
+    else:
+        print(f" ⚠️  Non-success : Updating row {row} for obat {kode_val} -> '{msg}'")
+    writer.put_row(ws, {f"H{row}": status, f"I{row}": msg}, on_written=on_written)
+    return status
+
+def queue_resep_status(writer, ws_resep, row, status, on_written=None):
+    """Queue a resep status (G) together with its timestamp (F); on_written as for queue_obat_result."""
+    ts_val = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    writer.put_row(ws_resep, {f"G{row}": status, f"F{row}": ts_val}, on_written=on_written)
 
 # ==== CONFIGURATION ====
 SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1MdEQrxNS6kuHkwks8Fgg6q29HxJ3qx2br-DPBpGecn4/edit?gid=1523826715#gid=1523826715"
@@ -96,262 +63,724 @@ SELECTORS = {
 
 # ==== GOOGLE SHEET HANDLER ====
 def open_sheet():
-    SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_PATH, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    ss = client.open_by_url(SPREADSHEET_URL)
-    return ss.worksheet(SHEET_RESEP), ss.worksheet(SHEET_OBAT)
+    # shared, cached client and handles (sheets_handler.get_client)
+    return get_worksheet(SHEET_RESEP, SPREADSHEET_URL), get_worksheet(SHEET_OBAT, SPREADSHEET_URL)
 
 # ==== PLAYWRIGHT HELPERS ====
 def attach_browser():
-    pw = sync_playwright().start()
-    browser = pw.chromium.connect_over_cdp(CDP_ENDPOINT)
-    context = browser.contexts[0] if browser.contexts else browser.new_context()
-    page = context.pages[0] if context.pages else context.new_page()
+    browser = cdp_broker.connect_sync(CDP_ENDPOINT)
+    page = cdp_broker.lease_page_sync(browser, owner="auto_input_v2")
     print("✅ Attached to existing Chrome session.")
     return browser, page
 
 def handle_dialog(page):
     try:
-        dialog = page.wait_for_event("dialog", timeout=8000)
+        with metrics.timer("dialog.wait"):
+            dialog = page.wait_for_event("dialog", timeout=8000)
         msg = dialog.message
         dialog.accept()
         return msg
     except Exception:
+        metrics.count("dialog.missing")
         return None
 
-def build_obat_row_map(ws_obat):
-    """Build a mapping (receipt_num, apol_id) → row number for quick lookup."""
-    values = ws_obat.get_all_values()
+# ==== OBAT AUTOCOMPLETE ====
+LISTBOX_SELECTOR = "table[id$='CboKdObatNR_DDD_L_LBT']"
+FIRST_ITEM_ROW = "table[id$='CboKdObatNR_DDD_L_LBT'] tr.dxeListBoxItemRow_Glass"
+FIRST_ITEM_KD_CELL = "table[id$='CboKdObatNR_DDD_L_LBT'] td[id$='_LBI0T0']"
+
+# Listbox visible and the code cell of its first row is exactly `kode`
+# (KODE12 does not pass for KODE1).
+_JS_LISTBOX_FIRST = """([lbSel, kode]) => {
+    const lb = document.querySelector(lbSel);
+    if (!lb || lb.getClientRects().length === 0) return false;
+    const cell = lb.querySelector("td[id$='_LBI0T0']");
+    return !!cell && cell.textContent.trim().toUpperCase() === kode.trim().toUpperCase();
+}"""
+
+# Selection propagated: combo text is `kode` itself or `kode` followed by the
+# separator before the name ("KODE1 - NAMA", not "KODE12 - ..."), the combo
+# reports a selected item, listbox closed, no DevExpress callback in flight.
+_JS_KODE_SELECTED = """([inputSel, lbSel, kode]) => {
+    const el = document.querySelector(inputSel);
+    const v = el ? (el.value || '').trim().toUpperCase() : '';
+    const k = kode.trim().toUpperCase();
+    if (v !== k && !v.startsWith(k + ' ')) return false;
+    const lb = document.querySelector(lbSel);
+    if (lb && lb.getClientRects().length > 0) return false;
+    let busy = false, combo = null;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => {
+            if (c.InCallback && c.InCallback()) busy = true;
+            if (c.GetInputElement && c.GetInputElement() === el) combo = c;
+        });
+    } catch (e) {}
+    return !busy && !!combo && combo.GetSelectedIndex() >= 0;
+}"""
+
+_JS_NO_CALLBACK = """() => {
+    let busy = false;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => { if (c.InCallback && c.InCallback()) busy = true; });
+    } catch (e) {}
+    return !busy;
+}"""
+
+def read_kode_input_value(page):
+    try:
+        return page.eval_on_selector(SELECTORS["kode_obat"], "el => el.value").strip()
+    except Exception:
+        return ""
+
+def select_obat_fast(page, kode):
+    """
+    Set the code in one step, fire a single keystroke so the combo runs its
+    filter callback, wait for the first listbox row to show `kode`, click it
+    and wait until the selection has propagated. No fixed sleeps.
+    Returns (ok, selected_value); ok=False means: use select_obat_legacy.
+    """
+    sel = SELECTORS["kode_obat"]
+    try:
+        page.fill(sel, kode[:-1])
+        page.press(sel, kode[-1])
+        page.wait_for_function(_JS_LISTBOX_FIRST, arg=[LISTBOX_SELECTOR, kode], polling="raf", timeout=6000)
+        page.click(FIRST_ITEM_KD_CELL, timeout=2000)
+        page.wait_for_function(_JS_KODE_SELECTED, arg=[sel, LISTBOX_SELECTOR, kode], polling="raf", timeout=2000)
+    except Exception:
+        return False, read_kode_input_value(page)
+    return True, read_kode_input_value(page)
+
+def select_obat_legacy(page, kode):
+    """Typed autocomplete with fixed pauses and one retry (the original path). Returns (ok, selected_value)."""
+    # type to trigger autocomplete
+    page.fill(SELECTORS["kode_obat"], "")
+    time.sleep(0.12)
+    page.click(SELECTORS["kode_obat"])
+    page.type(SELECTORS["kode_obat"], kode, delay=50)
+
+    # wait for the listbox to appear and try to click first item
+    try:
+        page.wait_for_selector(LISTBOX_SELECTOR, timeout=6000)
+        try:
+            page.click(FIRST_ITEM_KD_CELL, timeout=3000)
+        except Exception:
+            try:
+                page.click(FIRST_ITEM_ROW, timeout=3000)
+            except Exception:
+                page.keyboard.press("ArrowDown")
+                time.sleep(0.18)
+                page.keyboard.press("Enter")
+    except Exception:
+        # listbox never showed — fallback to ArrowDown/Enter
+        time.sleep(0.9)
+        page.keyboard.press("ArrowDown")
+        time.sleep(0.18)
+        page.keyboard.press("Enter")
+
+    # short pause to let widget propagate selection to fields
+    time.sleep(0.5)
+
+    # verify selection
+    selected_val = read_kode_input_value(page)
+    if selected_val and (kode in selected_val or selected_val in kode):
+        ui_ok = True
+    else:
+        try:
+            found = page.query_selector(f"xpath=//table[contains(@id,'TabPageObat')]//td[contains(., '{kode}')]")
+            ui_ok = bool(found)
+        except:
+            ui_ok = False
+
+    if not ui_ok:
+        metrics.count("autocomplete.retry")
+        print(f"⚠️ Autocomplete selection for {kode} may have failed — selected_val='{selected_val}'. Will attempt one retry.")
+        # single retry
+        page.fill(SELECTORS["kode_obat"], "")
+        time.sleep(0.12)
+        page.click(SELECTORS["kode_obat"])
+        page.type(SELECTORS["kode_obat"], kode, delay=80)
+        try:
+            page.wait_for_selector(LISTBOX_SELECTOR, timeout=5000)
+            page.click(FIRST_ITEM_KD_CELL)
+        except:
+            page.keyboard.press("ArrowDown")
+            page.keyboard.press("Enter")
+        time.sleep(0.6)
+        selected_val = read_kode_input_value(page)
+        ui_ok = bool(selected_val and (kode in selected_val or selected_val in kode))
+    return ui_ok, selected_val
+
+def wait_form_idle(page, timeout=3000):
+    """After Simpan's alert: wait for the form's callback to finish instead of a fixed 1s pause."""
+    try:
+        page.wait_for_function(_JS_NO_CALLBACK, polling="raf", timeout=timeout)
+    except Exception:
+        pass
+
+# ==== DAFTAR RESEP NAVIGATION ====
+# The grid is loaded once and re-filtered in place for every resep; after the
+# obat of a resep we go back in history to it instead of a fresh goto. Pages
+# count as ready on their own signals (key element present, no DevExpress
+# callback in flight) rather than networkidle.
+DAFTAR_RESEP_PAGE = "DaftarResep.aspx"
+OBAT_INPUT_PAGE = "ObatInput.aspx"
+
+_JS_PAGE_READY = """(sel) => {
+    if (!document.querySelector(sel)) return false;
+    let busy = false;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => { if (c.InCallback && c.InCallback()) busy = true; });
+    } catch (e) {}
+    return !busy;
+}"""
+
+class PageLoads:
+    """Counts full page loads (the `load` event) of one page."""
+
+    def __init__(self, page):
+        self.count = 0
+        page.on("load", self._on_load)
+
+    def _on_load(self, _page):
+        self.count += 1
+        metrics.count("page.load")
+
+def obat_on_grid(page, kode) -> bool:
+    """Whether `kode` is already listed in the saved-obat grid of ObatInput.aspx."""
+    try:
+        return page.query_selector(f"xpath=//table[contains(@id,'GvObatNR')]//td[contains(., '{kode}')]") is not None
+    except Exception:
+        return False
+
+def wait_page_ready(page, sel, timeout=30000):
+    page.wait_for_function(_JS_PAGE_READY, arg=sel, polling=100, timeout=timeout)
+
+def open_daftar_resep(page, stay_on_grid=True, fresh=False):
+    """
+    Put the page on the DaftarResep grid and return how: "reused" (already
+    there), "back" (history back from ObatInput) or "goto" (full load).
+    stay_on_grid=False is the original goto + networkidle per resep.
+    """
+    if not stay_on_grid:
+        page.goto(BASE_URL + DAFTAR_RESEP_PAGE)
+        page.wait_for_load_state("networkidle")
+        return "goto"
+    if not fresh:
+        try:
+            if DAFTAR_RESEP_PAGE in page.url:
+                wait_page_ready(page, SELECTORS["resep_filter"], timeout=5000)
+                return "reused"
+            if OBAT_INPUT_PAGE in page.url:
+                page.go_back(wait_until="commit", timeout=15000)
+                if DAFTAR_RESEP_PAGE in page.url:
+                    wait_page_ready(page, SELECTORS["resep_filter"], timeout=15000)
+                    return "back"
+        except Exception:
+            pass
+    page.goto(BASE_URL + DAFTAR_RESEP_PAGE, wait_until="domcontentloaded")
+    wait_page_ready(page, SELECTORS["resep_filter"])
+    return "goto"
+
+def filter_resep(page, no_resep, timeout=15000):
+    """Filter the grid to `no_resep` in place; True once its row is shown and the grid is idle."""
+    page.fill(SELECTORS["resep_filter"], no_resep)
+    page.keyboard.press("Enter")
+    try:
+        page.wait_for_selector(f"text={no_resep}", timeout=timeout)
+    except Exception:
+        return False
+    # Wait for the grid callback to finish before the Input Obat button is used
+    try:
+        page.wait_for_selector("div.dxgvLoadingDiv_Glass", state="hidden", timeout=timeout)
+        page.wait_for_function(_JS_NO_CALLBACK, polling=100, timeout=timeout)
+    except Exception:
+        pass
+    return True
+
+# ==== KODE OBAT COMBO CACHE ====
+class ComboCache:
+    """
+    Persistent LRU of apol_id → the combo entry it resolved to last time
+    ({"value": ..., "text": ...}), so repeat drugs skip the server lookup.
+    Stored as JSON in STATE_DIR; entries are dropped via invalidate() when a
+    cached selection fails its check.
+    """
+
+    def __init__(self, path=None, capacity=2000):
+        self.path = path or os.path.join(STATE_DIR, "obat_combo_cache.json")
+        self.capacity = capacity
+        self.stats = {"hits": 0, "misses": 0, "invalidated": 0, "evicted": 0}
+        self._entries = OrderedDict()
+        self._dirty = False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kode):
+        entry = self._entries.get(kode)
+        if entry is None:
+            self.stats["misses"] += 1
+            metrics.count("combo_cache.miss")
+            return None
+        self._entries.move_to_end(kode)
+        self.stats["hits"] += 1
+        metrics.count("combo_cache.hit")
+        return entry
+
+    def put(self, kode, entry):
+        if not entry or not entry.get("text"):
+            return
+        self._entries[kode] = {"value": entry.get("value", ""), "text": entry["text"]}
+        self._entries.move_to_end(kode)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.stats["evicted"] += 1
+        self._dirty = True
+
+    def invalidate(self, kode):
+        if self._entries.pop(kode, None) is not None:
+            self.stats["invalidated"] += 1
+            metrics.count("combo_cache.invalidated")
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def close(self):
+        self.save()
+
+# Current combo entry: value from the DevExpress control (or its hidden _VI input) and the shown text.
+_JS_READ_COMBO = """(inputSel) => {
+    const input = document.querySelector(inputSel);
+    if (!input) return null;
+    let value = null;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => {
+            if (c.GetInputElement && c.GetInputElement() === input && c.GetValue) value = c.GetValue();
+        });
+    } catch (e) {}
+    if (value === null || value === undefined) {
+        const vi = document.getElementById(input.id.replace(/_I$/, '_VI'));
+        value = vi ? vi.value : '';
+    }
+    return { value: String(value), text: (input.value || '').trim() };
+}"""
+
+# Select a cached entry through the combo itself (no filter callback) and let the
+# page's own SelectedIndexChanged handling fill the rest of the row. The harga
+# field is cleared first so the check below only passes on a fresh value.
+_JS_APPLY_COMBO = """([inputSel, hargaSel, value, text]) => {
+    const input = document.querySelector(inputSel);
+    if (!input) return false;
+    let combo = null;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => {
+            if (c.GetInputElement && c.GetInputElement() === input) combo = c;
+        });
+    } catch (e) {}
+    if (!combo || !combo.SetValue) return false;
+    const harga = document.querySelector(hargaSel);
+    if (harga) harga.value = '';
+    if (combo.FindItemByValue && !combo.FindItemByValue(value) && combo.AddItem) combo.AddItem(text, value);
+    combo.SetValue(value);
+    if (combo.RaiseSelectedIndexChanged) combo.RaiseSelectedIndexChanged(true);
+    return true;
+}"""
+
+# Cached entry took: the combo holds `value` as its selected item, no callback in
+# flight, and the server filled the harga field for it.
+_JS_CACHED_APPLIED = """([inputSel, hargaSel, value]) => {
+    const input = document.querySelector(inputSel);
+    let busy = false, combo = null;
+    try {
+        ASPxClientControl.GetControlCollection().ForEachControl(c => {
+            if (c.InCallback && c.InCallback()) busy = true;
+            if (c.GetInputElement && c.GetInputElement() === input) combo = c;
+        });
+    } catch (e) {}
+    if (busy || !combo || combo.GetSelectedIndex() < 0 || String(combo.GetValue()) !== value) return false;
+    const harga = document.querySelector(hargaSel);
+    return !!harga && (harga.value || '').trim() !== '';
+}"""
+
+def read_combo_entry(page):
+    try:
+        return page.evaluate(_JS_READ_COMBO, SELECTORS["kode_obat"])
+    except Exception:
+        return None
+
+def select_obat_cached(page, kode, entry):
+    """
+    Select a cached entry in the combo, then require the combo to report that
+    value as selected and the harga field to be filled by the server, on top of
+    the fast path's selection check. Returns (ok, value).
+    """
+    sel, harga, value = SELECTORS["kode_obat"], SELECTORS["harga_obat"], entry.get("value", "")
+    if not value:
+        return False, read_kode_input_value(page)
+    try:
+        if not page.evaluate(_JS_APPLY_COMBO, [sel, harga, value, entry["text"]]):
+            return False, read_kode_input_value(page)
+        page.wait_for_function(_JS_CACHED_APPLIED, arg=[sel, harga, value], polling="raf", timeout=3000)
+        page.wait_for_function(_JS_KODE_SELECTED, arg=[sel, LISTBOX_SELECTOR, kode], polling="raf", timeout=1500)
+    except Exception:
+        return False, read_kode_input_value(page)
+    return True, read_kode_input_value(page)
+
+# Statuses that mean a resep / obat row was already handled.
+PROCESSED_STATUSES = DONE_STATUSES
+
+# Columns read from each sheet (read_columns) — the rest is never looked at.
+RESEP_COLUMNS = ("status", "receipt_num", "sep_num")
+OBAT_COLUMNS = ("receipt_num", "apol_id", "qty", "status")
+
+class ObatIndex:
+    """
+    In-memory index over 'daftar obat', built from ONE sheet read:
+      by_receipt: normalized receipt_num → [pending obat records]
+      row_map:    (normalized receipt_num, normalized apol_id) → row number
+    Each record is an ObatRecord, normalised once when the sheet is read.
+    mark() updates statuses in place so later lookups stay correct.
+    """
+
+    def __init__(self):
+        self.by_receipt = {}
+        self.row_map = {}
+        self.by_row = {}
+
+    def add(self, record: ObatRecord):
+        if not record.resep_key or not record.kode_key or record.done:
+            return
+        self.by_row[record.row] = record
+        self.by_receipt.setdefault(record.resep_key, []).append(record)
+        self.row_map[(record.resep_key, record.kode_key)] = record.row
+
+    def pending_for(self, receipt_num) -> list[ObatRecord]:
+        """Pending obat records for a resep, O(1)."""
+        return list(self.by_receipt.get(normalize_key(receipt_num), ()))
+
+    def row_for(self, receipt_num, apol_id):
+        return self.row_map.get((normalize_key(receipt_num), normalize_key(apol_id)))
+
+    def mark(self, row: int, status: str):
+        """Record a new status for a sheet row; processed rows leave the pending lists."""
+        record = self.by_row.get(row)
+        if record is None:
+            return
+        record.status = status_of(status)
+        if not record.done:
+            return
+        del self.by_row[row]
+        pending = self.by_receipt.get(record.resep_key, [])
+        pending[:] = [r for r in pending if r is not record]
+        if not pending:
+            self.by_receipt.pop(record.resep_key, None)
+        key = (record.resep_key, record.kode_key)
+        if self.row_map.get(key) == row:
+            del self.row_map[key]
+
+    def __len__(self):
+        return len(self.by_row)
+
+def load_obat_index(ws_obat, values=None) -> ObatIndex:
+    """
+    Read the OBAT_COLUMNS of 'daftar obat' once (or use pre-read `values`
+    shaped like get_all_values()) and index its pending rows by receipt number.
+    """
+    index = ObatIndex()
+    if values is None:
+        try:
+            cols = read_columns(ws_obat, OBAT_COLUMNS)
+        except ValueError as e:
+            print(f"⚠️ Header mismatch. {e}")
+            return index
+        for row_num, *row in cols.tuples(*OBAT_COLUMNS):
+            index.add(ObatRecord(row_num, *row))
+        print(f"📊 Loaded {len(index)} pending obat rows into index ({len(index.by_receipt)} resep).")
+        return index
     if not values:
-        return {}
+        return index
 
     headers = [h.strip().lower() for h in values[0]]
-    try:
-        receipt_idx = headers.index("receipt_num")
-        apol_idx = headers.index("apol_id")
-        status_idx = headers.index("status")
-    except ValueError:
+    if not {"receipt_num", "apol_id", "status"} <= set(headers):
         print(f"⚠️ Header mismatch. Headers found: {headers}")
-        return {}
+        return index
 
-    mapping = {}
+    # position of each OBAT_COLUMNS field (qty may be absent)
+    positions = [headers.index(c) if c in headers else None for c in OBAT_COLUMNS]
     for row_num, row in enumerate(values[1:], start=2):
-        if len(row) <= max(receipt_idx, apol_idx):
-            continue
-
-        # Normalize keys: strip(), lowercase, and remove leading zeros
-        no_resep = str(row[receipt_idx]).strip().replace("'", "").lstrip("0").lower()
-        kode_obat = str(row[apol_idx]).strip().replace("'", "").lstrip("0").lower()
-        status = str(row[status_idx]).strip().lower() if len(row) > status_idx else ""
+        width = len(row)
+        index.add(ObatRecord(row_num, *(row[p] if p is not None and p < width else "" for p in positions)))
 
-        if no_resep and kode_obat and status not in ("normal","done", "error", "not_found", "checked","null"):
-            mapping[(no_resep, kode_obat)] = row_num
+    print(f"📊 Loaded {len(index)} pending obat rows into index ({len(index.by_receipt)} resep).")
+    return index
 
-    print(f"📊 Loaded {len(mapping)} obat rows into cache.")
-    return mapping
+def build_obat_row_map(ws_obat, values=None):
+    """Build a mapping (receipt_num, apol_id) → row number for quick lookup."""
+    return load_obat_index(ws_obat, values=values).row_map
 
 # ==== MAIN ====
-def auto_input():
+def auto_input(use_store: bool = False, fast: bool = True, use_cache: bool = False, stay_on_grid: bool = True,
+               resume: bool = True):
+    """
+    Input every pending obat of every pending resep.
+    fast=True selects kode obat with condition waits (select_obat_fast) and
+    falls back to the legacy typed/sleep path per obat when it does not settle.
+    use_cache=True first tries the combo entry cached for the code (ComboCache);
+    opt-in until the cached selection is confirmed to trigger the harga lookup
+    on the live form.
+    stay_on_grid=True reuses the loaded DaftarResep grid (open_daftar_resep);
+    False navigates to it and waits for networkidle for every resep.
+    resume=True starts where an interrupted run stopped (checkpoint.Checkpoint);
+    obat of the resep it had in flight are checked on the ObatInput grid first.
+    """
     ws_resep, ws_obat = open_sheet()
-    resep_records = ws_resep.get_all_records()
-    obat_records = ws_obat.get_all_records()
-    obat_row_map = build_obat_row_map(ws_obat)
+    checkpoint = Checkpoint("auto_input_v2", scope=ws_resep.title)
+    if not resume:
+        checkpoint.clear()
+    start = max(2, checkpoint.resume_from() or 2)  # row 1 is the header
+    if start > 2 or checkpoint.in_flight:
+        print(f"♻️  Resuming from resep row {start}.")
+    if use_store:
+        # Local SQLite mirror: incremental pull instead of full-sheet reads every run
+        store = StateStore()
+        with metrics.timer("sheets.read"):
+            store.pull(ws_resep)
+            store.pull(ws_obat)
+        resep_rows = [
+            ResepRecord.from_dict(r, row=i)
+            for i, r in enumerate(store.records(ws_resep, numericise=True)[start - 2:], start=start)
+        ]
+        obat_index = load_obat_index(ws_obat, values=store.values(ws_obat))
+    else:
+        # only the columns the loop uses, from the resume row on
+        cols = read_columns(ws_resep, RESEP_COLUMNS, after_row=start - 1)
+        resep_rows = [ResepRecord(i, no_resep, no_sep, status)
+                      for i, status, no_resep, no_sep in cols.tuples(*RESEP_COLUMNS)]
+        obat_index = load_obat_index(ws_obat)
     browser, page = attach_browser()
+    page_loads = PageLoads(page)
+    loads_per_resep = []
+
+    # Background coalescing writer for every sheet update (see queue_* helpers)
+    writer = CoalescingWriter()
+    writer.replay_journal(ws_resep, ws_obat)  # cells an earlier run gave up on
+
+    # A resep row leaves the checkpoint only once the writer confirms its status
+    # reached the sheet; batches go out in queue order, so its obat results were
+    # sent before it. A row with a given-up obat write stays in flight and is
+    # checked on the obat grid again on resume.
+    unsaved = set()
+
+    def obat_written(i):
+        return lambda ok: ok or unsaved.add(i)
+
+    def resep_written(i):
+        return lambda ok: checkpoint.done(i) if ok and i not in unsaved else None
+
+    combo_cache = ComboCache() if use_cache else None
+    for resep in resep_rows:
+        i, no_resep, no_sep = resep.row, resep.receipt_num, resep.sep_num
+        if resep.done:
+            if i in checkpoint.in_flight:
+                checkpoint.done(i)  # finished before the interruption
+            continue
 
-    # ThreadPoolExecutor reused for ordered background writes (we wait on each)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        for i, resep in enumerate(resep_records, start=2):
-            status = str(resep.get("status", "")).strip().lower()
-            if status in ("normal","done", "error", "not_found", "checked","null"):
-                continue
+        if not no_resep:
+            print(f"⚠️ Row {i} missing resep number.")
+            continue
 
-            no_resep = str(resep.get("receipt_num", "")).strip()
-            no_sep = str(resep.get("sep_num", "")).strip()
-            if not no_resep:
-                print(f"⚠️ Row {i} missing resep number.")
-                continue
+        print(f"\n🔎 Processing resep {no_resep} (SEP={no_sep})")
+        resep_started = time.perf_counter()
 
-            print(f"\n🔎 Processing resep {no_resep} (SEP={no_sep})")
-
-            related_obats = [
-                o for o in obat_records
-                if str(o.get("receipt_num", "")).strip() == no_resep
-                and str(o.get("status", "")).strip().lower() not in ("normal","done", "error", "not_found", "checked","null")
-            ]
-            print(f"  📝 Found {len(related_obats)} pending obat for this resep.")
-            if not related_obats:
-                safe_update_cell(ws_resep, f"G{i}", "null")
-                print(f"✅ Resep {no_resep} marked done (no pending obat).")
-                continue
+        related_obats = obat_index.pending_for(no_resep)
+        print(f"  📝 Found {len(related_obats)} pending obat for this resep.")
+        if not related_obats:
+            checkpoint.begin(i, "status", receipt_num=no_resep)
+            queue_resep_status(writer, ws_resep, i, "null", on_written=resep_written(i))
+            print(f"✅ Resep {no_resep} marked done (no pending obat).")
+            continue
 
-            page.goto(BASE_URL + "DaftarResep.aspx")
-            page.wait_for_load_state("networkidle")
-            page.fill(SELECTORS["resep_filter"], no_resep)
-            page.keyboard.press("Enter")
+        # A resep left in flight may have obat saved whose sheet update was lost
+        interrupted = checkpoint.in_flight.get(i)
+        if interrupted:
+            print(f"♻️  Resep {no_resep} was interrupted in phase '{interrupted.get('phase')}' — checking the obat grid first.")
+        checkpoint.begin(i, "navigate", receipt_num=no_resep)
+
+        loads_before = page_loads.count
+        with metrics.timer("nav.daftar_resep"):
+            how = open_daftar_resep(page, stay_on_grid)
+        metrics.count(f"nav.grid_{how}")
+
+        with metrics.timer("nav.filter"):
+            found = filter_resep(page, no_resep)
+            if not found and how != "goto":
+                # A reused grid can hold stale state; confirm on a freshly loaded one
+                print(f"  ↻ Resep {no_resep} not shown on the reused grid — reloading Daftar Resep.")
+                open_daftar_resep(page, stay_on_grid, fresh=True)
+                found = filter_resep(page, no_resep)
+        if not found:
+            print(f"❌ Resep {no_resep} not found in table.")
+            queue_resep_status(writer, ws_resep, i, "not_found", on_written=resep_written(i))
+            continue
 
-            try:
-                page.wait_for_selector(f"text={no_resep}", timeout=15000)
-            except Exception:
-                print(f"❌ Resep {no_resep} not found in table.")
-                safe_update_cell(ws_resep, f"G{i}", "not_found")
-                continue
+        print("🕐 Clicking Input Obat button…")
+        # Re-locate the button (old handles may be detached)
+        buttons = page.query_selector_all(SELECTORS["btn_input_obat"])
+        if not buttons:
+            print(f"❌ No Input Obat button found for resep {no_resep}")
+            checkpoint.done(i)
+            continue
 
-            print("🕐 Clicking Input Obat button…")
-            # Wait until grid finishes loading before clicking
-            try:
-                # Wait for overlay to appear and then disappear
-                page.wait_for_selector("div.dxgvLoadingDiv_Glass", state="visible", timeout=5000)
-                page.wait_for_selector("div.dxgvLoadingDiv_Glass", state="hidden", timeout=15000)
-            except:
-                # Overlay might not appear at all (already loaded)
-                pass
-
-            # Re-locate the button (old handles may be detached)
-            buttons = page.query_selector_all(SELECTORS["btn_input_obat"])
-            if not buttons:
-                print(f"❌ No Input Obat button found for resep {no_resep}")
-                continue
+        # Now click safely
+        buttons[0].click()
 
-            # Now click safely
-            buttons[0].click()
+        # ⏳ Wait until redirected to ObatInput.aspx and its kode obat combo is usable
+        try:
+            with metrics.timer("nav.obat_input"):
+                if stay_on_grid:
+                    page.wait_for_url("**/" + OBAT_INPUT_PAGE, wait_until="domcontentloaded", timeout=30000)
+                    wait_page_ready(page, SELECTORS["kode_obat"])
+                else:
+                    page.wait_for_url("**/" + OBAT_INPUT_PAGE, timeout=30000)
+                    page.wait_for_load_state("networkidle")
+            print("✅ ObatInput.aspx ready.")
+        except Exception:
+            print("⚠️ Timeout waiting for ObatInput.aspx, continue anyway.")
+
+        # Track if any obat for this resep produced an error
+        resep_has_error = False
+
+        for obat in related_obats:
+            kode = obat.apol_id
+            qty = obat.qty or "1"
+            if not kode:
+                continue
 
-            # ⏳ Wait until redirected to ObatInput.aspx (instead of fixed sleep)
-            try:
-                page.wait_for_url("**/ObatInput.aspx", timeout=30000)
-                page.wait_for_load_state("networkidle")
-                print("✅ ObatInput.aspx fully loaded.")
-            except Exception:
-                print("⚠️ Timeout waiting for ObatInput.aspx, continue anyway.")
-
-            # Track if any obat for this resep produced an error
-            resep_has_error = False
-
-            for obat in related_obats:
-                kode = str(obat.get("apol_id", "")).strip()
-                qty = str(obat.get("qty", "")).strip() or "1"
-                if not kode:
-                    continue
-
-                print(f"  💊 Inputting {kode} x{qty} …")
-
-                # --- robust autocomplete selection (replacement) ---
-                LISTBOX_SELECTOR = "table[id$='CboKdObatNR_DDD_L_LBT']"
-                FIRST_ITEM_ROW = "table[id$='CboKdObatNR_DDD_L_LBT'] tr.dxeListBoxItemRow_Glass"
-                FIRST_ITEM_KD_CELL = "table[id$='CboKdObatNR_DDD_L_LBT'] td[id$='_LBI0T0']"
-
-                def read_kode_input_value():
-                    try:
-                        return page.eval_on_selector(SELECTORS["kode_obat"], "el => el.value").strip()
-                    except Exception:
-                        return ""
-
-                # type to trigger autocomplete
-                page.fill(SELECTORS["kode_obat"], "")
-                time.sleep(0.12)
-                page.click(SELECTORS["kode_obat"])
-                page.type(SELECTORS["kode_obat"], kode, delay=50)
-
-                # wait for the listbox to appear and try to click first item
-                try:
-                    page.wait_for_selector(LISTBOX_SELECTOR, timeout=6000)
-                    try:
-                        page.click(FIRST_ITEM_KD_CELL, timeout=3000)
-                    except Exception:
-                        try:
-                            page.click(FIRST_ITEM_ROW, timeout=3000)
-                        except Exception:
-                            page.keyboard.press("ArrowDown")
-                            time.sleep(0.18)
-                            page.keyboard.press("Enter")
-                except Exception:
-                    # listbox never showed — fallback to ArrowDown/Enter
-                    time.sleep(0.9)
-                    page.keyboard.press("ArrowDown")
-                    time.sleep(0.18)
-                    page.keyboard.press("Enter")
-
-                # short pause to let widget propagate selection to fields
-                time.sleep(0.5)
-
-                # verify selection
-                selected_val = read_kode_input_value()
-                if selected_val and (kode in selected_val or selected_val in kode):
-                    ui_ok = True
+            row = obat.row
+            if interrupted and obat_on_grid(page, kode):
+                print(f"  ♻️  {kode} is already on the obat grid — not saving it again.")
+                status_result = queue_obat_result(writer, ws_obat, row, "Obat berhasil disimpan (found on the grid after restart)",
+                                                  kode, on_written=obat_written(i))
+                obat_index.mark(row, status_result)
+                continue
+            checkpoint.phase(i, "select", obat_row=row, kode=kode)
+
+            print(f"  💊 Inputting {kode} x{qty} …")
+
+            # --- autocomplete selection: cached entry, fast path, legacy path as fallback ---
+            obat_started = time.perf_counter()
+            path, ui_ok, selected_val = "legacy", False, ""
+            cached = combo_cache.get(kode) if combo_cache is not None else None
+            if cached:
+                with metrics.timer("autocomplete.cached"):
+                    ui_ok, selected_val = select_obat_cached(page, kode, cached)
+                if ui_ok:
+                    path = "cached"
                 else:
-                    try:
-                        found = page.query_selector(f"xpath=//table[contains(@id,'TabPageObat')]//td[contains(., '{kode}')]")
-                        ui_ok = bool(found)
-                    except:
-                        ui_ok = False
-
-                if not ui_ok:
-                    print(f"⚠️ Autocomplete selection for {kode} may have failed — selected_val='{selected_val}'. Will attempt one retry.")
-                    # single retry
-                    page.fill(SELECTORS["kode_obat"], "")
-                    time.sleep(0.12)
-                    page.click(SELECTORS["kode_obat"])
-                    page.type(SELECTORS["kode_obat"], kode, delay=80)
-                    try:
-                        page.wait_for_selector(LISTBOX_SELECTOR, timeout=5000)
-                        page.click(FIRST_ITEM_KD_CELL)
-                    except:
-                        page.keyboard.press("ArrowDown")
-                        page.keyboard.press("Enter")
-                    time.sleep(0.6)
-                    selected_val = read_kode_input_value()
-                    ui_ok = (selected_val and (kode in selected_val or selected_val in kode))
-
-                if not ui_ok:
-                    print(f"❌ Failed to reliably select kode {kode}. Selected value after retry: '{selected_val}'. Skipping this obat for now.")
-                    # Mark as error in sheet optionally (we skip for now)
-                    resep_has_error = True
-                    continue
-
-                # proceed to fill qty & save as before
-                time.sleep(0.2)
-                page.fill(SELECTORS["qty_obat"], qty)
-                page.click(SELECTORS["btn_simpan"])
-
-                message = handle_dialog(page)
-                print(f"💬 {message or 'No alert dialog detected.'}")
-
-                # Update Google Sheet immediately (run in thread but wait here to preserve ordering)
-                row = obat_row_map.get((no_resep, kode))
-
-                if not row:
-                    print(f"DEBUG: lookup key=({no_resep}, {kode})")
-                    print("DEBUG: available keys (sample):", list(obat_row_map.keys())[:5])
-
-                if row:
-                    # Submit to thread executor and wait for completion before moving on
-                    future = executor.submit(write_row_sync, ws_obat, row, message or "", kode)
-                    try:
-                        status_result = future.result(timeout=120)  # wait for write to finish
-                        if status_result == "done":
-                            print(f"  ✅ Completed write for row {row} (obat {kode})")
-                        else:
-                            print(f"  ⚠️ Write returned status '{status_result}' for row {row} (obat {kode})")
-                            resep_has_error = True
-                    except concurrent.futures.TimeoutError:
-                        print(f"❌ Timeout while writing row {row} to sheet.")
-                        resep_has_error = True
+                    combo_cache.invalidate(kode)
+                    print(f"  ↩️  Cached entry for {kode} did not check out (value='{selected_val}') — dropped, looking it up.")
+            if not ui_ok and fast:
+                with metrics.timer("autocomplete.fast"):
+                    ui_ok, selected_val = select_obat_fast(page, kode)
+                if ui_ok:
+                    path = "fast"
                 else:
-                    print(f"⚠️ Could not find row for resep {no_resep}, obat {kode}")
-                    resep_has_error = True
+                    metrics.count("autocomplete.fast_fallback")
+                    print(f"  ↩️  Fast selection for {kode} did not settle (value='{selected_val}') — using the legacy path.")
+            if not ui_ok:
+                with metrics.timer("autocomplete.legacy"):
+                    ui_ok, selected_val = select_obat_legacy(page, kode)
+
+            if not ui_ok:
+                metrics.count("autocomplete.failed")
+                print(f"❌ Failed to reliably select kode {kode}. Selected value after retry: '{selected_val}'. Skipping this obat for now.")
+                # Mark as error in sheet optionally (we skip for now)
+                resep_has_error = True
+                continue
+            if combo_cache is not None and path != "cached":
+                combo_cache.put(kode, read_combo_entry(page))
 
+            # proceed to fill qty & save as before
+            if path == "legacy":
+                time.sleep(0.2)
+            page.fill(SELECTORS["qty_obat"], qty)
+            checkpoint.phase(i, "save", obat_row=row, kode=kode)
+            page.click(SELECTORS["btn_simpan"])
+
+            message = handle_dialog(page)
+            print(f"💬 {message or 'No alert dialog detected.'}")
+
+            # Queue the sheet update; the background writer batches it, we don't wait
+            status_result = queue_obat_result(writer, ws_obat, row, message or "", kode, on_written=obat_written(i))
+            obat_index.mark(row, status_result)
+            if status_result != "done":
+                resep_has_error = True
+                if path == "cached":
+                    combo_cache.invalidate(kode)  # don't trust an entry that ended in a rejected save
+
+            if fast:
+                wait_form_idle(page)
+            else:
                 time.sleep(1)
-
-            # After processing all obat for this resep, set resep status depending on any obat errors
-            final_status = "error" if resep_has_error else "done"
-            safe_update_cell(ws_resep, f"G{i}", final_status)
-            print(f"✅ Resep {no_resep} completed. Final status: {final_status.upper()}")
+            metrics.observe(f"obat.{path}", time.perf_counter() - obat_started)
+            metrics.observe("obat.total", time.perf_counter() - obat_started)
+
+        # After processing all obat for this resep, set resep status depending on any obat errors
+        final_status = "error" if resep_has_error else "done"
+        queue_resep_status(writer, ws_resep, i, final_status, on_written=resep_written(i))
+        print(f"✅ Resep {no_resep} completed. Final status: {final_status.upper()}")
+        metrics.observe("resep.total", time.perf_counter() - resep_started)
+        loads_per_resep.append(page_loads.count - loads_before)
+        if not stay_on_grid:
             time.sleep(2.5)
 
-    browser.close()
+    for path in ("cached", "fast", "legacy"):
+        n = metrics.stats(f"obat.{path}")[0]
+        if n:
+            per_obat = metrics.samples(f"obat.{path}")
+            print(f"⏱  {path} selection: {n} obat, median {metrics.percentile(per_obat, 50):.2f}s per obat")
+
+    if loads_per_resep:
+        print(f"📄 Page loads: {page_loads.count} total, {sum(loads_per_resep) / len(loads_per_resep):.2f} per resep "
+              f"({'grid reused' if stay_on_grid else 'goto per resep'})")
+
+    if combo_cache is not None:
+        combo_cache.close()
+        cs = combo_cache.stats
+        print(f"📊 Combo cache: {cs['hits']} hits, {cs['misses']} misses, {cs['invalidated']} invalidated, "
+              f"{len(combo_cache)} entries in {combo_cache.path}")
+
+    print("⏳ Flushing queued sheet writes…")
+    try:
+        writer.close()  # raises if cells had to be given up (they are in writer.journal_path)
+    finally:
+        st = writer.stats
+        print(f"📊 Sheet writes: {st['cells']} cells in {st['batches']} batch calls "
+              f"({st['coalesced']} coalesced, {st['retries']} retries, {st['failed']} failed).")
+        cdp_broker.disconnect_sync(CDP_ENDPOINT)
+    checkpoint.clear()  # every status is on the sheet
     print("🏁 All resep processed safely and completely.")
 
 if __name__ == "__main__":
     if input("Enter sheet name for resep (or leave blank for default 'daftar resep'): ").strip():
         SHEET_RESEP = input("Sheet Name for Resep (e.g. daftar resep): ").strip()
-    auto_input()
+    use_store = input("Use local state store for pending rows? (y/N): ").strip().lower() == "y"
+    fast = input("Fast autocomplete selection? (Y/n): ").strip().lower() != "n"
+    use_cache = input("Use cached kode obat selections? (y/N): ").strip().lower() == "y"
+    stay_on_grid = input("Reuse the Daftar Resep grid between resep? (Y/n): ").strip().lower() != "n"
+    resume = input("Resume an interrupted run from its checkpoint? (Y/n): ").strip().lower() != "n"
+    metrics.configure("auto_input_v2")
+    auto_input(use_store=use_store, fast=fast, use_cache=use_cache, stay_on_grid=stay_on_grid, resume=resume)
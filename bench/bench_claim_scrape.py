@@ -0,0 +1,68 @@
+# bench_claim_scrape.py
+#
+# Compare per-row vs bulk scraping of the SIRS claim table against the saved
+# fixture page. Runs on a local headless Chromium, no SIRS login needed:
+#
+#   python -m bench.bench_claim_scrape --rows 400
+
+import argparse
+import asyncio
+import pathlib
+import time
+from playwright.async_api import async_playwright
+import sirs_runner
+
+FIXTURE = pathlib.Path(__file__).parent / "fixtures" / "sirs_claims.html"
+
+# Clone the fixture rows until the table holds `n` rows (keeps the saved file small).
+_JS_GROW_TABLE = """(n) => {
+    const tbody = document.querySelector('div#dv_content table.tblcontrast tbody');
+    const seed = Array.from(tbody.rows);
+    for (let i = tbody.rows.length; i < n; i++) {
+        const tr = seed[i % seed.length].cloneNode(true);
+        tr.cells[0].innerText = String(i + 1);
+        tr.cells[3].innerText = tr.cells[3].innerText.slice(0, -6) + String(i).padStart(6, '0');
+        tbody.appendChild(tr);
+    }
+}"""
+
+
+async def _time_mode(mode: str, repeat: int) -> tuple[float, list]:
+    best, records = None, []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        records = await sirs_runner.get_claim_records(mode=mode)
+        took = time.perf_counter() - t0
+        best = took if best is None else min(best, took)
+    return best, records
+
+
+async def main(rows: int, repeat: int):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        page = await browser.new_page()
+        await page.set_content(FIXTURE.read_text(encoding="utf-8"))
+        await page.evaluate(_JS_GROW_TABLE, rows)
+        sirs_runner._page = page
+
+        results = {}
+        for mode in ("rows", "bulk", "html"):
+            results[mode] = await _time_mode(mode, repeat)
+
+        baseline = results["rows"][1]
+        mismatched = [mode for mode, (_, records) in results.items() if records != baseline]
+        print(f"Claim table scrape, {rows} rows (best of {repeat}):")
+        for mode, (took, records) in results.items():
+            same = "MISMATCH" if mode in mismatched else "ok"
+            print(f"  {mode:<5} {took * 1000:9.1f} ms  {len(records) / took:9.0f} rows/s  [{same}]")
+        await browser.close()
+    if mismatched:
+        raise SystemExit(f"scrape modes {', '.join(mismatched)} differ from the per-row output")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=400)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    asyncio.run(main(args.rows, args.repeat))
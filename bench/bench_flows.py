@@ -0,0 +1,199 @@
+# bench_flows.py
+#
+# End-to-end throughput of the three runner flows on a plain Linux box:
+# a headless Chromium with a CDP port, the local page stand-ins from
+# bench/fake_sites.py and in-memory worksheets from bench/fake_sheets.py.
+# Nothing touches the BPJS site, SIRS or Google Sheets.
+#
+#   python -m bench.bench_flows --flows submit,auto_input,extract --rows 30 --workers 3
+#   python -m bench.bench_flows --flows submit --latency 0.8 --error-every 5 --sheets-latency 0.3
+
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.request
+from contextlib import contextmanager
+import metrics
+from config import WORKSHEET_NAME
+from bench.fake_sheets import FakeSpreadsheet
+from bench.fake_sites import start_fake_sites
+
+# Real sep_web_driver layout (A→K); config.SEP_SHEET_HEADERS predates the claim columns.
+SEP_HEADERS   = ["sep_dttm", "mrn", "sep_num", "receipt_num", "receipt_type", "processing_by",
+                 "processing_started", "submission_id", "updated_dttm", "status", "note"]
+RESEP_HEADERS = ["dttm", "mrn", "sep_num", "receipt_num", "receipt_type", "updated_dttm", "status"]
+OBAT_HEADERS  = ["dttm", "sep_num", "receipt_num", "apol_id", "nama_obat", "qty", "harga", "status", "message"]
+
+
+@contextmanager
+def cdp_chrome(port: int):
+    """Headless Chromium (Playwright's build) listening for CDP on 127.0.0.1:port."""
+    from playwright.sync_api import sync_playwright
+    with sync_playwright() as p:
+        exe = p.chromium.executable_path
+    profile = tempfile.mkdtemp(prefix="bench-chrome-")
+    args = [exe, "--headless=new", f"--remote-debugging-port={port}", f"--user-data-dir={profile}",
+            "--no-first-run", "--no-default-browser-check", "about:blank"]
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        args.insert(1, "--no-sandbox")
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    endpoint = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                urllib.request.urlopen(endpoint + "/json/version", timeout=1).read()
+                break
+            except OSError:
+                if time.monotonic() > deadline or proc.poll() is not None:
+                    raise RuntimeError(f"Chromium did not open CDP port {port}")
+                time.sleep(0.2)
+        yield endpoint
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(profile, ignore_errors=True)
+
+
+@contextmanager
+def patched(*patches):
+    """Temporarily point module attributes (URLs, sheet openers, CDP endpoint) at the fakes."""
+    saved = [(mod, name, getattr(mod, name)) for mod, name, _ in patches]
+    for mod, name, value in patches:
+        setattr(mod, name, value)
+    try:
+        yield
+    finally:
+        for mod, name, value in saved:
+            setattr(mod, name, value)
+
+
+def _sep(n: int) -> str:
+    return f"0179R0270425V{n:06d}"
+
+
+def bench_submit(base_url, cdp, args) -> tuple[int, float, dict]:
+    import apotek_runner
+    import submit_main
+
+    ss = FakeSpreadsheet(latency=args.sheets_latency)
+    ws = ss.add_worksheet(WORKSHEET_NAME, [SEP_HEADERS] + [
+        ["2025-04-29 10:47", f"{n:08d}", _sep(n), f"{10000 + n}", "Obat Kronis Blm Stabil"]
+        for n in range(args.rows)
+    ])
+    with patched(
+        (submit_main, "get_worksheet", lambda name: ws),
+        (submit_main, "init_apotek", lambda: apotek_runner.init_apotek(cdp)),
+        (submit_main, "open_apotek_tab", lambda: apotek_runner.open_apotek_tab(cdp)),
+        (apotek_runner, "APOTEK_URL", base_url + "/apotek/RspMsk1.aspx"),
+    ):
+        t0 = time.perf_counter()
+        submit_main.main(workers=args.workers, buffer_rows=args.buffer_rows, lease_block=args.lease_block)
+        elapsed = time.perf_counter() - t0
+    stats = dict(ss.stats)
+    done = sum(1 for row in ws.get_all_values()[1:] if row[9])
+    return done, elapsed, stats
+
+
+def bench_auto_input(base_url, cdp, args) -> tuple[int, float, dict]:
+    import auto_input_v2
+
+    ss = FakeSpreadsheet(latency=args.sheets_latency)
+    ws_resep = ss.add_worksheet(auto_input_v2.SHEET_RESEP, [RESEP_HEADERS] + [
+        ["2025-04-29 10:47", f"{n:08d}", _sep(n), f"{20000 + n}", "Obat Kronis Blm Stabil"]
+        for n in range(args.resep)
+    ])
+    ws_obat = ss.add_worksheet(auto_input_v2.SHEET_OBAT, [OBAT_HEADERS] + [
+        ["2025-04-29 10:47", _sep(n), f"{20000 + n}", f"{1000 + n * 10 + k}", f"OBAT {k}", "30", ""]
+        for n in range(args.resep) for k in range(args.obat)
+    ])
+    cache_path = os.path.join(tempfile.mkdtemp(prefix="bench-combo-"), "obat_combo_cache.json")
+    ComboCache = auto_input_v2.ComboCache
+    with patched(
+        (auto_input_v2, "ComboCache", lambda: ComboCache(path=cache_path)),  # keep the real cache untouched
+        (auto_input_v2, "open_sheet", lambda: (ws_resep, ws_obat)),
+        (auto_input_v2, "CDP_ENDPOINT", cdp),
+        (auto_input_v2, "BASE_URL", base_url + "/apotek/"),
+    ):
+        t0 = time.perf_counter()
+        auto_input_v2.auto_input(fast=not args.legacy_autocomplete, use_cache=args.combo_cache,
+                                 stay_on_grid=not args.navigate_per_resep)
+        elapsed = time.perf_counter() - t0
+    stats = dict(ss.stats)
+    done = sum(1 for row in ws_obat.get_all_values()[1:] if row[7])
+    return done, elapsed, stats
+
+
+def bench_extract(base_url, cdp, args) -> tuple[int, float, dict]:
+    import extract_main
+    import sirs_runner
+
+    ss = FakeSpreadsheet(latency=args.sheets_latency)
+    ws = ss.add_worksheet(WORKSHEET_NAME, [SEP_HEADERS])
+    with patched(
+        (extract_main, "get_worksheet", lambda name: ws),
+        (extract_main, "set_playwright_context", lambda p: sirs_runner.set_playwright_context(p, cdp)),
+        (sirs_runner, "SIRS_APP_URL", base_url + "/sirs/index.php"),
+    ):
+        t0 = time.perf_counter()
+        asyncio.run(extract_main.main(1, args.days, "April", pipelined=not args.sequential))
+        elapsed = time.perf_counter() - t0
+    stats = dict(ss.stats)
+    return len(ws.get_all_values()) - 1, elapsed, stats
+
+
+FLOWS = {"extract": bench_extract, "submit": bench_submit, "auto_input": bench_auto_input}
+
+
+def main(args):
+    server = start_fake_sites(latency=args.latency, save_latency=args.save_latency,
+                              page_latency=args.page_latency, process_time=args.process_time,
+                              error_every=args.error_every, rows_per_day=args.rows_per_day)
+    results = {}
+    # extract first: it runs its own asyncio loop, auto_input_v2 leaves a sync Playwright running
+    for name in [f for f in FLOWS if f in args.flows]:
+        with cdp_chrome(args.cdp_port) as cdp:
+            print(f"\n=== {name} ===")
+            results[name] = FLOWS[name](server.base_url, cdp, args)
+    server.shutdown()
+
+    print(f"\nlatency {args.latency:.2f}s, save {args.save_latency:.2f}s, page {args.page_latency:.2f}s, "
+          f"sheets {args.sheets_latency:.2f}s, error every {args.error_every or '-'}")
+    print(f"  {'flow':<12}{'rows':>7}{'seconds':>10}{'rows/s':>9}{'sheet reads':>13}{'sheet writes':>14}")
+    for name, (rows, elapsed, stats) in results.items():
+        rate = rows / elapsed if elapsed > 0 else 0.0
+        print(f"  {name:<12}{rows:>7}{elapsed:>10.1f}{rate:>9.2f}{stats['reads']:>13}{stats['writes']:>14}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--flows", default="submit,auto_input,extract", type=lambda s: s.split(","))
+    ap.add_argument("--rows", type=int, default=30, help="sep_web_driver rows for submit")
+    ap.add_argument("--resep", type=int, default=5, help="resep rows for auto_input")
+    ap.add_argument("--obat", type=int, default=3, help="obat per resep for auto_input")
+    ap.add_argument("--days", type=int, default=3, help="days for extract")
+    ap.add_argument("--rows-per-day", type=int, default=40, help="SIRS claim rows per day")
+    ap.add_argument("--latency", type=float, default=0.3, help="in-page callback latency (s)")
+    ap.add_argument("--save-latency", type=float, default=0.5, help="Simpan → alert latency (s)")
+    ap.add_argument("--page-latency", type=float, default=0.2, help="server time per page load (s)")
+    ap.add_argument("--process-time", type=float, default=1.0, help="SIRS Tampilkan processing time (s)")
+    ap.add_argument("--error-every", type=int, default=0, help="every N-th search/filter/save fails (0 = never)")
+    ap.add_argument("--sheets-latency", type=float, default=0.15, help="simulated Sheets API round-trip (s)")
+    ap.add_argument("--workers", type=int, default=1, help="submit_main --workers")
+    ap.add_argument("--buffer-rows", type=int, default=0, help="submit_main --buffer-rows")
+    ap.add_argument("--lease-block", type=int, default=0, help="submit_main --lease-block")
+    ap.add_argument("--sequential", action="store_true", help="extract_main without pipelining")
+    ap.add_argument("--legacy-autocomplete", action="store_true", help="auto_input_v2 with the typed/sleep selection path")
+    ap.add_argument("--combo-cache", action="store_true", help="auto_input_v2 with the kode obat combo cache")
+    ap.add_argument("--navigate-per-resep", action="store_true", help="auto_input_v2 with goto + networkidle per resep")
+    ap.add_argument("--cdp-port", type=int, default=9333, help="CDP port of the bench Chromium (not 9222)")
+    args = ap.parse_args()
+    metrics.configure("bench_flows", jsonl=False)
+    main(args)
@@ -0,0 +1,104 @@
+# bench_job_queue.py
+#
+# Extraction → submission latency through job_queue.JobQueue: a producer
+# appends one "day" of SEP rows to an in-memory sep_web_driver every
+# --interval seconds via write_initial_sep_rows(jobs=...), while --workers
+# consumers (own queue connections, as separate processes would have) claim
+# jobs, "submit" for --submit-seconds and finish them. Reports enqueue → claim
+# wait and enqueue → done latency, max depth, and raw claim+finish cost.
+# No Google / browser access:
+#
+#   python -m bench.bench_job_queue --days 5 --rows 40 --workers 2
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from bench.bench_flows import SEP_HEADERS
+from bench.fake_sheets import FakeSpreadsheet
+from job_queue import JobQueue, format_stats
+from records import SepRecord
+from sheets_handler import write_initial_sep_rows
+
+
+def producer(ws, path: str, days: int, rows: int, interval: float):
+    jobs = JobQueue(path)
+    for day in range(days):
+        records = [SepRecord(sep_num=f"0179R0270425V{day:02d}{i:04d}", receipt_num=f"{day * 1000 + i}")
+                   for i in range(rows)]
+        write_initial_sep_rows(ws, records, dedupe=False, jobs=jobs)
+        time.sleep(interval)
+    jobs.close()
+
+
+def consumer(n: int, path: str, stop: threading.Event, submit_seconds: float, poll: float, depth: list):
+    jobs = JobQueue(path)
+    while not stop.is_set():
+        job = jobs.claim(f"bench/{n}")
+        if job is None:
+            stop.wait(poll)
+            continue
+        depth.append(jobs.depth())
+        time.sleep(submit_seconds)
+        jobs.finish(job.id)
+    jobs.close()
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.sqlite")
+        ws = FakeSpreadsheet().add_worksheet("sep_web_driver", [SEP_HEADERS])
+        stop, depth = threading.Event(), []
+        workers = [threading.Thread(target=consumer, args=(n, path, stop, args.submit_seconds, args.poll, depth))
+                   for n in range(args.workers)]
+        for t in workers:
+            t.start()
+        producer(ws, path, args.days, args.rows, args.interval)
+        jobs = JobQueue(path)
+        while jobs.depth():
+            time.sleep(0.05)
+        stop.set()
+        for t in workers:
+            t.join()
+        print(f"\n{args.days} days × {args.rows} rows, {args.workers} workers, "
+              f"{args.submit_seconds:.2f}s per submit, poll {args.poll:.1f}s")
+        print(f"  {format_stats(jobs.stats())}")
+        print(f"  max depth seen by a worker: {max(depth, default=0)}")
+
+        # raw queue cost, no simulated work
+        n = 2000
+        jobs.enqueue("raw", [(i, SepRecord(sep_num=f"S{i}", receipt_num=str(i))) for i in range(n)])
+        t0 = time.perf_counter()
+        for _ in range(n):
+            jobs.finish(jobs.claim("raw").id)
+        took = time.perf_counter() - t0
+        print(f"  claim + finish: {took / n * 1e6:.0f} µs per job ({n} jobs)")
+
+        # sheet cleared, row 2 reused by another SEP: the new SEP must be queued
+        first, other = SepRecord(sep_num="0179R0270425V000001", receipt_num="00123"), \
+            SepRecord(sep_num="0179R0270425V000002", receipt_num="456")
+        jobs.enqueue("reuse", [(2, first)])
+        old = jobs.claim("reuse")
+        jobs.finish(old.id)
+        same  = jobs.enqueue("reuse", [(2, SepRecord(sep_num=first.sep_num, receipt_num="'123"))])
+        added = jobs.enqueue("reuse", [(2, other)])
+        job = jobs.claim("reuse")
+        jobs.fail(old.id, "stale worker")  # must not touch the replacement
+        ok = same == 0 and added == 1 and job is not None and job.sep_num == other.sep_num and job.id != old.id
+        ok = ok and jobs.stats()["failed"] == 0
+        print(f"  reused row after a clear: {'ok' if ok else 'MISMATCH'}")
+        jobs.close()
+        if not ok:
+            raise SystemExit("a reused sheet row was not queued for its new SEP")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=5)
+    ap.add_argument("--rows", type=int, default=40, help="rows appended per day")
+    ap.add_argument("--interval", type=float, default=2.0, help="seconds between days (SIRS processing time)")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--submit-seconds", type=float, default=0.05, help="simulated Apotek submit per row")
+    ap.add_argument("--poll", type=float, default=0.5)
+    main(ap.parse_args())
@@ -0,0 +1,68 @@
+# bench_obat_index.py
+#
+# Pending-obat lookup: the old per-resep list comprehension over every obat
+# record vs. the receipt_num index built by auto_input_v2.load_obat_index.
+# Pure Python on a synthetic sheet, no Google / browser access:
+#
+#   python -m bench.bench_obat_index --obat 50000
+
+import argparse
+import random
+import time
+from auto_input_v2 import load_obat_index, PROCESSED_STATUSES
+
+HEADERS = ["receipt_num", "apol_id", "nama_obat", "qty", "harga", "updated_dttm", "sep_num", "status", "message"]
+
+
+def synthetic_values(n_obat: int, per_resep: int = 5, seed: int = 7) -> list[list[str]]:
+    rnd = random.Random(seed)
+    values = [HEADERS]
+    for i in range(n_obat):
+        receipt = f"{90000 + i // per_resep:05d}"
+        status = rnd.choice(["", "", "", "done", "error"])
+        values.append([receipt, f"{rnd.randint(1, 800):08d}", "OBAT", str(rnd.randint(1, 60)), "1000", "", "SEP", status, ""])
+    return values
+
+
+def legacy_related(obat_records: list[dict], no_resep: str) -> list[dict]:
+    # the comprehension auto_input ran once per resep row
+    return [
+        o for o in obat_records
+        if str(o.get("receipt_num", "")).strip() == no_resep
+        and str(o.get("status", "")).strip().lower() not in PROCESSED_STATUSES
+    ]
+
+
+def main(n_obat: int, n_lookups: int):
+    values = synthetic_values(n_obat)
+    obat_records = [dict(zip(HEADERS, row)) for row in values[1:]]
+    receipts = sorted({row[0] for row in values[1:]})
+    sample = random.Random(1).sample(receipts, min(n_lookups, len(receipts)))
+
+    t0 = time.perf_counter()
+    legacy = {r: legacy_related(obat_records, r) for r in sample}
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index = load_obat_index(None, values=values)
+    t_build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    indexed = {r: index.pending_for(r) for r in sample}
+    t_index = time.perf_counter() - t0
+
+    row_of = {id(o): row for row, o in enumerate(obat_records, start=2)}
+    same = all([o.row for o in indexed[r]] == [row_of[id(o)] for o in legacy[r]] for r in sample)
+    print(f"{n_obat} obat rows, {len(receipts)} resep, {len(sample)} lookups")
+    print(f"  list comprehension : {t_legacy * 1000:10.1f} ms  ({t_legacy / len(sample) * 1e6:8.1f} µs/resep)")
+    print(f"  index build (once) : {t_build * 1000:10.1f} ms")
+    print(f"  index lookups      : {t_index * 1000:10.1f} ms  ({t_index / len(sample) * 1e6:8.1f} µs/resep)")
+    print(f"  results match      : {'ok' if same else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--obat", type=int, default=50000)
+    ap.add_argument("--lookups", type=int, default=2000)
+    args = ap.parse_args()
+    main(args.obat, args.lookups)
@@ -0,0 +1,85 @@
+# bench_read_columns.py
+#
+# Pending-row scan of sep_web_driver: read_all_records (every cell, a dict per
+# row) vs. read_columns (only SUBMIT_COLUMNS, columnar), plus an incremental
+# read of rows appended since. Cells returned stand in for payload size, which
+# is what the real API spends its time on; "client ms" is the time spent in
+# our code on top of it (responses are served pre-computed). No Google access:
+#
+#   python -m bench.bench_read_columns --rows 50000
+
+import argparse
+import time
+import tracemalloc
+from bench.bench_flows import SEP_HEADERS
+from bench.fake_sheets import FakeSpreadsheet
+from sheets_handler import read_all_records, read_columns, sheet_headers
+from records import SepRecord
+from submit_main import SUBMIT_COLUMNS
+
+
+def synthetic_rows(n: int, start: int = 0) -> list[list[str]]:
+    return [
+        ["2025-04-29 10:47", f"{i:08d}", f"0179R0270425V{i:06d}", f"{10000 + i}", "Obat Kronis Blm Stabil",
+         "", "", f"sub-{i}" if i % 4 else "", "2025-04-29T11:00:00" if i % 4 else "",
+         "normal" if i % 4 else "", "-" if i % 4 else ""]
+        for i in range(start, start + n)
+    ]
+
+
+class Prefetched:
+    """Worksheet stand-in answering from responses computed up front, so timings show only the reader's own work."""
+
+    def __init__(self, ws, ranges: list[list[str]]):
+        self.spreadsheet_id, self.id, self.title = ws.spreadsheet_id, ws.id, ws.title
+        self._all   = ws.get_all_values()
+        self._batch = {tuple(r): ws.batch_get(r) for r in ranges}
+
+    def get_all_values(self):
+        return self._all
+
+    def batch_get(self, ranges, **kwargs):
+        return self._batch[tuple(ranges)]
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+
+def main(n_rows: int, n_new: int):
+    ss = FakeSpreadsheet()
+    ws = ss.add_worksheet("sep_web_driver", [SEP_HEADERS] + synthetic_rows(n_rows))
+    letters = "CDEHJ"  # SUBMIT_COLUMNS on the sep_web_driver layout
+    full = Prefetched(ws, [["1:1"], [f"{c}2:{c}" for c in letters]])
+    sheet_headers(full)  # header row cached, as after the first read of a run
+
+    records, t_all, m_all = measure(lambda: read_all_records(full))
+    pending_all = [idx for idx, row in enumerate(records, start=2) if not SepRecord.from_dict(row).done]
+
+    cols, t_cols, m_cols = measure(lambda: read_columns(full, SUBMIT_COLUMNS))
+    pending_cols = [idx for idx, *v in cols.tuples() if not SepRecord(idx, **dict(zip(SUBMIT_COLUMNS, v))).done]
+
+    ws.append_rows(synthetic_rows(n_new, start=n_rows))
+    tail = Prefetched(ws, [[f"{c}{cols.last_row + 1}:{c}" for c in letters]])
+    new, t_new, m_new = measure(lambda: read_columns(tail, SUBMIT_COLUMNS, after_row=cols.last_row))
+
+    print(f"{n_rows} rows, {len(pending_all)} pending; then {n_new} rows appended")
+    print(f"  {'reader':<26}{'client ms':>10}{'peak MB':>9}{'cells':>10}")
+    print(f"  {'read_all_records':<26}{t_all * 1000:>10.1f}{m_all:>9.1f}{n_rows * len(SEP_HEADERS):>10}")
+    print(f"  {'read_columns':<26}{t_cols * 1000:>10.1f}{m_cols:>9.1f}{len(cols) * len(SUBMIT_COLUMNS):>10}")
+    print(f"  {'read_columns (after_row)':<26}{t_new * 1000:>10.1f}{m_new:>9.1f}{len(new) * len(SUBMIT_COLUMNS):>10}")
+    print(f"  pending rows match: {'ok' if pending_all == pending_cols else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--new", type=int, default=200, help="rows appended before the incremental read")
+    args = ap.parse_args()
+    main(args.rows, args.new)
@@ -0,0 +1,58 @@
+# bench_records.py
+#
+# sep_web_driver rows held as header-keyed dicts (read_all_records) vs.
+# records.SepRecord: memory for the whole sheet and the pending filter, with
+# the per-access str().strip() of the dict version vs. the attributes
+# normalised at load. Pure Python, no Google access:
+#
+#   python -m bench.bench_records --rows 50000
+
+import argparse
+import time
+import tracemalloc
+from bench.bench_flows import SEP_HEADERS
+from bench.bench_read_columns import synthetic_rows
+from records import SepRecord
+
+
+def dict_done(row: dict) -> bool:
+    # the check submit_main ran on every dict row
+    return bool((row.get("submission_id", "") or "").strip() or (row.get("status", "") or "").strip())
+
+
+def build(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    rows = fn()
+    elapsed = time.perf_counter() - t0
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return rows, elapsed, size / 2**20
+
+
+def filter_time(rows, done) -> tuple[list[int], float]:
+    t0 = time.perf_counter()
+    pending = [idx for idx, row in enumerate(rows, start=2) if not done(row)]
+    return pending, time.perf_counter() - t0
+
+
+def main(n_rows: int):
+    values = synthetic_rows(n_rows)
+    dicts, t_dicts, m_dicts = build(lambda: [dict(zip(SEP_HEADERS, row)) for row in values])
+    recs, t_recs, m_recs = build(lambda: [SepRecord(i, *row) for i, row in enumerate(values, start=2)])
+
+    p_dicts, f_dicts = filter_time(dicts, dict_done)
+    p_recs, f_recs = filter_time(recs, lambda r: r.done)
+
+    print(f"{n_rows} rows, {len(p_recs)} pending")
+    print(f"  {'rows as':<11}{'build ms':>10}{'held MB':>9}{'filter ms':>11}")
+    print(f"  {'dict':<11}{t_dicts * 1000:>10.1f}{m_dicts:>9.1f}{f_dicts * 1000:>11.1f}")
+    print(f"  {'SepRecord':<11}{t_recs * 1000:>10.1f}{m_recs:>9.1f}{f_recs * 1000:>11.1f}")
+    print(f"  pending rows match: {'ok' if p_dicts == p_recs else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50000)
+    args = ap.parse_args()
+    main(args.rows)
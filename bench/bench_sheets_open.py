@@ -0,0 +1,57 @@
+# bench_sheets_open.py
+#
+# Cold vs. warm worksheet opens against the real spreadsheet (needs the
+# service-account key from config and network access):
+#
+#   legacy  the old per-call path: read key → gspread.authorize → open_by_url → worksheet
+#   cold    first sheets_handler.get_worksheet in the process (key, token, metadata)
+#   warm    repeat get_worksheet calls (cached client and handles)
+#
+# plus one small read after each open, which shows the keep-alive pool: a
+# fresh client pays TCP + TLS setup again, the shared session does not.
+#
+#   python -m bench.bench_sheets_open --repeat 5
+
+import argparse
+import statistics
+import time
+import gspread
+from google.oauth2.service_account import Credentials
+import sheets_handler
+from config import SERVICE_ACCOUNT_PATH, SHEET_URL, WORKSHEET_NAME
+
+
+def legacy_open(name: str):
+    creds  = Credentials.from_service_account_file(SERVICE_ACCOUNT_PATH, scopes=sheets_handler.SCOPES)
+    client = gspread.authorize(creds)
+    return client.open_by_url(SHEET_URL).worksheet(name)
+
+
+def timed(fn) -> tuple[float, float]:
+    """(open seconds, first-read seconds) for one open via fn."""
+    t0 = time.perf_counter()
+    ws = fn()
+    t1 = time.perf_counter()
+    ws.acell("A1")
+    return t1 - t0, time.perf_counter() - t1
+
+
+def main(name: str, repeat: int):
+    legacy = [timed(lambda: legacy_open(name)) for _ in range(repeat)]
+    cold   = [timed(lambda: sheets_handler.get_worksheet(name))]
+    warm   = [timed(lambda: sheets_handler.get_worksheet(name)) for _ in range(repeat)]
+
+    print(f"worksheet '{name}', {repeat} opens per path")
+    print(f"  {'path':<8}{'open ms (median)':>18}{'read ms (median)':>18}")
+    for label, runs in (("legacy", legacy), ("cold", cold), ("warm", warm)):
+        open_ms = statistics.median(o for o, _ in runs) * 1000
+        read_ms = statistics.median(r for _, r in runs) * 1000
+        print(f"  {label:<8}{open_ms:>18.1f}{read_ms:>18.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--worksheet", default=WORKSHEET_NAME)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    main(args.worksheet, args.repeat)
@@ -0,0 +1,118 @@
+# bench_sirs_http.py
+#
+# Validate the direct-HTTP report fetch against the Playwright path of
+# sirs_extract_obat, using a local stand-in for the rp_id=17 report
+# (bench/fixtures/sirs_report.html + a POST handler rendering table.qresult):
+#
+#   python -m bench.bench_sirs_http --latency 0.5 --threads 5
+
+import argparse
+import asyncio
+import concurrent.futures
+import pathlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from playwright.async_api import async_playwright
+from sirs_extract_obat import scrape_doctor, capture_report_form, make_http_session, fetch_doctor_http, parse_report_html
+
+FIXTURE = pathlib.Path(__file__).parent / "fixtures" / "sirs_report.html"
+DOCTOR_IDS = ["595", "647", "721", "802", "913"]
+
+
+def report_rows(doc_id: str) -> list[list[str]]:
+    n = int(doc_id) % 7 + 3
+    return [
+        [f"2025-04-{i + 1:02d} 09:{i:02d}", f"0179R0270425V{int(doc_id) * 100 + i:06d}",
+         f"{90000 + i}", f"OBAT {doc_id}-{i}", str(i + 1)]
+        for i in range(n)
+    ]
+
+
+LOGIN_PAGE = '<form id="login"><input name="user"><input name="pass" type="password"></form>'
+
+
+def render_report(doc_id: str) -> str:
+    """Report table; every other doctor without <tbody>, as some SIRS pages send it."""
+    body = "".join(
+        "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>"
+        for row in report_rows(doc_id)
+    )
+    if int(doc_id) % 2:
+        body = f"<tbody>{body}</tbody>"
+    return (
+        '<table class="qresult"><thead><tr><th>Tgl</th><th>SEP</th><th>Resep</th><th>Obat</th><th>Qty</th></tr></thead>'
+        f"{body}</table>"
+    )
+
+
+def start_fixture_server(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, html: str):
+            data = html.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._send(FIXTURE.read_text(encoding="utf-8"))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode("utf-8"))
+            time.sleep(latency)  # server-side report generation time
+            self._send(render_report(form.get("s_8_", [""])[0]))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def main(latency: float, threads: int):
+    server = start_fixture_server(latency)
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        page = await browser.new_page()
+        await page.goto(url)
+
+        t0 = time.perf_counter()
+        browser_rows = {doc_id: await scrape_doctor(page, doc_id) for doc_id in DOCTOR_IDS}
+        t_browser = time.perf_counter() - t0
+
+        form = await capture_report_form(page)
+        await browser.close()
+
+    session = make_http_session(form, pool_size=threads)
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        http_rows = dict(zip(DOCTOR_IDS, pool.map(lambda d: fetch_doctor_http(session, form, d), DOCTOR_IDS)))
+    t_http = time.perf_counter() - t0
+    server.shutdown()
+
+    print(f"{len(DOCTOR_IDS)} doctors, server latency {latency:.2f}s")
+    print(f"  playwright (sequential) : {t_browser:7.2f} s")
+    print(f"  http ({threads} threads)       : {t_http:7.2f} s")
+    for doc_id in DOCTOR_IDS:
+        ok = browser_rows[doc_id] == http_rows[doc_id] == report_rows(doc_id)
+        print(f"  doctor {doc_id}: {len(http_rows[doc_id]):3d} rows [{'ok' if ok else 'MISMATCH'}]")
+    try:
+        parse_report_html(LOGIN_PAGE)
+        print("  login page: parsed as a report [MISMATCH]")
+    except RuntimeError as e:
+        print(f"  login page: rejected [ok] ({e})")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency", type=float, default=0.5)
+    ap.add_argument("--threads", type=int, default=5)
+    args = ap.parse_args()
+    asyncio.run(main(args.latency, args.threads))
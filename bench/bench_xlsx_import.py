@@ -0,0 +1,75 @@
+# bench_xlsx_import.py
+#
+# xlsx_import on a synthetic SEP workbook (same columns as documents/list_sep.xlsx,
+# a few percent repeated rows) into an in-memory sep_web_driver from
+# bench/fake_sheets.py: rows/s, peak Python memory and Sheets calls per chunk size.
+# Peak memory includes the fake sheet holding every appended row; the "read"
+# line streams the workbook into a sink that keeps nothing, for comparison.
+#
+#   python -m bench.bench_xlsx_import --rows 100000 --chunk-rows 1000,5000,20000
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import openpyxl
+from config import WORKSHEET_NAME
+from bench.bench_flows import SEP_HEADERS
+from bench.fake_sheets import FakeSpreadsheet
+from xlsx_import import import_xlsx, sheet_sink
+
+HEADERS = ["dttm", "sep_num", "receipt_num", "status_cd", "error_message"]
+
+
+def synthetic_workbook(path: str, n_rows: int, dup_rate: float = 0.03, seed: int = 7):
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("sep_web_driver")
+    ws.append(HEADERS)
+    for i in range(n_rows):
+        n = rnd.randrange(i) if i and rnd.random() < dup_rate else i
+        ws.append([f"{1 + n % 28} April 2025 {8 + n % 9}:{n % 60:02d}", f"0179R0270425V{n:06d}",
+                   70000 + n, rnd.choice([None, None, "normal"]), None])
+    wb.save(path)
+
+
+def run(path: str, chunk_rows: int, latency: float, keep: bool = True) -> dict:
+    ss = FakeSpreadsheet(latency=latency)
+    ws = ss.add_worksheet(WORKSHEET_NAME, [SEP_HEADERS])
+    sink = sheet_sink(ws) if keep else (lambda records: (len(records), 0))
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    stats = import_xlsx([path], sink, chunk_rows=chunk_rows)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if keep:
+        assert len(ws.get_all_values()) - 1 == stats["inserted"]
+    return {**stats, "seconds": elapsed, "peak_mb": peak / 2**20, **ss.stats}
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sep_synthetic.xlsx")
+        t0 = time.perf_counter()
+        synthetic_workbook(path, args.rows)
+        print(f"{args.rows} rows → {os.path.getsize(path) / 2**20:.1f} MB workbook in {time.perf_counter() - t0:.1f}s")
+        print(f"sheets latency {args.sheets_latency:.2f}s per call")
+        print(f"  {'chunk':>7}{'seconds':>9}{'rows/s':>9}{'peak MB':>9}{'appended':>10}{'dupes':>7}"
+              f"{'reads':>7}{'writes':>8}")
+        runs = [("read", 5000, False)] + [(str(n), n, True) for n in args.chunk_rows]
+        for label, chunk_rows, keep in runs:
+            r = run(path, chunk_rows, args.sheets_latency, keep)
+            print(f"  {label:>7}{r['seconds']:>9.1f}{r['read'] / r['seconds']:>9.0f}{r['peak_mb']:>9.1f}"
+                  f"{r['inserted']:>10}{r['duplicate']:>7}{r['reads']:>7}{r['writes']:>8}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--chunk-rows", default=[1000, 5000, 20000],
+                    type=lambda s: [int(x) for x in s.split(",")])
+    ap.add_argument("--sheets-latency", type=float, default=0.3, help="simulated Sheets API round-trip (s)")
+    main(ap.parse_args())
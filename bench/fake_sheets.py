@@ -0,0 +1,218 @@
+# fake_sheets.py
+#
+# In-memory stand-in for the parts of gspread the runners use (Spreadsheet /
+# Worksheet: get_all_values, get_all_records, acell, batch_get, batch_update,
+# batch_clear, update, append_rows, values_batch_update). Every API call can
+# pay a simulated round-trip `latency` and is counted, so benchmarks see the
+# same call pattern as against Google Sheets without touching the network.
+#
+#   ss = FakeSpreadsheet(latency=0.15)
+#   ws = ss.add_worksheet("sep_web_driver", [SEP_HEADERS, *rows])
+#   ss.stats   # {"reads": n, "writes": n}
+
+import itertools
+import re
+import threading
+import time
+from gspread.cell import Cell
+from gspread.utils import numericise_all, rowcol_to_a1
+
+_A1 = re.compile(r"^([A-Za-z]*)(\d*)$")
+_ids = itertools.count(1000)
+
+
+def _col_number(letters: str) -> int:
+    n = 0
+    for ch in letters.upper():
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def _split_sheet(a1: str) -> tuple[str | None, str]:
+    """'daftar obat'!H3 -> ("daftar obat", "H3")"""
+    if "!" not in a1:
+        return None, a1
+    title, cells = a1.rsplit("!", 1)
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, cells
+
+
+def parse_range(a1: str) -> tuple[int, int, int | None, int | None]:
+    """
+    A1 range -> (first_row, first_col, last_row, last_col), 1-based, with None
+    for open ends: "F12" / "F12:K12" / "C2:D" / "A5:K" / "H:H".
+    """
+    start, _, end = a1.partition(":")
+    m1, m2 = _A1.match(start), _A1.match(end or start)
+    if not m1 or not m2:
+        raise ValueError(f"Unsupported A1 range: {a1!r}")
+    r1 = int(m1.group(2)) if m1.group(2) else 1
+    c1 = _col_number(m1.group(1)) if m1.group(1) else 1
+    r2 = int(m2.group(2)) if m2.group(2) else None
+    c2 = _col_number(m2.group(1)) if m2.group(1) else None
+    return r1, c1, r2, c2
+
+
+class FakeWorksheet:
+    """One tab of a FakeSpreadsheet; values are kept as a list of row lists of strings."""
+
+    def __init__(self, spreadsheet, title: str, values: list[list] | None = None):
+        self.spreadsheet    = spreadsheet
+        self.spreadsheet_id = spreadsheet.id
+        self.id             = next(_ids)
+        self.title          = title
+        self._values        = [[("" if v is None else str(v)) for v in row] for row in (values or [])]
+
+    # --- helpers ----------------------------------------------------------
+
+    def _call(self, kind: str):
+        self.spreadsheet._call(kind)
+
+    def _ensure(self, row: int, col: int):
+        while len(self._values) < row:
+            self._values.append([])
+        line = self._values[row - 1]
+        if len(line) < col:
+            line.extend([""] * (col - len(line)))
+
+    def _get(self, a1: str) -> list[list[str]]:
+        """Values of one range, trimmed of trailing empty cells/rows like the Sheets API."""
+        r1, c1, r2, c2 = parse_range(a1)
+        r2 = r2 or len(self._values)
+        out = []
+        for r in range(r1, r2 + 1):
+            line = self._values[r - 1] if r <= len(self._values) else []
+            cells = line[c1 - 1:c2] if c2 else line[c1 - 1:]
+            while cells and cells[-1] == "":
+                cells = cells[:-1]
+            out.append(list(cells))
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def _set(self, a1: str, values: list[list]):
+        r1, c1, _, _ = parse_range(a1)
+        for dr, line in enumerate(values):
+            for dc, value in enumerate(line):
+                self._ensure(r1 + dr, c1 + dc)
+                self._values[r1 + dr - 1][c1 + dc - 1] = "" if value is None else str(value)
+
+    @property
+    def row_count(self) -> int:
+        return len(self._values)
+
+    @property
+    def col_count(self) -> int:
+        return max((len(row) for row in self._values), default=0) or 26
+
+    # --- reads ------------------------------------------------------------
+
+    def get_all_values(self) -> list[list[str]]:
+        self._call("reads")
+        with self.spreadsheet.lock:
+            width = max((len(r) for r in self._values), default=0)
+            return [list(r) + [""] * (width - len(r)) for r in self._values]
+
+    def get_all_records(self) -> list[dict]:
+        values = self.get_all_values()
+        if not values:
+            return []
+        headers = values[0]
+        return [dict(zip(headers, numericise_all(row, default_blank=""))) for row in values[1:]]
+
+    def acell(self, label: str, **kwargs) -> Cell:
+        self._call("reads")
+        r, c, _, _ = parse_range(label)
+        with self.spreadsheet.lock:
+            line = self._values[r - 1] if r <= len(self._values) else []
+            return Cell(r, c, line[c - 1] if c <= len(line) else "")
+
+    def get(self, range_name: str, **kwargs) -> list[list[str]]:
+        self._call("reads")
+        with self.spreadsheet.lock:
+            return self._get(_split_sheet(range_name)[1])
+
+    def batch_get(self, ranges: list[str], **kwargs) -> list[list[list[str]]]:
+        self._call("reads")
+        with self.spreadsheet.lock:
+            return [self._get(_split_sheet(a1)[1]) for a1 in ranges]
+
+    # --- writes -----------------------------------------------------------
+
+    def batch_update(self, data: list[dict], **kwargs):
+        self._call("writes")
+        with self.spreadsheet.lock:
+            for item in data:
+                self._set(_split_sheet(item["range"])[1], item["values"])
+
+    def update(self, range_name, values=None, **kwargs):
+        # accept both gspread 5 (range, values) and 6 (values, range) orders
+        if isinstance(range_name, list):
+            range_name, values = values, range_name
+        self.batch_update([{"range": range_name, "values": values}])
+
+    def update_acell(self, label: str, value):
+        self.batch_update([{"range": label, "values": [[value]]}])
+
+    def batch_clear(self, ranges: list[str]):
+        self._call("writes")
+        with self.spreadsheet.lock:
+            for a1 in ranges:
+                r1, c1, r2, c2 = parse_range(_split_sheet(a1)[1])
+                for r in range(r1, (r2 or len(self._values)) + 1):
+                    if r > len(self._values):
+                        break
+                    line = self._values[r - 1]
+                    for c in range(c1, (c2 or len(line)) + 1):
+                        if c <= len(line):
+                            line[c - 1] = ""
+
+    def append_rows(self, values: list[list], **kwargs):
+        self._call("writes")
+        with self.spreadsheet.lock:
+            first = len(self._values) + 1
+            self._values.extend([("" if v is None else str(v)) for v in row] for row in values)
+            last = len(self._values)
+        # the values.append response shape gspread passes back
+        width = max((len(row) for row in values), default=1)
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:{rowcol_to_a1(last, width)}",
+                            "updatedRows": len(values)}}
+
+    def append_row(self, values: list, **kwargs):
+        self.append_rows([values], **kwargs)
+
+
+class FakeSpreadsheet:
+    """Container of FakeWorksheets sharing one simulated API latency and call counter."""
+
+    def __init__(self, latency: float = 0.0, title: str = "bench"):
+        self.id      = f"fake-{next(_ids)}"
+        self.title   = title
+        self.latency = latency
+        self.lock    = threading.RLock()
+        self.stats   = {"reads": 0, "writes": 0}
+        self._sheets = {}
+
+    def _call(self, kind: str):
+        with self.lock:
+            self.stats[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add_worksheet(self, title: str, values: list[list] | None = None) -> FakeWorksheet:
+        ws = self._sheets[title] = FakeWorksheet(self, title, values)
+        return ws
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        return self._sheets[title]
+
+    def worksheets(self) -> list[FakeWorksheet]:
+        return list(self._sheets.values())
+
+    def values_batch_update(self, body: dict):
+        self._call("writes")
+        with self.lock:
+            for item in body.get("data", []):
+                title, cells = _split_sheet(item["range"])
+                self._sheets[title]._set(cells, item["values"])
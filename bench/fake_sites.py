@@ -0,0 +1,79 @@
+# fake_sites.py
+#
+# Local HTTP stand-ins for the pages the runners drive, built from the
+# selectors the runners themselves use (config.APOTEK_SELECTORS,
+# config.SIRS_SELECTORS, auto_input_v2.SELECTORS):
+#
+#   /apotek/RspMsk1.aspx      submit_main / apotek_runner
+#   /apotek/DaftarResep.aspx  auto_input_v2 (grid filter → Input Obat)
+#   /apotek/ObatInput.aspx    auto_input_v2 (kode obat autocomplete, Simpan)
+#   /sirs/index.php           extract_main / sirs_runner
+#
+#   server = start_fake_sites(latency=0.3, error_every=10)
+#   server.base_url   # http://127.0.0.1:<port>
+#
+# latency       in-page callback time (SEP search, grid filter, listbox)
+# save_latency  Simpan → alert time
+# page_latency  server time per page load (navigation cost)
+# process_time  SIRS "Tampilkan" processing time
+# error_every   every N-th search / filter / save fails with a dialog (0 = never)
+
+import json
+import pathlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from config import APOTEK_SELECTORS, SIRS_SELECTORS
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+PAGES = {
+    "/apotek/RspMsk1.aspx":     "fake_apotek_rspmsk.html",
+    "/apotek/DaftarResep.aspx": "fake_daftar_resep.html",
+    "/apotek/ObatInput.aspx":   "fake_obat_input.html",
+    "/sirs/index.php":          "fake_sirs.html",
+}
+
+
+def _selectors() -> dict:
+    from auto_input_v2 import SELECTORS as OBAT_SELECTORS
+    return {**APOTEK_SELECTORS, **SIRS_SELECTORS, **OBAT_SELECTORS}
+
+
+def start_fake_sites(latency: float = 0.3, save_latency: float = 0.5, page_latency: float = 0.2,
+                     process_time: float = 1.0, error_every: int = 0, rows_per_day: int = 40) -> ThreadingHTTPServer:
+    """Serve the stand-in pages on 127.0.0.1 (random port) from a daemon thread."""
+    fake = {
+        "sel":          _selectors(),
+        "latency":      int(latency * 1000),
+        "save_latency": int(save_latency * 1000),
+        "process_time": int(process_time * 1000),
+        "error_every":  error_every,
+        "rows_per_day": rows_per_day,
+    }
+    inject = f"<script>window.FAKE = {json.dumps(fake)};</script>"
+    pages = {path: (FIXTURES / name).read_text(encoding="utf-8").replace("<!--FAKE-->", inject)
+             for path, name in PAGES.items()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            html = pages.get(urlsplit(self.path).path)
+            if html is None:
+                self.send_error(404)
+                return
+            time.sleep(page_latency)
+            data = html.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
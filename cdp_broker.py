@@ -0,0 +1,355 @@
+# cdp_broker.py
+#
+# Tab broker for the one logged-in Chrome (CDP on 127.0.0.1:9222).
+#
+# Every entry point used to grab contexts[0].pages[0], so two jobs running at
+# once drove the same tab. The broker is a small long-lived process that owns
+# tab allocation: a job asks it for a tab, gets a fresh target in the default
+# (logged-in) context, and the tab is closed when the job releases it or its
+# socket goes away (crash, Ctrl-C). Inside one process, the Playwright
+# connection is opened once per event loop / thread and reused by every
+# runner (connect / connect_sync).
+#
+#   python cdp_broker.py                 # start the broker (keep it running)
+#
+#   browser = await cdp_broker.connect()
+#   page    = await cdp_broker.lease_page(browser, owner="apotek")
+#   ...
+#   await cdp_broker.release_page(page)
+#
+# Without a running broker lease_page falls back to the old behaviour
+# (first page of the default context), so nothing breaks.
+#
+# Limits: a Playwright connection cannot be handed to another process, so each
+# process still pays one connect_over_cdp (the cache only removes the repeats
+# within a process). Tabs are created through Chrome's /json HTTP endpoints,
+# so the broker itself needs no Playwright driver.
+#
+# Protocol: one JSON object per line over TCP 127.0.0.1:CDP_BROKER_PORT.
+#   {"op": "lease", "owner": "apotek", "url": "about:blank"} -> {"ok": true, "target_id": "..."}
+#   {"op": "release", "target_id": "..."}                    -> {"ok": true}
+#   {"op": "status"}                                         -> {"ok": true, "leases": [...]}
+#   {"op": "ping"}                                           -> {"ok": true}
+
+import asyncio
+import json
+import socket
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from urllib.parse import quote
+from config import CDP_ENDPOINT, CDP_BROKER_PORT
+
+
+# === BROKER SERVER =======================================================
+
+def _cdp_http(cdp_endpoint: str, path: str, method: str = "GET"):
+    req = urllib.request.Request(cdp_endpoint.rstrip("/") + path, method=method)
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        body = resp.read().decode("utf-8")
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+
+class Broker:
+    """Hands out dedicated Chrome tabs over a local socket and reclaims them."""
+
+    def __init__(self, cdp_endpoint: str = CDP_ENDPOINT, port: int = CDP_BROKER_PORT):
+        self.cdp_endpoint = cdp_endpoint
+        self.port         = port
+        self.leases       = {}   # target_id -> {"owner", "since", "client"}
+
+    async def _http(self, path: str, method: str = "GET"):
+        return await asyncio.to_thread(_cdp_http, self.cdp_endpoint, path, method)
+
+    async def _lease(self, client: str, owner: str, url: str) -> str:
+        target = await self._http("/json/new?" + quote(url, safe=":/?&=#%"), method="PUT")
+        self.leases[target["id"]] = {
+            "owner": owner, "client": client, "since": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        print(f"📑 {owner or client}: leased tab {target['id']} ({len(self.leases)} active)")
+        return target["id"]
+
+    async def _release(self, target_id: str):
+        lease = self.leases.pop(target_id, None)
+        try:
+            await self._http(f"/json/close/{target_id}")
+        except Exception:
+            pass  # already closed by hand
+        if lease:
+            print(f"📑 {lease['owner'] or lease['client']}: released tab {target_id} ({len(self.leases)} active)")
+
+    async def _prune(self):
+        """Forget leases whose tab was closed directly in Chrome."""
+        alive = {t["id"] for t in await self._http("/json/list")}
+        for target_id in [t for t in self.leases if t not in alive]:
+            self.leases.pop(target_id, None)
+
+    async def _handle(self, reader, writer):
+        peer = "%s:%s" % writer.get_extra_info("peername")[:2]
+        mine = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    msg = json.loads(line)
+                    op  = msg.get("op")
+                    if op == "lease":
+                        target_id = await self._lease(peer, msg.get("owner", ""), msg.get("url", "about:blank"))
+                        mine.add(target_id)
+                        reply = {"ok": True, "target_id": target_id}
+                    elif op == "release":
+                        mine.discard(msg["target_id"])
+                        await self._release(msg["target_id"])
+                        reply = {"ok": True}
+                    elif op == "status":
+                        await self._prune()
+                        reply = {"ok": True, "leases": [{"target_id": t, **l} for t, l in self.leases.items()]}
+                    elif op == "ping":
+                        reply = {"ok": True}
+                    else:
+                        reply = {"ok": False, "error": f"unknown op {op!r}"}
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # client went away: its tabs go with it
+            for target_id in mine:
+                await self._release(target_id)
+            writer.close()
+
+    async def serve(self):
+        version = await self._http("/json/version")
+        print(f"✅ CDP broker on 127.0.0.1:{self.port} → {version.get('Browser', self.cdp_endpoint)}")
+        server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        async with server:
+            await server.serve_forever()
+
+
+# === CLIENT ==============================================================
+
+class BrokerClient:
+    """Blocking JSON-lines client; leases live as long as this connection."""
+
+    def __init__(self, port: int = CDP_BROKER_PORT, timeout: float = 15.0):
+        self._sock = socket.create_connection(("127.0.0.1", port), timeout=timeout)
+        self._file = self._sock.makefile("rwb")
+        self._lock = threading.Lock()
+
+    def request(self, op: str, **fields) -> dict:
+        with self._lock:
+            self._file.write((json.dumps({"op": op, **fields}) + "\n").encode("utf-8"))
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("CDP broker closed the connection")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "broker error"))
+        return reply
+
+    def lease(self, owner: str = "", url: str = "about:blank") -> str:
+        return self.request("lease", owner=owner, url=url)["target_id"]
+
+    def release(self, target_id: str):
+        self.request("release", target_id=target_id)
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+_client      = None
+_client_lock = threading.Lock()
+
+
+def broker_client() -> BrokerClient | None:
+    """Process-wide broker connection, or None when no broker is running."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            try:
+                _client = BrokerClient()
+                _client.request("ping")
+            except OSError:
+                _client = None
+        return _client
+
+
+# === SHARED PLAYWRIGHT CONNECTIONS =======================================
+# Playwright objects belong to the event loop (async) or thread (sync) that
+# created them, so the cache is keyed by loop / thread.
+
+_async_conns = {}   # (loop, endpoint) -> (playwright, browser, owns_playwright)
+_sync_conns  = {}   # (thread id, endpoint) -> (playwright, browser)
+_leased      = {}   # page -> target_id
+_endpoints   = {}   # browser -> CDP endpoint it was connected to
+
+
+def _brokered(browser) -> BrokerClient | None:
+    """The broker serves the Chrome at config.CDP_ENDPOINT only (not e.g. a bench Chromium)."""
+    return broker_client() if _endpoints.get(browser) == CDP_ENDPOINT else None
+
+
+async def connect(cdp_endpoint: str = CDP_ENDPOINT, playwright=None):
+    """
+    Browser connected over CDP, opened once per event loop and reused.
+    Pass `playwright` to attach with an already-started async_playwright().
+    """
+    key = (asyncio.get_running_loop(), cdp_endpoint)
+    conn = _async_conns.get(key)
+    if conn is None or not conn[1].is_connected():
+        from playwright.async_api import async_playwright
+        owns = playwright is None
+        pw = await async_playwright().start() if owns else playwright
+        browser = await pw.chromium.connect_over_cdp(cdp_endpoint)
+        _endpoints[browser] = cdp_endpoint
+        conn = _async_conns[key] = (pw, browser, owns)
+    return conn[1]
+
+
+async def disconnect(cdp_endpoint: str = CDP_ENDPOINT):
+    """Drop this loop's cached connection (leased tabs are released first)."""
+    conn = _async_conns.pop((asyncio.get_running_loop(), cdp_endpoint), None)
+    if conn is None:
+        return
+    pw, browser, owns = conn
+    for page in [p for p in _leased if p.context.browser is browser]:
+        await release_page(page)
+    _endpoints.pop(browser, None)
+    await browser.close()
+    if owns:
+        await pw.stop()
+
+
+def connect_sync(cdp_endpoint: str = CDP_ENDPOINT):
+    """Sync-API counterpart of connect(), cached per thread."""
+    key = (threading.get_ident(), cdp_endpoint)
+    conn = _sync_conns.get(key)
+    if conn is None or not conn[1].is_connected():
+        from playwright.sync_api import sync_playwright
+        pw = sync_playwright().start()
+        conn = _sync_conns[key] = (pw, pw.chromium.connect_over_cdp(cdp_endpoint))
+        _endpoints[conn[1]] = cdp_endpoint
+    return conn[1]
+
+
+def disconnect_sync(cdp_endpoint: str = CDP_ENDPOINT):
+    conn = _sync_conns.pop((threading.get_ident(), cdp_endpoint), None)
+    if conn is None:
+        return
+    pw, browser = conn
+    for page in [p for p in _leased if p.context.browser is browser]:
+        release_page_sync(page)
+    _endpoints.pop(browser, None)
+    browser.close()
+    pw.stop()
+
+
+async def _target_id(page) -> str:
+    session = await page.context.new_cdp_session(page)
+    try:
+        return (await session.send("Target.getTargetInfo"))["targetInfo"]["targetId"]
+    finally:
+        await session.detach()
+
+
+def _target_id_sync(page) -> str:
+    session = page.context.new_cdp_session(page)
+    try:
+        return session.send("Target.getTargetInfo")["targetInfo"]["targetId"]
+    finally:
+        session.detach()
+
+
+async def lease_page(browser, owner: str = "", new_tab: bool = False, timeout: float = 5.0):
+    """
+    A tab of our own in the logged-in context, leased from the broker when it
+    runs. Without a broker: a new tab if `new_tab`, else the first page of the
+    default context (previous behaviour).
+    """
+    ctx    = browser.contexts[0] if browser.contexts else await browser.new_context()
+    client = await asyncio.to_thread(_brokered, browser)
+    if client is None:
+        if new_tab or not ctx.pages:
+            return await ctx.new_page()
+        return ctx.pages[0]
+
+    target_id = await asyncio.to_thread(client.lease, owner)
+    checked   = set(_leased)
+    deadline  = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for page in ctx.pages:
+            if page in checked:
+                continue
+            checked.add(page)
+            if await _target_id(page) == target_id:
+                _leased[page] = target_id
+                return page
+        await asyncio.sleep(0.05)  # Playwright attaches the new target asynchronously
+    await asyncio.to_thread(client.release, target_id)
+    raise TimeoutError(f"Leased tab {target_id} never appeared in the CDP context")
+
+
+def lease_page_sync(browser, owner: str = "", new_tab: bool = False, timeout: float = 5.0):
+    """Sync-API counterpart of lease_page()."""
+    ctx    = browser.contexts[0] if browser.contexts else browser.new_context()
+    client = _brokered(browser)
+    if client is None:
+        if new_tab or not ctx.pages:
+            return ctx.new_page()
+        return ctx.pages[0]
+
+    target_id = client.lease(owner)
+    checked   = set(_leased)
+    deadline  = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for page in ctx.pages:
+            if page in checked:
+                continue
+            checked.add(page)
+            if _target_id_sync(page) == target_id:
+                _leased[page] = target_id
+                return page
+        # the sync API only processes the target attach while inside a call
+        if ctx.pages:
+            ctx.pages[0].wait_for_timeout(50)
+        else:
+            time.sleep(0.05)
+    client.release(target_id)
+    raise TimeoutError(f"Leased tab {target_id} never appeared in the CDP context")
+
+
+async def release_page(page) -> bool:
+    """
+    Give a leased tab back (the broker closes it). Returns False for pages that
+    were not leased, which are left open.
+    """
+    target_id = _leased.pop(page, None)
+    if target_id is None or _client is None:
+        return False
+    await asyncio.to_thread(_client.release, target_id)
+    return True
+
+
+def release_page_sync(page) -> bool:
+    target_id = _leased.pop(page, None)
+    if target_id is None or _client is None:
+        return False
+    _client.release(target_id)
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(Broker().serve())
+    except KeyboardInterrupt:
+        print("👋 CDP broker stopped.")
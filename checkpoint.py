@@ -0,0 +1,125 @@
+# checkpoint.py
+#
+# Small per-runner resume file (STATE_DIR/checkpoints/<name>.json). It records
+# the rows a run has in flight, with the phase each one reached, and the
+# last row up to which everything is finished, so a run interrupted by a
+# Chrome / network drop can start there instead of re-scanning the sheet, and
+# can check the target page for an in-flight row instead of resubmitting it.
+#
+#   cp = Checkpoint("submit_main", scope=ws.title)
+#   start = cp.resume_from()            # None → nothing to resume
+#   cp.expect(rows)                     # optional: dispatched to workers, not started yet
+#   cp.begin(row, "search", sep_num=...)
+#   cp.phase(row, "save")
+#   cp.done(row)
+#   cp.hold(row)                        # another process owns it: not ours to finish
+#   cp.clear()                          # clean finish
+#
+# last_done never passes a row that is still in flight, expected or held, so
+# rows must be started (or expected) in ascending order, and a resume looks at
+# rows another host was working on again. Every change is written
+# atomically (temp file, fsync, os.replace), so a crash leaves either the old
+# or the new checkpoint.
+
+import json
+import os
+import threading
+from datetime import datetime
+from config import STATE_DIR
+
+
+class Checkpoint:
+    def __init__(self, name: str, scope: str = "", path: str | None = None):
+        self.name  = name
+        self.scope = scope
+        self.path  = path or os.path.join(STATE_DIR, "checkpoints", f"{name}.json")
+        self._lock = threading.Lock()
+        self.last_done = 0
+        self.in_flight = {}          # row → {"phase": ..., "since": ..., **info}
+        self._max_done = 0
+        self._expected = set()       # dispatched but not begun; in memory only
+        self._held     = set()       # owned by another process; in memory only
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("scope", "") != self.scope:
+            print(f"⚠️ Ignoring checkpoint {self.path}: it belongs to '{data.get('scope')}', not '{self.scope}'.")
+            return
+        self.last_done = self._max_done = int(data.get("last_done", 0))
+        self.in_flight = {int(row): info for row, info in data.get("in_flight", {}).items()}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        data = {
+            "scope":      self.scope,
+            "last_done":  self.last_done,
+            "in_flight":  {str(row): info for row, info in sorted(self.in_flight.items())},
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def resume_from(self) -> int | None:
+        """First sheet row an interrupted run still has to look at, or None if there is nothing to resume."""
+        with self._lock:
+            if not self.last_done and not self.in_flight:
+                return None
+            return min([self.last_done + 1, *self.in_flight])
+
+    def expect(self, rows):
+        """Rows handed to workers that will begin() them later, e.g. in a thread pool."""
+        with self._lock:
+            self._expected.update(rows)
+
+    def begin(self, row: int, phase: str, **info):
+        with self._lock:
+            self.in_flight[row] = {"phase": phase, "since": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **info}
+            self._save()
+
+    def phase(self, row: int, phase: str, **info):
+        with self._lock:
+            entry = self.in_flight.setdefault(row, {})
+            entry.update(info, phase=phase)
+            self._save()
+
+    def done(self, row: int):
+        with self._lock:
+            self.in_flight.pop(row, None)
+            self._expected.discard(row)
+            self._max_done = max(self._max_done, row)
+            self._advance()
+            self._save()
+
+    def hold(self, row: int):
+        """A row claimed or leased by another process: dropped from in_flight, but last_done stays below it."""
+        with self._lock:
+            self.in_flight.pop(row, None)
+            self._expected.discard(row)
+            self._held.add(row)
+            self._advance()
+            self._save()
+
+    def _advance(self):
+        # everything below the lowest open row has been started and finished by us
+        open_rows = self._expected.union(self.in_flight, self._held)
+        self.last_done = min(open_rows) - 1 if open_rows else self._max_done
+
+    def clear(self):
+        with self._lock:
+            self.last_done = self._max_done = 0
+            self.in_flight = {}
+            self._expected = set()
+            self._held     = set()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
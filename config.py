@@ -18,13 +18,25 @@ APOTEK_SELECTORS = {
     "receipt_input":       "#ctl00_ctl00_ASPxSplitter1_Content_ContentSplitter_MainContent_txtNoResep_I",           # No Resep field  
     "simpan_button":       "#ctl00_ctl00_ASPxSplitter1_Content_ContentSplitter_MainContent_BtnSimpan_CD", # Simpan button  
     "reset_button":        "#ctl00_ctl00_ASPxSplitter1_Content_ContentSplitter_MainContent_BtnReset_CD",  # Reset button  
+    "resep_filter":        "#ctl00_ctl00_ASPxSplitter1_Content_ContentSplitter_MainContent_GvDaftarResep_DXFREditorcol13_I",  # Daftar Resep grid: No Resep filter  
 }
+APOTEK_DAFTAR_RESEP_URL = "https://apotek.bpjs-kesehatan.go.id/apotek/DaftarResep.aspx"  # submitted resep (checked on resume)  
+
+# — Chrome DevTools (shared logged-in Chrome, see chrome-debugging.sh) —  
+CDP_ENDPOINT    = "http://127.0.0.1:9222"  
+CDP_BROKER_PORT = 9230   # cdp_broker.py: hands out dedicated tabs to concurrent jobs
 
 # — Google Sheets settings —  
 SHEET_URL            = "https://docs.google.com/spreadsheets/d/1f-quvC9jSRnTvjMKFUbsge0XES4gQ3vSxbE44TUGG4o"  
 WORKSHEET_NAME       = "sep_web_driver"  
 SERVICE_ACCOUNT_PATH = "./keys/sep-sync-bot.json"  
 
+# — Local run state (journals, caches, checkpoints) —  
+STATE_DIR            = "./state"  
+
+# — Metrics (metrics.py): per-run JSONL under STATE_DIR/metrics, summary at exit —  
+METRICS_PROMETHEUS_PORT = None   # e.g. 9464 to serve http://127.0.0.1:9464/metrics
+
 # — Column headers for sep_web_driver (A→G) —  
 SEP_SHEET_HEADERS = [  
     "sep_dttm",      # A: timestamp
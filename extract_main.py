@@ -1,33 +1,128 @@
 import asyncio
-from sirs_runner import init_sirs_manual, get_claim_records, download_claims, set_playwright_context
+import concurrent.futures
+import time
+import metrics
+from sirs_runner import init_sirs_manual, get_claim_records, download_claims, set_playwright_context, release_playwright_context
 from sheets_handler import get_worksheet, write_initial_sep_rows
 from config import WORKSHEET_NAME
+from job_queue import JobQueue
 from playwright.async_api import async_playwright
 
-async def main(start_day: int, end_day: int, bulan: str):
+STAGES = ("sirs_process", "scrape", "sheet_write", "download")
+
+
+def _timed_write(ws, records, timings, date_str, jobs=None):
+    """Sheet write for one day, run in the background executor; records its own duration."""
+    t0 = time.perf_counter()
+    inserted, skipped = write_initial_sep_rows(ws, records, jobs=jobs)
+    timings.setdefault("sheet_write", []).append((date_str, time.perf_counter() - t0))
+    return inserted, skipped
+
+
+def _print_timings(timings: dict, wall: float):
+    print("\n⏱  Stage timing breakdown:", flush=True)
+    print(f"  {'stage':<13}{'days':>6}{'total s':>10}{'avg s':>9}{'max s':>9}", flush=True)
+    for stage in STAGES:
+        durations = [d for _, d in timings.get(stage, [])]
+        if not durations:
+            continue
+        print(f"  {stage:<13}{len(durations):>6}{sum(durations):>10.1f}"
+              f"{sum(durations) / len(durations):>9.1f}{max(durations):>9.1f}", flush=True)
+    busy = sum(d for stage in STAGES for _, d in timings.get(stage, []))
+    print(f"  wall clock {wall:.1f}s for {busy:.1f}s of stage work", flush=True)
+
+
+async def main(start_day: int, end_day: int, bulan: str, pipelined: bool = True, enqueue: bool = True):
+    """
+    Extract SEP records for each day in [start_day, end_day].
+    pipelined=True hands the sheet write for day N to a background executor
+    while SIRS processes day N+1 (the download stays on the page, since it
+    needs day N's table still showing).
+    enqueue=True also queues every appended row for submit_daemon (job_queue.JobQueue).
+    """
+    timings = {}
+    run_started = time.perf_counter()
+    ws = get_worksheet(WORKSHEET_NAME)  # one worksheet client for the whole run
+    jobs = JobQueue() if enqueue else None
+    loop = asyncio.get_running_loop()
+    pending_writes = []
+    failed_writes = []  # (date_str, records) whose sheet write raised; retried once at the end
+
     async with async_playwright() as p:
         await set_playwright_context(p)  # sets _playwright, _browser, _page
 
-        for day in range(start_day, end_day + 1):
-            date_str = str(day)
-            print(f"\n🔁 Processing date {date_str} {bulan} ...", flush=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as writer:
+            for day in range(start_day, end_day + 1):
+                date_str = str(day)
+                print(f"\n🔁 Processing date {date_str} {bulan} ...", flush=True)
+
+                t0 = time.perf_counter()
+                await init_sirs_manual(date=date_str, bulan=bulan)
+                timings.setdefault("sirs_process", []).append((date_str, time.perf_counter() - t0))
+
+                t0 = time.perf_counter()
+                records = await get_claim_records()
+                timings.setdefault("scrape", []).append((date_str, time.perf_counter() - t0))
+
+                write_fut = loop.run_in_executor(writer, _timed_write, ws, records, timings, date_str, jobs)
+
+                t0 = time.perf_counter()
+                download_ok = await download_claims()
+                timings.setdefault("download", []).append((date_str, time.perf_counter() - t0))
+
+                if pipelined:
+                    pending_writes.append((date_str, records, download_ok, write_fut))
+                    continue
+
+                try:
+                    inserted, skipped = await write_fut
+                except Exception as e:
+                    print(f"❌ {date_str}: sheet write failed: {e}", flush=True)
+                    failed_writes.append((date_str, records))
+                    continue
+                if download_ok:
+                    print(f"✅ {date_str}: Wrote {inserted} new records into your sheet ({skipped} already there).", flush=True)
+                    print(f"✅ {date_str}: downloaded the claims.", flush=True)
+                    print("----------------------------------", flush=True)
+
+            for date_str, records, download_ok, write_fut in pending_writes:
+                try:
+                    inserted, skipped = await write_fut
+                except Exception as e:
+                    print(f"❌ {date_str}: sheet write failed: {e}", flush=True)
+                    failed_writes.append((date_str, records))
+                    continue
+                if download_ok:
+                    print(f"✅ {date_str}: Wrote {inserted} new records into your sheet ({skipped} already there).", flush=True)
+                    print(f"✅ {date_str}: downloaded the claims.", flush=True)
+                    print("----------------------------------", flush=True)
+
+            # The scraped rows are still in hand; retry each failed day once rather than
+            # lose them. write_initial_sep_rows skips rows already on the sheet.
+            for date_str, records in failed_writes:
+                try:
+                    inserted, skipped = await loop.run_in_executor(
+                        writer, _timed_write, ws, records, timings, date_str, jobs)
+                except Exception as e:
+                    print(f"❌ {date_str}: sheet write failed again, {len(records)} rows not written: {e}", flush=True)
+                    continue
+                print(f"✅ {date_str}: retry wrote {inserted} new records ({skipped} already there).", flush=True)
+
+        await release_playwright_context()
+    if jobs is not None:
+        jobs.close()
 
-            await init_sirs_manual(date=date_str, bulan=bulan)
-            records = await get_claim_records()
-            ws = get_worksheet(WORKSHEET_NAME)
-            write_ok = write_initial_sep_rows(ws, records)  # sync
-            download_ok = await download_claims()
-            if download_ok and write_ok:
-                print(f"✅ {date_str}: Wrote {len(records)} records into your sheet.", flush=True)
-                print(f"✅ {date_str}: downloaded the claims.", flush=True)
-                print("----------------------------------", flush=True)
+    _print_timings(timings, time.perf_counter() - run_started)
 
 if __name__ == "__main__":
+    metrics.configure("extract_main")
     while True:
         start = int(input("Start date (DD): ").strip())
         end = int(input("End date (DD): ").strip())
         bulan = input("Bulan (e.g. September): ").strip()
-        asyncio.run(main(start, end, bulan))
+        pipelined = input("Pipelined mode? (Y/n): ").strip().lower() != "n"
+        enqueue = input("Queue new rows for submit_daemon? (Y/n): ").strip().lower() != "n"
+        asyncio.run(main(start, end, bulan, pipelined=pipelined, enqueue=enqueue))
         again = input("Run again? (y/n): ").strip().lower()
         if again != "y":
             break
@@ -0,0 +1,259 @@
+# job_queue.py
+#
+# Durable local queue between extraction and submission (STATE_DIR/jobs.sqlite).
+# write_initial_sep_rows / append_sep_records enqueue one job per
+# sep_web_driver row they append, and submit_daemon.py claims jobs as they
+# arrive, so a SEP reaches Apotek seconds after it was scraped instead of at
+# the next manual submit_main run. Producers and the daemon are separate
+# processes sharing the file (WAL mode). A job claimed by a worker that died
+# is handed out again once its lease runs out.
+#
+#   jobs = JobQueue()
+#   jobs.enqueue(ws.title, [(row_idx, rec), ...])     # producer: SepRecords just appended
+#   job = jobs.claim("host/tab-1", lease=900)          # consumer; None when nothing is ready
+#   jobs.finish(job.id)  /  jobs.retry(job.id, "error text")
+#   jobs.stats()                                       # depth per state, wait / latency percentiles
+
+import os
+import sqlite3
+import threading
+import time
+import metrics
+from config import STATE_DIR
+from records import normalize_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet        TEXT NOT NULL,
+    row_idx      INTEGER NOT NULL,
+    sep_num      TEXT NOT NULL,
+    receipt_num  TEXT NOT NULL,
+    receipt_type TEXT NOT NULL,
+    state        TEXT NOT NULL DEFAULT 'queued',   -- queued / running / done / failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    enqueued_at  REAL NOT NULL,
+    run_after    REAL NOT NULL,                    -- not claimable before (retry backoff, lease expiry)
+    started_at   REAL,
+    finished_at  REAL,
+    worker       TEXT,
+    error        TEXT,
+    UNIQUE (sheet, row_idx)
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_ready    ON jobs (state, run_after);
+CREATE INDEX IF NOT EXISTS ix_jobs_finished ON jobs (state, finished_at);
+"""
+
+STATES = ("queued", "running", "done", "failed")
+
+
+def _row_key(sep_num, receipt_num) -> str:
+    """What a job stands for besides its row: normalized SEP + receipt number."""
+    return f"{normalize_key(sep_num)}|{normalize_key(receipt_num)}"
+
+
+class Job:
+    """One claimed queue entry: the sep_web_driver row to submit."""
+    __slots__ = ("id", "sheet", "row", "sep_num", "receipt_num", "receipt_type", "attempts", "enqueued_at")
+
+    def __init__(self, id, sheet, row, sep_num, receipt_num, receipt_type, attempts, enqueued_at):
+        self.id           = id
+        self.sheet        = sheet
+        self.row          = row
+        self.sep_num      = sep_num
+        self.receipt_num  = receipt_num
+        self.receipt_type = receipt_type
+        self.attempts     = attempts
+        self.enqueued_at  = enqueued_at
+
+    def __repr__(self):
+        return f"Job(id={self.id}, {self.sheet}!{self.row}, sep={self.sep_num}, receipt={self.receipt_num})"
+
+
+class JobQueue:
+    """SQLite-backed submission queue, safe to share between threads and processes."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.join(STATE_DIR, "jobs.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # autocommit; claim() takes the write lock itself with BEGIN IMMEDIATE
+        self._db   = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.create_function("row_key", 2, _row_key, deterministic=True)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- producer -----------------------------------------------------------
+
+    def enqueue(self, sheet: str, rows) -> int:
+        """
+        Queue (row_idx, SepRecord) pairs of `sheet` for submission. A job for
+        the same row and the same SEP / receipt is left alone (already queued or
+        handled); a job for that row holding another SEP (the sheet was cleared
+        and the row reused) is replaced by a fresh one with a new id, so a worker
+        still busy with the old job cannot finish or fail the new one.
+        Returns the number added.
+        """
+        now = time.time()
+        params = [(sheet, row_idx, rec.sep_num, rec.receipt_num, rec.receipt_type, now, now) for row_idx, rec in rows]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._db.total_changes
+                self._db.executemany(
+                    "DELETE FROM jobs WHERE sheet = ? AND row_idx = ? AND row_key(sep_num, receipt_num) != row_key(?, ?)",
+                    [(sheet, row_idx, sep_num, receipt_num) for sheet, row_idx, sep_num, receipt_num, *_ in params],
+                )
+                replaced = self._db.total_changes - before
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO jobs (sheet, row_idx, sep_num, receipt_num, receipt_type, enqueued_at, run_after) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", params,
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            added = self._db.total_changes - before - replaced
+        metrics.count("queue.enqueued", added)
+        if replaced:
+            metrics.count("queue.replaced", replaced)
+        return added
+
+    # --- consumer -----------------------------------------------------------
+
+    def claim(self, worker: str, lease: float = 900) -> Job | None:
+        """
+        Oldest ready job, marked running for `worker`. A running job whose
+        lease expired (worker died mid-submit) counts as ready again.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, sheet, row_idx, sep_num, receipt_num, receipt_type, attempts, enqueued_at FROM jobs "
+                    "WHERE state IN ('queued', 'running') AND run_after <= ? ORDER BY run_after, id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, "
+                        "started_at = ?, run_after = ? WHERE id = ?",
+                        (worker, now, now + lease, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = Job(*row)
+        job.attempts += 1
+        metrics.observe("queue.wait", now - job.enqueued_at)
+        return job
+
+    def finish(self, job_id: int):
+        """The row went through submission (its result is on the sheet)."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = 'done', finished_at = ?, error = NULL WHERE id = ?", (now, job_id)
+            )
+            enqueued = self._db.execute("SELECT enqueued_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if enqueued:
+            metrics.observe("queue.latency", now - enqueued[0])
+
+    def retry(self, job_id: int, error: str, max_attempts: int = 5, backoff: float = 30.0) -> bool:
+        """
+        Put a job that could not be handled back in the queue, after
+        backoff · 2^(attempts-1) seconds; after max_attempts it is marked failed.
+        Returns True if it will be retried.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            attempts = row[0] if row else max_attempts
+            if attempts < max_attempts:
+                self._db.execute(
+                    "UPDATE jobs SET state = 'queued', run_after = ?, error = ? WHERE id = ?",
+                    (now + backoff * 2 ** (attempts - 1), error, job_id),
+                )
+        if attempts >= max_attempts:
+            self.fail(job_id, error)
+            return False
+        metrics.count("queue.retried")
+        return True
+
+    def fail(self, job_id: int, error: str):
+        """Give up on a job without retrying (e.g. its sheet row no longer matches)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = 'failed', finished_at = ?, error = ? WHERE id = ?", (time.time(), error, job_id)
+            )
+        metrics.count("queue.failed")
+
+    def requeue_failed(self) -> int:
+        """Give every failed job a fresh set of attempts. Returns how many."""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET state = 'queued', attempts = 0, run_after = ?, finished_at = NULL "
+                "WHERE state = 'failed'", (time.time(),),
+            )
+            return cur.rowcount
+
+    def purge(self, older_than: float = 7 * 86400) -> int:
+        """Drop done jobs finished more than `older_than` seconds ago. Returns how many."""
+        with self._lock:
+            cur = self._db.execute(
+                "DELETE FROM jobs WHERE state = 'done' AND finished_at < ?", (time.time() - older_than,)
+            )
+            return cur.rowcount
+
+    # --- stats --------------------------------------------------------------
+
+    def depth(self) -> int:
+        """Jobs not finished yet (queued or running)."""
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM jobs WHERE state IN ('queued', 'running')").fetchone()[0]
+
+    def stats(self, window: float = 3600) -> dict:
+        """
+        Queue depth per state, age of the oldest unfinished job, and for jobs
+        finished in the last `window` seconds the p50 / p95 of wait (enqueue →
+        claim) and latency (enqueue → done), in seconds.
+        """
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT state, count(*) FROM jobs GROUP BY state").fetchall())
+            oldest = self._db.execute(
+                "SELECT min(enqueued_at) FROM jobs WHERE state IN ('queued', 'running')"
+            ).fetchone()[0]
+            recent = self._db.execute(
+                "SELECT started_at - enqueued_at, finished_at - enqueued_at FROM jobs "
+                "WHERE state = 'done' AND finished_at >= ?", (now - window,),
+            ).fetchall()
+        waits     = [w for w, _ in recent]
+        latencies = [l for _, l in recent]
+        return {
+            **{state: counts.get(state, 0) for state in STATES},
+            "oldest_age":  now - oldest if oldest else 0.0,
+            "done_recent": len(recent),
+            "wait_p50":    metrics.percentile(waits, 50),
+            "wait_p95":    metrics.percentile(waits, 95),
+            "latency_p50": metrics.percentile(latencies, 50),
+            "latency_p95": metrics.percentile(latencies, 95),
+        }
+
+
+def format_stats(stats: dict) -> str:
+    """One-line summary of JobQueue.stats() for logs."""
+    return (f"queued {stats['queued']}, running {stats['running']}, done {stats['done']}, "
+            f"failed {stats['failed']}, oldest {stats['oldest_age']:.0f}s; last {stats['done_recent']} done: "
+            f"wait p50 {stats['wait_p50']:.1f}s p95 {stats['wait_p95']:.1f}s, "
+            f"latency p50 {stats['latency_p50']:.1f}s p95 {stats['latency_p95']:.1f}s")
@@ -0,0 +1,223 @@
+# metrics.py
+#
+# Shared instrumentation for every runner: timers and counters per phase
+# (navigation, autocomplete, dialog wait, Sheets read/write, backoff, claim).
+#
+#   import metrics
+#   metrics.configure("submit_main")              # once per entry point
+#   with metrics.timer("sheets.read"): ...
+#   metrics.count("claim.lost")
+#
+# Every sample is appended to state/metrics/<run>-<timestamp>.jsonl, a summary
+# table is printed at exit, and (optionally) a Prometheus text endpoint is served
+# on 127.0.0.1:<port>/metrics.
+
+import atexit
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import STATE_DIR, METRICS_PROMETHEUS_PORT
+
+RESERVOIR = 1024    # duration samples kept per timer for percentiles
+
+_lock     = threading.Lock()
+_timers   = {}      # name -> _Timer
+_counters = {}      # name -> total
+_run      = None
+_events   = None    # open JSONL file
+_server   = None
+
+
+def configure(run: str, jsonl: bool = True, prometheus_port: int | None = None):
+    """
+    Name this run, open its JSONL event log and register the exit summary.
+    prometheus_port (or config.METRICS_PROMETHEUS_PORT) starts the text endpoint.
+    """
+    global _run, _events
+    with _lock:
+        if _run is not None:
+            return
+        _run = run
+        if jsonl:
+            folder = os.path.join(STATE_DIR, "metrics")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{run}-{datetime.now():%Y%m%d-%H%M%S}.jsonl")
+            _events = open(path, "a", encoding="utf-8", buffering=1)
+    atexit.register(_shutdown)
+    port = prometheus_port or METRICS_PROMETHEUS_PORT
+    if port:
+        start_prometheus(port)
+
+
+class _Timer:
+    """
+    Exact count / sum / max of a timer plus a uniform random sample of at most
+    RESERVOIR durations (reservoir sampling), so memory stays flat in long runs.
+    """
+    __slots__ = ("count", "total", "max", "sample")
+
+    def __init__(self):
+        self.count  = 0
+        self.total  = 0.0
+        self.max    = 0.0
+        self.sample = []
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max    = max(self.max, seconds)
+        if len(self.sample) < RESERVOIR:
+            self.sample.append(seconds)
+        else:
+            k = random.randrange(self.count)
+            if k < RESERVOIR:
+                self.sample[k] = seconds
+
+
+def _emit(kind: str, name: str, value: float, labels: dict):
+    if _events is None:
+        return
+    event = {"ts": datetime.now().isoformat(timespec="milliseconds"), "run": _run,
+             "kind": kind, "name": name, "value": round(value, 6)}
+    if labels:
+        event["labels"] = labels
+    _events.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def observe(name: str, seconds: float, **labels):
+    """Record one duration sample for timer `name`."""
+    with _lock:
+        t = _timers.get(name)
+        if t is None:
+            t = _timers[name] = _Timer()
+        t.add(seconds)
+        _emit("timer", name, seconds, labels)
+
+
+def count(name: str, n: float = 1, **labels):
+    """Increment counter `name`."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+        _emit("counter", name, n, labels)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Time the enclosed block (works inside coroutines too — it measures wall time)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def timed(name: str):
+    """Decorator form of timer() for plain functions."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with timer(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def samples(name: str) -> list[float]:
+    """Sampled durations of timer `name` (all of them up to RESERVOIR, a uniform sample beyond)."""
+    with _lock:
+        t = _timers.get(name)
+        return list(t.sample) if t else []
+
+
+def stats(name: str) -> tuple[int, float, float]:
+    """Exact (count, total seconds, max seconds) of timer `name`."""
+    with _lock:
+        t = _timers.get(name)
+        return (t.count, t.total, t.max) if t else (0, 0.0, 0.0)
+
+
+def _snapshot():
+    with _lock:
+        timers   = {k: (t.count, t.total, t.max, list(t.sample)) for k, t in _timers.items()}
+        counters = dict(_counters)
+    return timers, counters
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summary() -> str:
+    """Printable table of every timer and counter recorded in this process."""
+    timers, counters = _snapshot()
+    lines = [f"  {'metric':<28}{'n':>7}{'total s':>10}{'p50 s':>8}{'p95 s':>8}{'max s':>8}"]
+    for name in sorted(timers):
+        n, total, top, v = timers[name]
+        lines.append(f"  {name:<28}{n:>7}{total:>10.1f}{percentile(v, 50):>8.2f}"
+                     f"{percentile(v, 95):>8.2f}{top:>8.2f}")
+    for name in sorted(counters):
+        lines.append(f"  {name:<28}{counters[name]:>7g}")
+    return "\n".join(lines)
+
+
+def prometheus_text() -> str:
+    """Current metrics in Prometheus text exposition format."""
+    timers, counters = _snapshot()
+    out = []
+    for name, (n, total, _, v) in sorted(timers.items()):
+        metric = "apotek_" + name.replace(".", "_").replace("-", "_") + "_seconds"
+        out.append(f"# TYPE {metric} summary")
+        for q in (0.5, 0.95):
+            out.append(f'{metric}{{quantile="{q}"}} {percentile(v, q * 100):.6f}')
+        out.append(f"{metric}_sum {total:.6f}")
+        out.append(f"{metric}_count {n}")
+    for name, total in sorted(counters.items()):
+        metric = "apotek_" + name.replace(".", "_").replace("-", "_") + "_total"
+        out.append(f"# TYPE {metric} counter")
+        out.append(f"{metric} {total:g}")
+    return "\n".join(out) + "\n"
+
+
+def start_prometheus(port: int, host: str = "127.0.0.1"):
+    """Serve prometheus_text() on http://host:port/metrics from a daemon thread."""
+    global _server
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"📈 Prometheus metrics on http://{host}:{port}/metrics")
+
+
+def _shutdown():
+    if _timers or _counters:
+        print(f"\n📊 Metrics summary ({_run}):")
+        print(summary())
+    if _events is not None:
+        _events.close()
+    if _server is not None:
+        _server.shutdown()
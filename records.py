@@ -0,0 +1,125 @@
+# records.py
+#
+# Row types shared by every runner. A sheet row, scraped claim or workbook row
+# is normalised once when it is loaded (text stripped, status lowercased,
+# obat keys pre-computed), so the loops compare attributes instead of
+# repeating str(...).strip().lower() per access. __slots__ keeps a row at a
+# fraction of the size of the equivalent dict on 50k-row sheets.
+#
+#   rec = SepRecord.from_dict(row, row=idx)     # sep_web_driver / claim scrape / xlsx
+#   if rec.done: ...
+#   obat = ObatRecord(row, receipt_num=..., apol_id=..., qty=..., status=...)
+#   obat.resep_key, obat.kode_key               # normalize_key() of receipt_num / apol_id
+
+# Statuses that mean "already handled" across the sep / resep / obat sheets.
+DONE_STATUSES = frozenset({"normal", "done", "error", "not_found", "checked", "null"})
+
+
+def text(value) -> str:
+    """Cell value as stripped text ('' for None)."""
+    return "" if value is None else str(value).strip()
+
+
+def status_of(value) -> str:
+    """Status cell as compared everywhere: stripped, lowercase."""
+    return text(value).lower()
+
+
+def normalize_key(value) -> str:
+    """Normalize receipt_num / apol_id: strip(), drop quote prefix, remove leading zeros, lowercase."""
+    return text(value).replace("'", "").lstrip("0").lower()
+
+
+class _Record:
+    """Shared plumbing; subclasses list their fields in FIELDS (sheet column names) and __slots__."""
+    __slots__ = ()
+    FIELDS: tuple[str, ...] = ()
+    ALIASES: dict[str, str] = {}
+
+    @classmethod
+    def from_dict(cls, data: dict, row: int = 0):
+        """Build from a header-keyed dict (read_all_records, StateStore, scraper output); unknown keys are ignored."""
+        fields = {}
+        for key, value in data.items():
+            key = text(key).lower()
+            key = cls.ALIASES.get(key, key)
+            if key in cls.FIELDS and key not in fields:
+                fields[key] = value
+        return cls(row, **fields)
+
+    def as_dict(self) -> dict:
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.row == other.row and all(getattr(self, f) == getattr(other, f) for f in self.FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.FIELDS if getattr(self, f))
+        return f"{type(self).__name__}(row={self.row}, {fields})"
+
+
+class SepRecord(_Record):
+    """A sep_web_driver row (A→K), or a claim about to become one (row 0)."""
+    __slots__ = ("row", "sep_dttm", "mrn", "sep_num", "receipt_num", "receipt_type", "processing_by",
+                 "processing_started", "submission_id", "updated_dttm", "status", "note")
+    FIELDS = __slots__[1:]
+    ALIASES = {"dttm_sep": "sep_dttm"}
+
+    def __init__(self, row: int = 0, sep_dttm="", mrn="", sep_num="", receipt_num="", receipt_type="",
+                 processing_by="", processing_started="", submission_id="", updated_dttm="", status="", note=""):
+        self.row                = row
+        self.sep_dttm           = text(sep_dttm)
+        self.mrn                = text(mrn)
+        self.sep_num            = text(sep_num)
+        self.receipt_num        = text(receipt_num)
+        self.receipt_type       = text(receipt_type)
+        self.processing_by      = text(processing_by)
+        self.processing_started = text(processing_started)
+        self.submission_id      = text(submission_id)
+        self.updated_dttm       = text(updated_dttm)
+        self.status             = status_of(status)
+        self.note               = text(note)
+
+    @property
+    def done(self) -> bool:
+        """Idempotency: a row with submission_id or any status was handled in an earlier run."""
+        return bool(self.submission_id or self.status)
+
+
+class ResepRecord(_Record):
+    """A 'daftar resep' row."""
+    __slots__ = ("row", "receipt_num", "sep_num", "status")
+    FIELDS = __slots__[1:]
+
+    def __init__(self, row: int = 0, receipt_num="", sep_num="", status=""):
+        self.row         = row
+        self.receipt_num = text(receipt_num)
+        self.sep_num     = text(sep_num)
+        self.status      = status_of(status)
+
+    @property
+    def done(self) -> bool:
+        return self.status in DONE_STATUSES
+
+
+class ObatRecord(_Record):
+    """A 'daftar obat' row; resep_key / kode_key are the normalize_key() lookup keys."""
+    __slots__ = ("row", "receipt_num", "apol_id", "qty", "status", "resep_key", "kode_key")
+    FIELDS = ("receipt_num", "apol_id", "qty", "status")
+
+    def __init__(self, row: int = 0, receipt_num="", apol_id="", qty="", status=""):
+        self.row         = row
+        self.receipt_num = text(receipt_num)
+        self.apol_id     = text(apol_id)
+        self.qty         = text(qty)
+        self.status      = status_of(status)
+        self.resep_key   = normalize_key(self.receipt_num)
+        self.kode_key    = normalize_key(self.apol_id)
+
+    @property
+    def done(self) -> bool:
+        return self.status in DONE_STATUSES
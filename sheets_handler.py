@@ -1,48 +1,214 @@
+import atexit
 import gspread
+import json
+import metrics
+import os
+import random
+import re
+import requests
 import socket
+import threading
 import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.service_account import Credentials
+from gspread.exceptions import APIError
+from gspread.utils import rowcol_to_a1
+from records import SepRecord
 from config import (
     SERVICE_ACCOUNT_PATH,
     SHEET_URL,
     WORKSHEET_NAME,
-    SEP_SHEET_HEADERS
+    SEP_SHEET_HEADERS,
+    STATE_DIR
 )
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-def get_worksheet(name: str):
-    """Authenticate and open the named worksheet."""
-    creds  = Credentials.from_service_account_file(SERVICE_ACCOUNT_PATH, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    sheet  = client.open_by_url(SHEET_URL)
-    return sheet.worksheet(name)
+# Process-wide Sheets client: the service-account key is read once, every call
+# goes through one keep-alive connection pool shared by all threads, and the
+# access token is refreshed in the background before it expires. Spreadsheet
+# and worksheet handles are cached too, so repeat opens cost no API call.
+HTTP_POOL_SIZE        = 16     # keep-alive connections to sheets.googleapis.com
+TOKEN_REFRESH_MARGIN  = 600    # refresh this many seconds before the token expires
 
+_client        = None
+_spreadsheets  = {}    # url → Spreadsheet
+_worksheets    = {}    # (url, title) → Worksheet
+_client_lock   = threading.Lock()
 
-def write_initial_sep_rows(ws_sep, records: list[dict]):
+
+def _keep_token_fresh(creds, request):
+    """Daemon loop: refresh the token TOKEN_REFRESH_MARGIN s before expiry, so no call waits on it."""
+    while True:
+        expiry = creds.expiry  # naive UTC
+        now    = datetime.now(timezone.utc).replace(tzinfo=None)
+        wait   = (expiry - now).total_seconds() - TOKEN_REFRESH_MARGIN if expiry else 0
+        if wait > 0:
+            time.sleep(min(wait, 300))
+            continue
+        try:
+            with metrics.timer("sheets.token_refresh"):
+                creds.refresh(request)
+        except Exception as e:
+            print(f"⚠️ Sheets token refresh failed ({e}); retrying in 30s.")
+            time.sleep(30)
+
+
+def get_client() -> gspread.Client:
+    """The process-wide authorised gspread client (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            creds   = Credentials.from_service_account_file(SERVICE_ACCOUNT_PATH, scopes=SCOPES)
+            session = AuthorizedSession(creds)
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+            request = Request(session)
+            creds.refresh(request)  # token up front instead of on the first API call
+            threading.Thread(target=_keep_token_fresh, args=(creds, request),
+                             name="sheets-token", daemon=True).start()
+            _client = gspread.authorize(creds, session=session)
+        return _client
+
+
+def open_spreadsheet(url: str = SHEET_URL):
+    """Cached Spreadsheet handle for `url` (one metadata fetch per process)."""
+    with _client_lock:
+        ss = _spreadsheets.get(url)
+    if ss is None:
+        ss = get_client().open_by_url(url)
+        with _client_lock:
+            ss = _spreadsheets.setdefault(url, ss)
+    return ss
+
+
+@metrics.timed("sheets.open")
+def get_worksheet(name: str, url: str = SHEET_URL):
+    """Open the named worksheet; handles are cached per process (see get_client)."""
+    with _client_lock:
+        ws = _worksheets.get((url, name))
+    if ws is None:
+        ws = open_spreadsheet(url).worksheet(name)
+        with _client_lock:
+            ws = _worksheets.setdefault((url, name), ws)
+    return ws
+
+
+# (spreadsheet id, worksheet id) → set of sep keys already on the sheet
+_sep_key_cache = {}
+_sep_key_lock  = threading.Lock()
+
+def sep_key(sep_num, receipt_num) -> tuple[str, str]:
+    """Dedup key for a SEP row; receipt numbers lose leading zeros / quote prefixes the way Sheets stores them."""
+    sep     = str(sep_num or "").strip().replace("'", "").upper()
+    receipt = str(receipt_num or "").strip().replace("'", "").lstrip("0")
+    return sep, receipt
+
+def _existing_sep_keys(ws_sep) -> set:
+    """sep_num+receipt_num keys on the sheet, loaded once per worksheet with one C:D range read."""
+    cache_id = (getattr(ws_sep, "spreadsheet_id", None), ws_sep.id)
+    if cache_id not in _sep_key_cache:
+        with metrics.timer("sheets.read"):
+            values = ws_sep.batch_get(["C2:D"])[0]
+        _sep_key_cache[cache_id] = {
+            sep_key(row[0] if len(row) > 0 else "", row[1] if len(row) > 1 else "")
+            for row in values
+        }
+    return _sep_key_cache[cache_id]
+
+
+def _new_sep_records(ws_sep, records: list[SepRecord], dedupe: bool) -> tuple[list[SepRecord], set]:
+    """Records whose sep key is neither on the sheet nor earlier in `records`, and their keys. Call under _sep_key_lock."""
+    existing = _existing_sep_keys(ws_sep) if dedupe else set()
+    new_records, new_keys = [], set()
+    for rec in records:
+        key = sep_key(rec.sep_num, rec.receipt_num)
+        if dedupe and (key in existing or key in new_keys):
+            continue
+        new_keys.add(key)
+        new_records.append(rec)
+    return new_records, new_keys
+
+
+def _first_appended_row(response) -> int | None:
+    """First sheet row written by an append_rows call, from its updatedRange (None if unknown)."""
+    rng = ((response or {}).get("updates") or {}).get("updatedRange", "")
+    m = re.search(r"![A-Z]+(\d+)", rng)
+    return int(m.group(1)) if m else None
+
+
+def _enqueue_appended(ws_sep, jobs, response, records: list[SepRecord]):
+    """Hand rows just appended to the submission queue (job_queue.JobQueue)."""
+    first = _first_appended_row(response)
+    if first is None:
+        print(f"⚠️ Append response has no row range — {len(records)} rows not queued; submit_main will find them.")
+        return
+    added = jobs.enqueue(ws_sep.title, enumerate(records, start=first))
+    print(f"📬 Queued {added} rows ({first}–{first + len(records) - 1}) for submission.")
+
+
+def write_initial_sep_rows(ws_sep, records: list[SepRecord], dedupe: bool = True, jobs=None) -> tuple[int, int]:
     """
-    Clears sep_web_driver and writes header + one row per record:
-      A: dttm_sep, B: sep_num, C: receipt_num, D: receipt_type,
-      E: updated_dttm, F: status, G: note
+    Appends one row per record to sep_web_driver:
+      A: dttm_sep, B: mrn, C: sep_num, D: receipt_num, E: receipt_type
+
+    With dedupe=True (upsert mode) records whose sep_num+receipt_num already
+    exist on the sheet — or repeat within `records` — are skipped, so
+    re-extracting an overlapping date range appends nothing new. Existing keys
+    are read once per worksheet and cached. With a JobQueue in `jobs` every
+    appended row is also queued for submit_daemon. Returns (inserted, skipped).
     """
-    rows =[
-        [
-            rec["dttm_sep"],    # original visit date/time
-            rec["mrn"],         # medical record number
-            rec["sep_num"],     # SEP number
-            rec["receipt_num"], # prescription number
-            "Obat Kronis Blm Stabil", # receipt_type (manual entry)
+    with _sep_key_lock:
+        new_records, new_keys = _new_sep_records(ws_sep, records, dedupe)
+
+        rows =[
+            [
+                rec.sep_dttm,       # original visit date/time
+                rec.mrn,            # medical record number
+                rec.sep_num,        # SEP number
+                rec.receipt_num,    # prescription number
+                "Obat Kronis Blm Stabil", # receipt_type (manual entry)
+            ]
+            for rec in new_records
         ]
-        for rec in records
-    ]
-    print(f"Writing {len(rows)} records to Google Sheet...")
-    ws_sep.append_rows(rows)
+        skipped = len(records) - len(rows)
+        print(f"Writing {len(rows)} records to Google Sheet ({skipped} already present, skipped)...")
+        if rows:
+            with metrics.timer("sheets.write"):
+                response = ws_sep.append_rows(rows)
+            if jobs is not None:
+                _enqueue_appended(ws_sep, jobs, response, new_records)
+        if dedupe:
+            _existing_sep_keys(ws_sep).update(new_keys)
+        return len(rows), skipped
+
+
+def append_sep_records(ws_sep, records: list[SepRecord], dedupe: bool = True, jobs=None) -> tuple[int, int]:
+    """
+    Append SepRecords in ONE append_rows call, each field under the column the
+    sheet's own header row gives it (headers that are not SepRecord fields stay
+    blank). Dedupe and `jobs` as in write_initial_sep_rows. Returns (inserted, skipped).
+    """
+    with _sep_key_lock:
+        new_records, new_keys = _new_sep_records(ws_sep, records, dedupe)
+        if new_records:
+            with metrics.timer("sheets.read"):
+                headers = ws_sep.batch_get(["1:1"])[0]
+            headers = headers[0] if headers else SEP_SHEET_HEADERS
+            rows = [[getattr(rec, h) if h in SepRecord.FIELDS else "" for h in headers] for rec in new_records]
+            with metrics.timer("sheets.write"):
+                response = ws_sep.append_rows(rows, value_input_option="RAW")
+            if jobs is not None:
+                _enqueue_appended(ws_sep, jobs, response, new_records)
+        if dedupe:
+            _existing_sep_keys(ws_sep).update(new_keys)
+        return len(new_records), len(records) - len(new_records)
 
 
 def read_all_records(ws) -> list[dict]:
-    values = ws.get_all_values()
+    with metrics.timer("sheets.read"):
+        values = ws.get_all_values()
     if not values:
         return []
     headers = values[0]
@@ -51,6 +217,65 @@ def read_all_records(ws) -> list[dict]:
     return records
 
 
+# (spreadsheet id, worksheet id) → header row, for read_columns
+_header_cache = {}
+
+
+def sheet_headers(ws, refresh: bool = False) -> list[str]:
+    """Header row of a worksheet, read once per process (refresh=True re-reads it)."""
+    cache_id = (getattr(ws, "spreadsheet_id", None), ws.id)
+    if refresh or cache_id not in _header_cache:
+        with metrics.timer("sheets.read"):
+            header = ws.batch_get(["1:1"])[0]
+        _header_cache[cache_id] = [str(h).strip() for h in (header[0] if header else [])]
+    return _header_cache[cache_id]
+
+
+class Columns:
+    """
+    Columnar slice of a worksheet returned by read_columns(): rows[i] is the
+    sheet row of every cols[name][i]; last_row is the last row covered, i.e.
+    the after_row for the next incremental read.
+    """
+    __slots__ = ("rows", "cols", "last_row")
+
+    def __init__(self, rows: list[int], cols: dict[str, list[str]], last_row: int):
+        self.rows     = rows
+        self.cols     = cols
+        self.last_row = last_row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def tuples(self, *names):
+        """(row, value, ...) per sheet row, for `names` (default: every column read)."""
+        return zip(self.rows, *(self.cols[n] for n in (names or self.cols)))
+
+
+def read_columns(ws, names, after_row: int = 1) -> Columns:
+    """
+    Read only the named columns (matched case-insensitively against the header
+    row) for the rows after `after_row`, in ONE batch_get of per-column ranges.
+    Pass the previous result's last_row as after_row to fetch just the rows
+    appended since. Raises ValueError when a column is not on the sheet.
+    """
+    headers = [h.lower() for h in sheet_headers(ws)]
+    missing = [n for n in names if n.lower() not in headers]
+    if missing:
+        raise ValueError(f"columns {missing} not in '{ws.title}' headers {headers}")
+    letters = [rowcol_to_a1(1, headers.index(n.lower()) + 1).rstrip("0123456789") for n in names]
+    with metrics.timer("sheets.read"):
+        data = ws.batch_get([f"{col}{after_row + 1}:{col}" for col in letters])
+    # each range is trimmed of its own trailing blanks; pad to the longest one
+    n = max((len(col) for col in data), default=0)
+    cols = {
+        name: [(v[0] if v else "") for v in col] + [""] * (n - len(col))
+        for name, col in zip(names, data)
+    }
+    return Columns(list(range(after_row + 1, after_row + 1 + n)), cols, after_row + n)
+
+
+@metrics.timed("sheets.write")
 def update_sep_row(ws_sep, row_index: int, status: str, note: str):
     """
     Updates:
@@ -72,6 +297,16 @@ HOSTNAME = socket.gethostname()
 def _now_iso():
     return datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
 
+def _parse_ts(value: str) -> datetime | None:
+    """Parse a claim timestamp written by either _now_iso() or the older space-separated format."""
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+@metrics.timed("claim.row")
 def claim_row(ws, row_idx: int, ttl_seconds: int = 300, max_retries: int = 3, sleep: float = 0.4) -> bool:
     """
     Claim a row for processing using optimistic write+confirm.
@@ -102,8 +337,8 @@ def claim_row(ws, row_idx: int, ttl_seconds: int = 300, max_retries: int = 3, sl
             else:
                 # check TTL; attempt steal if stale
                 try:
-                    started_dt = datetime.strptime(current_started, "%Y-%m-%d %H:%M:%S")
-                    if datetime.now() - started_dt > timedelta(seconds=ttl_seconds):
+                    started_dt = _parse_ts(current_started)
+                    if started_dt is not None and datetime.now() - started_dt > timedelta(seconds=ttl_seconds):
                         batch = [
                             {"range": proc_by_cell, "values": [[HOSTNAME]]},
                             {"range": proc_started_cell, "values": [[_now_iso()]]},
@@ -121,6 +356,7 @@ def claim_row(ws, row_idx: int, ttl_seconds: int = 300, max_retries: int = 3, sl
         except Exception:
             # transient error — back off and retry
             time.sleep(sleep)
+    metrics.count("claim.lost")
     return False
 
 
@@ -140,6 +376,7 @@ def release_row_claim(ws, row_idx: int):
         pass
 
 
+@metrics.timed("sheets.write")
 def commit_row_result(ws, row_idx: int, status: str, note: str, submission_id: str | None = None):
     """
     Commit result and clear claim.
@@ -158,4 +395,524 @@ def commit_row_result(ws, row_idx: int, status: str, note: str, submission_id: s
     updates.append({"range": f"J{row_idx}", "values": [[status or ""]]})
     updates.append({"range": f"K{row_idx}", "values": [[note or "-"]]})
     ws.batch_clear([f"F{row_idx}", f"G{row_idx}"])
-    ws.batch_update(updates)
\ No newline at end of file
+    ws.batch_update(updates)
+
+
+def _a1_sheet(ws) -> str:
+    """Quoted sheet title for A1 ranges in values_batch_update."""
+    return "'" + ws.title.replace("'", "''") + "'"
+
+
+def result_journal_path(ws) -> str:
+    return os.path.join(STATE_DIR, f"{ws.title}.results.jsonl")
+
+
+def recover_result_journal(ws, journal_path: str | None = None) -> int:
+    """
+    Write the results a crashed buffered run left in its journal to the sheet,
+    in one values_batch_update, before anything scans for pending rows —
+    otherwise those rows look pending, their stale claim expires and they are
+    submitted again. Returns how many results were written; raises
+    RuntimeError when they cannot be, so the caller stops instead.
+    """
+    path = journal_path or result_journal_path(ws)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return 0
+    buffer = ResultBuffer(ws, flush_rows=0, flush_seconds=float("inf"), journal_path=path)
+    recovered = len(buffer._pending)
+    try:
+        if not buffer.flush():
+            raise RuntimeError(f"could not write {recovered} journaled results from {path} to the sheet; "
+                               f"not scanning for pending rows so they are not submitted twice")
+    finally:
+        buffer.close()
+    return recovered
+
+
+class ResultBuffer:
+    """
+    Write-back buffer for commit_row_result.
+
+    Results are appended to a local journal first (so a crash never loses a
+    submitted result), kept in memory, and flushed to the sheet as ONE
+    values_batch_update per `flush_rows` results or every `flush_seconds`,
+    plus at close()/interpreter exit. Each flushed row writes F:K in one range:
+      F, G => cleared claim, H => submission_id, I => updated_dttm, J => status, K => note
+
+    Rows keep their claim (F/G) until flushed, so other workers still skip them.
+    Unflushed journal entries from a previous run are re-queued on start-up;
+    call recover_result_journal() before scanning for pending rows so they
+    reach the sheet first.
+    Use `commit_row_result` as a drop-in for the module-level function.
+    """
+
+    def __init__(self, ws, flush_rows: int = 25, flush_seconds: float = 30.0, journal_path: str | None = None):
+        self.ws            = ws
+        self.flush_rows    = flush_rows
+        self.flush_seconds = flush_seconds
+        self.journal_path  = journal_path or result_journal_path(ws)
+        self._lock         = threading.RLock()
+        self._pending      = []      # journal entries not yet on the sheet
+        self._seq          = 0
+        self._oldest       = None    # monotonic time of the oldest pending entry
+        self._stop         = threading.Event()
+
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        self._replay_journal()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+        self._timer = threading.Thread(target=self._flush_loop, name="result-buffer", daemon=True)
+        self._timer.start()
+        atexit.register(self.close)
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        entries, flushed_upto = [], 0
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if "flushed" in entry:
+                    flushed_upto = max(flushed_upto, entry["flushed"])
+                else:
+                    entries.append(entry)
+        self._pending = [e for e in entries if e["seq"] > flushed_upto]
+        self._seq     = max([e["seq"] for e in entries], default=0)
+        if self._pending:
+            self._oldest = time.monotonic()
+            print(f"♻️  Re-queued {len(self._pending)} unflushed results from {self.journal_path}")
+
+    def _write_journal(self, entry: dict):
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def add(self, row_idx: int, status: str, note: str, submission_id: str | None = None):
+        with self._lock:
+            self._seq += 1
+            entry = {
+                "seq":           self._seq,
+                "row":           row_idx,
+                "submission_id": submission_id or "",
+                "ts":            _now_iso(),
+                "status":        status or "",
+                "note":          note or "-",
+            }
+            self._write_journal(entry)
+            self._pending.append(entry)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._pending) >= self.flush_rows:
+                self.flush()
+
+    def commit_row_result(self, ws, row_idx: int, status: str, note: str, submission_id: str | None = None):
+        """Same signature as the module-level commit_row_result, but buffered."""
+        self.add(row_idx, status, note, submission_id)
+
+    def flush(self) -> bool:
+        """Push every pending result in one values_batch_update. Returns False if the write failed."""
+        with self._lock:
+            if not self._pending:
+                return True
+            batch = list(self._pending)
+            sheet = _a1_sheet(self.ws)
+            body = {
+                "valueInputOption": "RAW",
+                "data": [
+                    {
+                        "range":  f"{sheet}!F{e['row']}:K{e['row']}",
+                        "values": [["", "", e["submission_id"], e["ts"], e["status"], e["note"]]],
+                    }
+                    for e in batch
+                ],
+            }
+            try:
+                with metrics.timer("sheets.write"):
+                    self.ws.spreadsheet.values_batch_update(body)
+            except Exception as e:
+                # keep everything queued; the timer retries on its next tick
+                print(f"⚠️ Result flush of {len(batch)} rows failed, will retry: {e}")
+                return False
+
+            self._pending = self._pending[len(batch):]
+            self._oldest  = time.monotonic() if self._pending else None
+            if self._pending:
+                self._write_journal({"flushed": batch[-1]["seq"]})
+            else:
+                # everything is on the sheet — start a fresh journal
+                self._journal.truncate(0)
+                self._journal.seek(0)
+            print(f"💾 Flushed {len(batch)} results to sheet in one batch.")
+            return True
+
+    def _flush_loop(self):
+        while not self._stop.wait(1.0):
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.flush_seconds
+            if due:
+                self.flush()
+
+    def close(self):
+        """Stop the timer and flush whatever is left (safe to call twice)."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._timer.join(timeout=5)
+        self.flush()
+        self._journal.close()
+
+
+def _contiguous_runs(rows: list[int]) -> list[tuple[int, int]]:
+    """[2, 3, 4, 7, 8] -> [(2, 4), (7, 8)]"""
+    runs = []
+    for r in sorted(rows):
+        if runs and r == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], r)
+        else:
+            runs.append((r, r))
+    return runs
+
+
+def _claim_cells(ws, rows: list[int]) -> dict[int, tuple[str, str]]:
+    """One batch_get of F:G over `rows` → {row: (processing_by, processing_started)}."""
+    runs   = _contiguous_runs(rows)
+    ranges = [f"F{a}:G{b}" for a, b in runs]
+    cells  = {}
+    for (a, b), values in zip(runs, ws.batch_get(ranges)):
+        for offset, r in enumerate(range(a, b + 1)):
+            row = values[offset] if offset < len(values) else []
+            owner   = (row[0] if len(row) > 0 else "").strip()
+            started = (row[1] if len(row) > 1 else "").strip()
+            cells[r] = (owner, started)
+    return cells
+
+
+class BlockLease:
+    """
+    Lease over a block of sheet rows claimed with claim_block().
+
+    A daemon thread re-stamps processing_started (G) for the rows still in
+    progress every ttl/3 seconds, in one batch write, so other hosts never see
+    them as stale. Call done(row) once a row's result is committed, and
+    close() when the block is finished: any row not marked done is released
+    (F, G cleared) so another worker can take it.
+    """
+
+    def __init__(self, ws, rows: list[int], ttl_seconds: int = 300):
+        self.ws          = ws
+        self.rows        = list(rows)
+        self.ttl_seconds = ttl_seconds
+        self._open       = set(rows)
+        self._lock       = threading.Lock()
+        self._stop       = threading.Event()
+        self._renewer    = threading.Thread(target=self._renew_loop, name="block-lease", daemon=True)
+        self._renewer.start()
+
+    def done(self, row_idx: int):
+        with self._lock:
+            self._open.discard(row_idx)
+
+    def _renew_loop(self):
+        while not self._stop.wait(max(self.ttl_seconds / 3, 1)):
+            with self._lock:
+                rows = sorted(self._open)
+                if not rows:
+                    continue
+                ts = _now_iso()
+                try:
+                    self.ws.batch_update([
+                        {"range": f"G{a}:G{b}", "values": [[ts]] * (b - a + 1)}
+                        for a, b in _contiguous_runs(rows)
+                    ])
+                except Exception as e:
+                    print(f"⚠️ Lease renewal for {len(rows)} rows failed: {e}")
+
+    def close(self):
+        """Stop renewing and release every row not marked done."""
+        self._stop.set()
+        self._renewer.join(timeout=5)
+        with self._lock:
+            rows = sorted(self._open)
+            self._open.clear()
+        if not rows:
+            return
+        try:
+            self.ws.batch_update([
+                {"range": f"F{a}:G{b}", "values": [["", ""]] * (b - a + 1)}
+                for a, b in _contiguous_runs(rows)
+            ])
+            print(f"↩️  Released {len(rows)} unfinished leased rows.")
+        except Exception:
+            pass
+
+
+@metrics.timed("claim.block")
+def claim_block(ws, rows: list[int], ttl_seconds: int = 300, settle: float = 0.25) -> BlockLease | None:
+    """
+    Claim a block of sheet rows (e.g. the next 25 pending ones) with one batch
+    read, one batch write and one batch read-back, instead of claim_row's
+    write/sleep/read per row.
+
+    Rows owned by someone else are skipped unless their claim is older than
+    `ttl_seconds`. Returns a BlockLease over the rows we won, or None when
+    none of them could be claimed.
+    """
+    if not rows:
+        return None
+
+    current = _claim_cells(ws, rows)
+    now     = datetime.now()
+    wanted  = []
+    for r in rows:
+        owner, started = current.get(r, ("", ""))
+        if owner:
+            started_dt = _parse_ts(started)
+            if started_dt is None or now - started_dt <= timedelta(seconds=ttl_seconds):
+                continue
+        wanted.append(r)
+    if not wanted:
+        return None
+
+    ts = _now_iso()
+    ws.batch_update([
+        {"range": f"F{a}:G{b}", "values": [[HOSTNAME, ts]] * (b - a + 1)}
+        for a, b in _contiguous_runs(wanted)
+    ])
+    time.sleep(settle)  # one settle delay per block (claim_row pays it per row)
+    confirm = _claim_cells(ws, wanted)
+    won = [r for r in wanted if confirm.get(r, ("", ""))[0] == HOSTNAME]
+    metrics.count("claim.lost", len(rows) - len(won))
+    return BlockLease(ws, won, ttl_seconds=ttl_seconds) if won else None
+
+
+# Sheets API write quota: 60 requests / minute / user / project.
+SHEETS_WRITES_PER_MINUTE = 60
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate     = rate
+        self.capacity = capacity
+        self._tokens  = capacity
+        self._last    = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            metrics.observe("sheets.throttle", wait)
+            time.sleep(wait)
+
+
+def _is_quota_error(e: Exception) -> bool:
+    code = getattr(getattr(e, "response", None), "status_code", None)
+    return code == 429 or "Quota exceeded" in str(e) or "RATE_LIMIT_EXCEEDED" in str(e)
+
+
+class CoalescingWriter:
+    """
+    Background writer for single-cell updates.
+
+    put()/put_row() return immediately. A worker thread drains the queue every
+    `linger` seconds (or once `max_batch` cells are waiting), keeps only the
+    last value per (worksheet, cell) and sends ONE batch_update per worksheet.
+    Calls are paced by a token bucket sized to the Sheets write quota; a 429
+    backs off exponentially (with jitter) and retries the same batch.
+
+    Ordering: batches go out strictly in queue order and a later write to a
+    cell always wins over an earlier one, so per-row ordering is preserved.
+
+    Cells still failing after `max_retries` are appended to a journal
+    (journal_path) and kept in `failed`; close() raises once if any were given
+    up, and replay_journal() queues a previous run's leftovers again. Callers
+    that must know a row reached the sheet pass put_row(on_written=...).
+    """
+
+    def __init__(self, linger: float = 1.0, max_batch: int = 200,
+                 writes_per_minute: int = SHEETS_WRITES_PER_MINUTE, max_retries: int = 6,
+                 value_input_option: str = "USER_ENTERED", journal_path: str | None = None):
+        self.linger             = linger
+        self.max_batch          = max_batch
+        self.max_retries        = max_retries
+        self.value_input_option = value_input_option
+        self.journal_path       = journal_path or os.path.join(STATE_DIR, "sheets_writer.unsent.jsonl")
+        self.bucket             = TokenBucket(writes_per_minute / 60.0, capacity=5)
+        self.stats              = {"cells": 0, "coalesced": 0, "batches": 0, "retries": 0, "failed": 0}
+        self.failed             = []   # (sheet title, cell, value) given up on
+        self._raised            = False
+        self._queue             = []   # (ws, cell, value, on_written | None) in arrival order
+        self._in_flight         = 0
+        self._cond              = threading.Condition()
+        self._closed            = False
+        self._flushing          = False
+        self._worker            = threading.Thread(target=self._run, name="sheets-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def put(self, ws, cell: str, value):
+        self.put_row(ws, {cell: value})
+
+    def put_row(self, ws, cells: dict, on_written=None):
+        """
+        Queue several cells of one row together (never split across batches).
+        on_written(ok) is called from the writer thread once the batch holding
+        them was written (True) or given up and journaled (False).
+        """
+        items = [(ws, cell, value, None) for cell, value in cells.items()]
+        if items and on_written is not None:
+            items[-1] = items[-1][:3] + (on_written,)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("CoalescingWriter is closed")
+            self._queue.extend(items)
+            self.stats["cells"] += len(cells)
+            self._cond.notify_all()
+
+    def replay_journal(self, *worksheets) -> int:
+        """
+        Queue again the cells an earlier run gave up on, for the given
+        worksheets (matched by spreadsheet id + title); entries for other
+        sheets stay in the journal. Returns the number of cells queued.
+        """
+        if not os.path.exists(self.journal_path):
+            return 0
+        by_key = {(getattr(ws, "spreadsheet_id", ""), ws.title): ws for ws in worksheets}
+        keep, replayed = [], 0
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                ws = by_key.get((entry.get("spreadsheet", ""), entry.get("sheet")))
+                if ws is None:
+                    keep.append(line if line.endswith("\n") else line + "\n")
+                    continue
+                self.put_row(ws, entry["cells"])
+                replayed += len(entry["cells"])
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(keep)
+        os.replace(tmp, self.journal_path)
+        if replayed:
+            print(f"♻️  Re-queued {replayed} unsent cells from {self.journal_path}")
+        return replayed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                # linger so more cells can join this batch
+                deadline = time.monotonic() + self.linger
+                while (len(self._queue) < self.max_batch and not self._closed and not self._flushing
+                       and time.monotonic() < deadline):
+                    self._cond.wait(deadline - time.monotonic())
+                items, self._queue = self._queue, []
+                self._in_flight = len(items)
+
+            # last value per (worksheet, cell); one batch per worksheet
+            per_ws = {}
+            for ws, cell, value, ack in items:
+                entry = per_ws.setdefault(id(ws), (ws, {}, []))
+                entry[1][cell] = value
+                if ack is not None:
+                    entry[2].append(ack)
+            for ws, cells, acks in per_ws.values():
+                ok = self._send(ws, cells)
+                for ack in acks:
+                    try:
+                        ack(ok)
+                    except Exception as e:
+                        print(f"⚠️ Write callback failed: {e}")
+            self.stats["coalesced"] += len(items) - sum(len(c) for _, c, _ in per_ws.values())
+
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _send(self, ws, cells: dict) -> bool:
+        """One batch_update with retries; False once the cells were given up (and journaled)."""
+        batch = [{"range": cell, "values": [[value]]} for cell, value in cells.items()]
+        error = None
+        for attempt in range(self.max_retries):
+            self.bucket.acquire()
+            try:
+                with metrics.timer("sheets.write"):
+                    ws.batch_update(batch, value_input_option=self.value_input_option)
+                self.stats["batches"] += 1
+                return True
+            except APIError as e:
+                error = e
+                self.stats["retries"] += 1
+                if _is_quota_error(e):
+                    wait = min(64, 2 ** attempt) + random.random()
+                    print(f"⚠️ Quota exceeded. Backing off {wait:.1f}s before retrying {len(batch)} cells...")
+                else:
+                    wait = 1 + random.random()
+                    print(f"⚠️ Sheet write failed ({e}); retrying {len(batch)} cells in {wait:.1f}s...")
+                metrics.observe("sheets.backoff", wait)
+                time.sleep(wait)
+            except Exception as e:
+                error = e
+                self.stats["retries"] += 1
+                print(f"⚠️ Sheet write failed ({e}); retrying {len(batch)} cells...")
+                wait = 1 + random.random()
+                metrics.observe("sheets.backoff", wait)
+                time.sleep(wait)
+        self.stats["failed"] += len(batch)
+        title = getattr(ws, "title", "?")
+        self.failed.extend((title, cell, value) for cell, value in cells.items())
+        entry = {"at": _now_iso(), "spreadsheet": getattr(ws, "spreadsheet_id", ""), "sheet": title,
+                 "cells": cells, "error": str(error)}
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"❌ Gave up writing {len(batch)} cells to '{title}': {list(cells)[:6]} — saved to {self.journal_path}")
+        return False
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything queued so far has been written or given up (see `failed`); False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing = False
+        return True
+
+    def close(self):
+        """
+        Flush pending writes and stop the worker (safe to call twice; also runs
+        at exit). Raises RuntimeError, once, if any cells had to be given up.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+        if self.failed and not self._raised:
+            self._raised = True
+            raise RuntimeError(f"{len(self.failed)} cells could not be written to the sheet; "
+                               f"saved to {self.journal_path}")
@@ -1,13 +1,24 @@
 import asyncio
-import gspread
+import concurrent.futures
+import cdp_broker
+import json
+import metrics
+import os
+import random
 import re
+import requests
+import time
 from datetime import datetime
-from google.oauth2.service_account import Credentials
-from playwright.async_api import async_playwright, TimeoutError as PWTimeoutError
-from config import SERVICE_ACCOUNT_PATH
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from playwright.async_api import TimeoutError as PWTimeoutError
+from config import CDP_ENDPOINT, STATE_DIR
+from sheets_handler import get_worksheet, _is_quota_error
 
 SIRS_URL = "http://10.67.2.229/sirs/index.php?XP_xrptoolrun_xrptools=3&run=y&rp_id=17"
 SHEET_NAME = "temp daftar obat"
+# rows that could not be appended after all retries, one JSON line per batch
+UNSENT_PATH = os.path.join(STATE_DIR, "sirs_extract_obat.unsent.jsonl")
 
 # === Your predefined doctor list (Penulis Resep IDs) ===
 DOCTOR_IDS = []
@@ -166,31 +177,22 @@ async def set_date_range(page, auto_submit: bool = True):
 
 
 # === PLAYWRIGHT SESSION ATTACH ===========================================
-async def attach_browser(cdp_endpoint="http://127.0.0.1:9222"):
-    """Attach to existing Chrome session."""
-    p = await async_playwright().start()
-    browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-    context = browser.contexts[0] if browser.contexts else await browser.new_context()
-    page = context.pages[0] if context.pages else await context.new_page()
+async def attach_browser(cdp_endpoint=CDP_ENDPOINT):
+    """Attach to existing Chrome session (tab leased from cdp_broker when it runs)."""
+    browser = await cdp_broker.connect(cdp_endpoint)
+    page = await cdp_broker.lease_page(browser, owner="sirs_extract_obat")
     print("✅ Attached to Chrome.")
-    return p, browser, page
+    return browser, page
 
 
 # === GOOGLE SHEETS =======================================================
 def open_sheet():
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_PATH, scopes=scopes)
-    client = gspread.authorize(creds)
+    # shared, cached client and handles (sheets_handler.get_client)
     #ss for drug_bot
-    ss = client.open_by_url(
-        "https://docs.google.com/spreadsheets/d/1MdEQrxNS6kuHkwks8Fgg6q29HxJ3qx2br-DPBpGecn4"
-    )
+    return get_worksheet(SHEET_NAME, "https://docs.google.com/spreadsheets/d/1MdEQrxNS6kuHkwks8Fgg6q29HxJ3qx2br-DPBpGecn4")
 
     #ss for review
-    # ss = client.open_by_url(
-    #     "https://docs.google.com/spreadsheets/d/1RJZ7eW-q2FrIheWII-0vhb9N0mPV2S5G1mF3vbZpVng"
-    # )
-    return ss.worksheet(SHEET_NAME)
+    # return get_worksheet(SHEET_NAME, "https://docs.google.com/spreadsheets/d/1RJZ7eW-q2FrIheWII-0vhb9N0mPV2S5G1mF3vbZpVng")
 
 
 # === TABLE EXTRACTION ====================================================
@@ -207,14 +209,343 @@ async def extract_table_rows(page):
     data = []
     for i in range(count):
         tds = await rows.nth(i).locator("td").all_inner_texts()
-        data.append(tds)
+        if tds:  # header rows (<th> only) have no cells
+            data.append(tds)
     print(f"📊 Extracted {len(data)} rows.")
     return data
 
 
+# === SHEET UPLOAD ========================================================
+def _append_with_retry(ws, rows, attempts: int = 5):
+    """append_rows with exponential backoff (longer on quota errors); raises the last error."""
+    for attempt in range(attempts):
+        try:
+            with metrics.timer("sheets.write"):
+                return ws.append_rows(rows, value_input_option="USER_ENTERED")
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            wait = (min(64, 2 ** (attempt + 2)) if _is_quota_error(e) else 2 ** attempt) + random.random()
+            print(f"⚠️ Uploading {len(rows)} rows failed ({e}); retrying in {wait:.1f}s...")
+            metrics.observe("sheets.backoff", wait)
+            time.sleep(wait)
+
+
+def upload_rows(ws, rows, doctors) -> bool:
+    """
+    Append scraped rows; if the sheet keeps refusing them they are saved to
+    UNSENT_PATH (with their doctor IDs) instead of being lost. Returns True if uploaded.
+    """
+    try:
+        _append_with_retry(ws, rows)
+        return True
+    except Exception as e:
+        os.makedirs(os.path.dirname(UNSENT_PATH) or ".", exist_ok=True)
+        with open(UNSENT_PATH, "a", encoding="utf-8") as f:
+            entry = {"at": datetime.now().isoformat(timespec="seconds"), "doctors": list(doctors),
+                     "error": str(e), "rows": rows}
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        metrics.count("sirs.unsent_rows", len(rows))
+        print(f"❌ Could not upload {len(rows)} rows for {len(doctors)} doctors ({e}); saved to {UNSENT_PATH}.")
+        return False
+
+
+def print_failures(failed, unsent):
+    """Final summary of doctors that could not be scraped or whose rows are only in UNSENT_PATH."""
+    if failed:
+        print(f"❌ {len(failed)} doctors failed (after one retry): {', '.join(failed)}")
+    if unsent:
+        print(f"❌ Rows of {len(unsent)} doctors were not uploaded and are in {UNSENT_PATH}: {', '.join(unsent)}")
+
+
+# === CONCURRENT EXTRACTION ===============================================
+# _JS_FORM_VALUES / _JS_APPLY_FORM_VALUES copy the #rpf filter values (date
+# range etc.) from the page the user prepared onto the extra worker pages.
+_JS_FORM_VALUES = """() => Array.from(document.querySelectorAll('#rpf input[id], #rpf select[id]'))
+    .filter(el => el.type !== 'button' && el.type !== 'submit')
+    .map(el => [el.id, el.value])"""
+
+_JS_APPLY_FORM_VALUES = """(pairs) => {
+    for (const [id, value] of pairs) {
+        const el = document.getElementById(id);
+        if (!el) continue;
+        el.value = value;
+        el.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+}"""
+
+
+async def scrape_doctor(page, doc_id):
+    """Select one doctor on the report form, submit, wait for the table and return its rows."""
+    with metrics.timer("sirs.report"):
+        return await _scrape_doctor(page, doc_id)
+
+
+async def _scrape_doctor(page, doc_id):
+    await page.select_option("#s_8_", doc_id)
+    await page.locator("input[value='Kirim']").click()
+
+    # wait for table refresh
+    try:
+        await page.wait_for_selector("div#loading", state="attached", timeout=2000)
+        await page.wait_for_selector("div#loading", state="detached", timeout=15000)
+    except:
+        pass  # tolerate SIRS variants without #loading div
+
+    return await extract_table_rows(page)
+
+
+async def _open_worker_page(context, source_page):
+    """New tab on the report form with the same filter values as `source_page`."""
+    page = await cdp_broker.lease_page(context.browser, owner="sirs_extract_obat", new_tab=True)
+    await page.goto(SIRS_URL)
+    await page.wait_for_selector("#rpf", timeout=15000)
+    values = [(k, v) for k, v in await source_page.evaluate(_JS_FORM_VALUES) if k != "s_8_"]
+    await page.evaluate(_JS_APPLY_FORM_VALUES, values)
+    return page
+
+
+async def _page_worker(page_no, page, doc_q, upload_q, counters, total, failed):
+    """
+    Take doctor IDs off the shared queue until it is empty; hand rows to the
+    uploader. Doctors whose scrape raised are added to `failed`.
+    """
+    stats = counters.setdefault(page_no, {"doctors": 0, "rows": 0, "started": time.monotonic(), "elapsed": 0.0})
+    while True:
+        try:
+            index, doc_id = doc_q.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        print(f"\n👩‍⚕️ [page {page_no}] num {index + 1} of {total} : Processing doctor ID: {doc_id}")
+        try:
+            rows = await scrape_doctor(page, doc_id)
+        except Exception as e:
+            print(f"❌ [page {page_no}] doctor {doc_id} failed: {e}")
+            failed.append((index, doc_id))
+            continue
+        stats["doctors"] += 1
+        stats["elapsed"] = time.monotonic() - stats["started"]
+        if not rows:
+            print(f"⚠️ No data for doctor {doc_id}")
+            continue
+        stats["rows"] += len(rows)
+        await upload_q.put((doc_id, rows))
+
+
+async def _uploader(ws, upload_q, batch_rows: int = 500, max_wait: float = 5.0):
+    """
+    Single sheet writer for all pages: buffers scraped rows and appends them in
+    one append_rows per `batch_rows` rows (or after `max_wait` s of quiet).
+    A None item flushes the rest and stops the uploader. Failed appends are
+    retried with backoff, then saved to disk (upload_rows); returns the doctor
+    IDs whose rows did not reach the sheet.
+    """
+    loop = asyncio.get_running_loop()
+    buffered, doctors, unsent = [], [], []
+
+    async def flush():
+        if not buffered:
+            return
+        rows, docs = list(buffered), list(doctors)
+        buffered.clear()
+        doctors.clear()
+        if await loop.run_in_executor(None, upload_rows, ws, rows, docs):
+            print(f"✅ Uploaded {len(rows)} rows for {len(docs)} doctors to sheet.")
+        else:
+            unsent.extend(docs)
+
+    while True:
+        try:
+            item = await asyncio.wait_for(upload_q.get(), timeout=max_wait)
+        except asyncio.TimeoutError:
+            await flush()
+            continue
+        if item is None:
+            await flush()
+            return unsent
+        doc_id, rows = item
+        buffered.extend(rows)
+        doctors.append(doc_id)
+        if len(buffered) >= batch_rows:
+            await flush()
+
+
+async def run_concurrent(page, doctor_ids, ws, pages: int):
+    """
+    Spread doctor IDs over `pages` tabs (the prepared page + pages-1 new ones)
+    through an asyncio queue; every scraped row goes to one batched uploader.
+    Doctors that failed are queued once more after the first pass.
+    """
+    doc_q = asyncio.Queue()
+    for item in enumerate(doctor_ids):
+        doc_q.put_nowait(item)
+    upload_q = asyncio.Queue()
+    counters, failed = {}, []
+
+    worker_pages = [page] + [await _open_worker_page(page.context, page) for _ in range(pages - 1)]
+    print(f"✅ {len(worker_pages)} report pages ready.")
+
+    uploader = asyncio.create_task(_uploader(ws, upload_q))
+    started = time.monotonic()
+    for attempt in (1, 2):
+        await asyncio.gather(*(
+            _page_worker(n, p, doc_q, upload_q, counters, len(doctor_ids), failed)
+            for n, p in enumerate(worker_pages, start=1)
+        ))
+        if not failed or attempt == 2:
+            break
+        print(f"\n🔁 Retrying {len(failed)} failed doctors once…")
+        for item in failed:
+            doc_q.put_nowait(item)
+        failed.clear()
+    await upload_q.put(None)
+    unsent = await uploader
+    elapsed = time.monotonic() - started
+
+    for extra in worker_pages[1:]:
+        if not await cdp_broker.release_page(extra):
+            await extra.close()
+
+    print("\n📊 Per-page throughput:")
+    for n in sorted(counters):
+        c = counters[n]
+        minutes = c["elapsed"] / 60 if c["elapsed"] else 0
+        rate = f"{c['doctors'] / minutes:.1f} doctors/min, {c['rows'] / minutes:.0f} rows/min" if minutes else "-"
+        print(f"  page {n}: {c['doctors']} doctors, {c['rows']} rows in {c['elapsed']:.0f}s ({rate})")
+    total_rows = sum(c["rows"] for c in counters.values())
+    print(f"  total : {len(doctor_ids)} doctors, {total_rows} rows in {elapsed:.0f}s")
+    print_failures([doc_id for _, doc_id in failed], unsent)
+
+
+# === DIRECT HTTP FETCH ===================================================
+# rp_id=17 is a plain server-rendered report, so once the browser is logged in
+# we can POST the #rpf form ourselves with the browser's session cookies and
+# parse table.qresult locally — no page per doctor, doctors run in threads.
+
+_JS_FORM_SNAPSHOT = """() => {
+    const form = document.querySelector('#rpf');
+    if (!form) return null;
+    return {
+        action: form.action || location.href,
+        method: (form.getAttribute('method') || 'post').toLowerCase(),
+        fields: Array.from(new FormData(form).entries()).filter(([, v]) => typeof v === 'string'),
+        userAgent: navigator.userAgent,
+    };
+}"""
+
+
+async def capture_report_form(page) -> dict:
+    """Snapshot the #rpf form (action, fields) and the session cookies of the logged-in page."""
+    form = await page.evaluate(_JS_FORM_SNAPSHOT)
+    if not form:
+        raise RuntimeError("Report form #rpf not found on the current page.")
+    form["cookies"] = await page.context.cookies(form["action"])
+    return form
+
+
+def make_http_session(form: dict, pool_size: int = 8) -> requests.Session:
+    """requests session with a keep-alive pool of `pool_size` connections and the browser's cookies."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = form.get("userAgent") or session.headers["User-Agent"]
+    for c in form.get("cookies", []):
+        session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+    return session
+
+
+def parse_report_html(html: str) -> list[list[str]]:
+    """
+    Rows of table.qresult as lists of cell texts (same shape as extract_table_rows).
+    html.parser adds no implicit <tbody>, so every <tr> of the table is read and
+    header rows (<th> cells / <thead>) are skipped. Raises RuntimeError when the
+    response has no table.qresult, e.g. SIRS answered with its login page.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.select_one("table.qresult")
+    if table is None:
+        if soup.find("input", attrs={"type": "password"}):
+            raise RuntimeError("SIRS returned its login page — the browser session has expired.")
+        raise RuntimeError("No table.qresult in the report response.")
+    return [
+        [" ".join(td.get_text().split()) for td in tr.find_all("td")]
+        for tr in table.find_all("tr")
+        if tr.find_parent("thead") is None and not tr.find("th") and tr.find("td")
+    ]
+
+
+@metrics.timed("sirs.report_http")
+def fetch_doctor_http(session: requests.Session, form: dict, doc_id: str, timeout: float = 60) -> list[list[str]]:
+    """Fetch the report for one doctor (#s_8_) with the captured form fields."""
+    fields = [(k, v) for k, v in form["fields"] if k != "s_8_"] + [("s_8_", doc_id)]
+    if form.get("method") == "get":
+        resp = session.get(form["action"], params=fields, timeout=timeout)
+    else:
+        resp = session.post(form["action"], data=fields, timeout=timeout)
+    resp.raise_for_status()
+    return parse_report_html(resp.text)
+
+
+async def run_http_extraction(page, doctor_ids, ws, threads: int = 8, batch_rows: int = 500):
+    """
+    Fetch every doctor's report over HTTP in `threads` parallel workers, reusing
+    the cookies of the CDP-attached Chrome; rows are appended in batches.
+    """
+    form = await capture_report_form(page)
+    session = make_http_session(form, pool_size=threads)
+    print(f"🌐 HTTP mode: {form['method'].upper()} {form['action']} with {len(form['cookies'])} cookies, {threads} threads.")
+
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    buffered, buffered_docs, total_rows = [], [], 0
+    todo, failed, unsent = list(doctor_ids), [], []
+
+    async def flush():
+        rows, docs = list(buffered), list(buffered_docs)
+        buffered.clear()
+        buffered_docs.clear()
+        if await loop.run_in_executor(None, upload_rows, ws, rows, docs):
+            print(f"✅ Uploaded {len(rows)} rows to sheet.")
+        else:
+            unsent.extend(docs)
+
+    async def fetch(pool, doc_id):
+        # Awaited through the loop so the fetch threads never block it.
+        try:
+            return doc_id, await loop.run_in_executor(pool, fetch_doctor_http, session, form, doc_id), None
+        except Exception as e:
+            return doc_id, None, e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        for attempt in (1, 2):
+            fetches = [fetch(pool, doc_id) for doc_id in todo]
+            for n, done in enumerate(asyncio.as_completed(fetches), start=1):
+                doc_id, rows, err = await done
+                if err is not None:
+                    print(f"❌ doctor {doc_id} failed: {err}")
+                    failed.append(doc_id)
+                    continue
+                print(f"👩‍⚕️ {n}/{len(todo)} doctor {doc_id}: {len(rows)} rows")
+                buffered.extend(rows)
+                buffered_docs.append(doc_id)
+                total_rows += len(rows)
+                if len(buffered) >= batch_rows:
+                    await flush()
+            if not failed or attempt == 2:
+                break
+            print(f"🔁 Retrying {len(failed)} failed doctors once…")
+            todo, failed = failed, []
+    if buffered:
+        await flush()
+    session.close()
+    print(f"📊 HTTP mode: {len(doctor_ids)} doctors, {total_rows} rows in {time.monotonic() - started:.0f}s")
+    print_failures(failed, unsent)
+
+
 # === MAIN RUNNER =========================================================
 async def run_extraction():
-    p, browser, page = await attach_browser()
+    browser, page = await attach_browser()
     ws = open_sheet()
 
     await page.goto(SIRS_URL)
@@ -226,40 +557,48 @@ async def run_extraction():
     await asyncio.sleep(5)
     loop = asyncio.get_running_loop()
     doctor_ids = await loop.run_in_executor(None, prompt_doctor_ids)
+    mode = await loop.run_in_executor(None, lambda: input("Fetch mode: [b]rowser or [h]ttp (Enter for browser): ").strip().lower())
+    prompt = "Parallel HTTP threads (Enter for 8): " if mode.startswith("h") else "Parallel report pages (Enter for 1): "
+    n_in = await loop.run_in_executor(None, lambda: input(prompt).strip())
     await loop.run_in_executor(None, lambda: input("Press Enter to continue when ready..."))
 
+    if mode.startswith("h"):
+        threads = int(n_in) if n_in.isdigit() and int(n_in) > 0 else 8
+        await run_http_extraction(page, doctor_ids, ws, threads=threads)
+        print("\n🏁 Extraction completed.")
+        await cdp_broker.disconnect()
+        return
+
+    pages = int(n_in) if n_in.isdigit() and int(n_in) > 0 else 1
+    if pages > 1:
+        await run_concurrent(page, doctor_ids, ws, pages)
+        print("\n🏁 Extraction completed.")
+        await cdp_broker.disconnect()
+        return
+
+    unsent = []
     for index, doc_id in enumerate(doctor_ids):
         print(f"\n👩‍⚕️ num {index+1} of {len(doctor_ids)} : Processing doctor ID: {doc_id}")
 
-        # select doctor
-        await page.select_option("#s_8_", doc_id)
-
-        # click submit
-        await page.locator("input[value='Kirim']").click()
-
-        # wait for table refresh
-        try:
-            await page.wait_for_selector("div#loading", state="attached", timeout=2000)
-            await page.wait_for_selector("div#loading", state="detached", timeout=15000)
-        except:
-            pass  # tolerate SIRS variants without #loading div
-
-        # extract data
-        rows = await extract_table_rows(page)
+        # select doctor, submit, wait for the table and extract data
+        rows = await scrape_doctor(page, doc_id)
         if not rows:
             print(f"⚠️ No data for doctor {doc_id}")
             continue
 
         labeled_rows = [r for r in rows]
-        ws.append_rows(labeled_rows, value_input_option="USER_ENTERED")
-        print(f"✅ Uploaded {len(labeled_rows)} rows for doctor {doc_id} to sheet.")
+        if upload_rows(ws, labeled_rows, [doc_id]):
+            print(f"✅ Uploaded {len(labeled_rows)} rows for doctor {doc_id} to sheet.")
+        else:
+            unsent.append(doc_id)
 
         await asyncio.sleep(2.0)  # pacing to prevent quota throttling
 
+    print_failures([], unsent)
     print("\n🏁 Extraction completed.")
-    await browser.close()
-    await p.stop()
+    await cdp_broker.disconnect()
 
 
 if __name__ == "__main__":
+    metrics.configure("sirs_extract_obat")
     asyncio.run(run_extraction())
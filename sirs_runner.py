@@ -2,8 +2,11 @@
 
 import re
 import asyncio
+import cdp_broker
+import metrics
 from playwright.async_api import async_playwright, TimeoutError as PWTimeoutError
-from config import SIRS_APP_URL
+from records import SepRecord
+from config import SIRS_APP_URL, SIRS_SELECTORS, CDP_ENDPOINT
 from utils import reset_form
 
 _playwright = None
@@ -24,7 +27,8 @@ async def init_sirs_manual(cdp_endpoint: str = "http://127.0.0.1:9222", date: st
     # Navigate if you haven’t already:
     if _page.url != SIRS_APP_URL:
         try:
-            await _page.goto(SIRS_APP_URL, timeout=10000)
+            with metrics.timer("nav.sirs"):
+                await _page.goto(SIRS_APP_URL, timeout=10000)
         except PWTimeoutError:
             print("⚠️  Timeout while navigating to SIRS app. Please ensure the URL is correct.")
             return
@@ -41,38 +45,95 @@ async def init_sirs_manual(cdp_endpoint: str = "http://127.0.0.1:9222", date: st
     await _page.select_option("#bulan", bulan)
     await _page.locator("input[type='button'][value='Tampilkan']").click()
 
-    print("⏳ Waiting for process to start...")
-    await _page.wait_for_selector("#dv_process_start", state="attached", timeout=15000)
-    print("⏳ Process started. Waiting for process to finish...")
-    await _page.wait_for_selector("#dv_process_start", state="detached", timeout=120000)
+    with metrics.timer("nav.sirs_process"):
+        print("⏳ Waiting for process to start...")
+        await _page.wait_for_selector("#dv_process_start", state="attached", timeout=15000)
+        print("⏳ Process started. Waiting for process to finish...")
+        await _page.wait_for_selector("#dv_process_start", state="detached", timeout=120000)
     print("✅ Process finished. Table should be visible.")
     
     # print("\n⚙️  Please switch to Chrome, set your filters, and click 'Tampilkan'.")
     # input("When the table is visible, press ⏎ Enter to continue…")
 
 
-async def get_claim_records() -> list[dict]:
+def _to_claim_record(cells: list[str], onclick: str) -> SepRecord:
+    """
+    Turn one scraped table row (cell texts + Print Resep onclick) into a claim
+    record. Cells are stripped here so every scrape mode gives the same values.
+    """
+    cells    = [(c or "").strip() for c in cells]
+    sep_num  = cells[3] if len(cells) > 3 else ""
+    mrn      = (cells[1] if len(cells) > 1 else "").replace("-", "")
+    dttm_sep = cells[4] if len(cells) > 4 else ""
+    m = re.search(r'print_prescription\("([^"]+)"', onclick or "")
+    receipt = m.group(1) if m else ""
+    receipt = receipt[-5:] if receipt.isdigit() and len(receipt) >= 5 else receipt
+    return SepRecord(sep_dttm=dttm_sep, mrn=mrn, sep_num=sep_num, receipt_num=receipt)
+
+
+# One round-trip: every row's cell texts and the Print Resep onclick in a single evaluate.
+_JS_BULK_ROWS = """([rowSel, btnSel]) => Array.from(document.querySelectorAll(rowSel)).map(tr => {
+    const btn = tr.querySelector(btnSel);
+    return {
+        cells:   Array.from(tr.querySelectorAll('td')).map(td => td.innerText.trim()),
+        onclick: btn ? (btn.getAttribute('onclick') || '') : '',
+    };
+})"""
+
+
+def parse_claim_records_html(html: str) -> list[SepRecord]:
+    """
+    Parse the claim table out of an HTML snapshot of the SIRS page
+    (same output as get_claim_records, no browser round-trips).
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    records = []
+    for tr in soup.select(SIRS_SELECTORS["row"]):
+        cells = [td.get_text(strip=True) for td in tr.find_all("td")]
+        btn = tr.select_one(SIRS_SELECTORS["print_button"])
+        onclick = btn.get("onclick", "") if btn else ""
+        records.append(_to_claim_record(cells, onclick))
+    return records
+
+
+async def get_claim_records(mode: str = "bulk") -> list[SepRecord]:
     """
     After selecting filters manually or in test, scrape the JS-rendered table:
       - SEP from 4th <td>
       - receipt from Print Resep button onclick
+
+    mode:
+      "bulk" – one evaluate for the whole table (default)
+      "html" – one page.content() snapshot parsed locally with BeautifulSoup
+      "rows" – legacy per-row locators (4+ CDP calls per row)
     """
     if not _page:
         raise RuntimeError("Playwright page is not initialized. Call init_cdp() first.")
-    rows = _page.locator("div#dv_content table.tblcontrast tbody tr")
+    with metrics.timer("sirs.scrape", mode=mode):
+        return await _scrape_claim_records(mode)
+
+
+async def _scrape_claim_records(mode: str) -> list[SepRecord]:
+    rows = _page.locator(SIRS_SELECTORS["row"])
     await rows.first.wait_for(timeout=5000)
+
+    if mode == "bulk":
+        raw = await _page.evaluate(_JS_BULK_ROWS, [SIRS_SELECTORS["row"], SIRS_SELECTORS["print_button"]])
+        return [_to_claim_record(r["cells"], r["onclick"]) for r in raw]
+    if mode == "html":
+        return parse_claim_records_html(await _page.content())
+
     count = await rows.count()
     records = []
     for i in range(count):
         row = rows.nth(i)
         sep_num     = await row.locator("td").nth(3).inner_text()
-        mrn         = (await row.locator("td").nth(1).inner_text()).strip().replace("-", "")
+        mrn         = await row.locator("td").nth(1).inner_text()
         dttm_sep    = await row.locator("td").nth(4).inner_text()
-        onclick     = await row.locator("input[value='Print Resep']").get_attribute("onclick") or ""
-        m = re.search(r'print_prescription\("([^"]+)"', onclick)
-        receipt = m.group(1) if m else ""
-        receipt = receipt[-5:] if receipt.isdigit() and len(receipt) >= 5 else receipt
-        records.append({"dttm_sep": dttm_sep, "mrn": mrn, "sep_num": sep_num, "receipt_num": receipt})
+        onclick     = await row.locator(SIRS_SELECTORS["print_button"]).get_attribute("onclick") or ""
+        records.append(_to_claim_record(["", mrn, "", sep_num, dttm_sep], onclick))
     return records
 
 async def download_claims():
@@ -102,9 +163,16 @@ def close():
     if _playwright:
         _playwright.stop()
 
-async def set_playwright_context(p, cdp_endpoint: str = "http://127.0.0.1:9222"):
+async def set_playwright_context(p, cdp_endpoint: str = CDP_ENDPOINT):
+    """Attach with `p` (cached per event loop) and take a SIRS tab — leased from cdp_broker when it runs."""
     global _playwright, _browser, _page
     _playwright = p
-    _browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-    ctx = _browser.contexts[0] if _browser.contexts else await _browser.new_context()
-    _page = ctx.pages[0] if ctx.pages else await ctx.new_page()
\ No newline at end of file
+    _browser = await cdp_broker.connect(cdp_endpoint, playwright=p)
+    _page = await cdp_broker.lease_page(_browser, owner="sirs")
+
+async def release_playwright_context():
+    """Give the SIRS tab back to cdp_broker (no-op without a broker)."""
+    global _page
+    if _page is not None:
+        await cdp_broker.release_page(_page)
+        _page = None
\ No newline at end of file
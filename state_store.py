@@ -0,0 +1,355 @@
+# state_store.py
+#
+# Local SQLite mirror of the Google worksheets (sep_web_driver, daftar resep,
+# daftar obat, ...). Rows are indexed on sep_num / receipt_num / status, so
+# "what is still pending?" is a local query instead of a full get_all_values()
+# scan, and a run can resume without pulling the whole sheet again. Sheets
+# are keyed by spreadsheet id + title, so same-named tabs of different
+# spreadsheets do not mix. Local edits are kept as dirty cells and written
+# back by push() in one values_batch_update; pull() never overwrites them.
+#
+#   store = StateStore()
+#   store.pull(ws)                       # first time: full load; later: new rows + watched columns
+#   for row_idx, row in store.pending(ws): ...
+#   store.update(ws, row_idx, {"status": "error"})               # dirty, written by store.push(ws)
+#   store.update(ws, row_idx, {"status": "error"}, dirty=False)  # mirror a write already made to the sheet
+#   store.sync(ws)                       # push, then pull
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from config import STATE_DIR
+from records import DONE_STATUSES
+
+# Columns any consumer of the mirror reads; pull() re-reads these for existing
+# rows (claim/result columns change as rows are processed, receipt_type / qty /
+# apol_id are corrected by hand). Columns not listed are only loaded with new rows.
+# A change in IDENTITY_COLUMNS of a known row means rows were inserted or
+# deleted above it, and the sheet is loaded again in full.
+WATCH_COLUMNS = (
+    "sep_num", "receipt_num", "receipt_type", "apol_id", "qty",
+    "processing_by", "processing_started", "submission_id",
+    "updated_dttm", "status", "note", "message",
+)
+IDENTITY_COLUMNS = ("sep_num", "receipt_num")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    name       TEXT PRIMARY KEY,
+    headers    TEXT NOT NULL,
+    row_count  INTEGER NOT NULL,
+    synced_at  TEXT
+);
+CREATE TABLE IF NOT EXISTS rows (
+    sheet         TEXT NOT NULL,
+    row_idx       INTEGER NOT NULL,
+    sep_num       TEXT,
+    receipt_num   TEXT,
+    status        TEXT,
+    submission_id TEXT,
+    data          TEXT NOT NULL,
+    dirty_cols    TEXT,
+    PRIMARY KEY (sheet, row_idx)
+);
+CREATE INDEX IF NOT EXISTS ix_rows_sep     ON rows (sheet, sep_num);
+CREATE INDEX IF NOT EXISTS ix_rows_receipt ON rows (sheet, receipt_num);
+CREATE INDEX IF NOT EXISTS ix_rows_status  ON rows (sheet, status);
+"""
+
+
+def col_letter(n: int) -> str:
+    """1 -> A, 27 -> AA"""
+    s = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        s = chr(65 + rem) + s
+    return s
+
+
+def _a1_sheet(ws) -> str:
+    """Quoted sheet title for A1 ranges."""
+    return "'" + ws.title.replace("'", "''") + "'"
+
+
+def sheet_key(ws) -> str:
+    """Mirror key of a worksheet: spreadsheet id + title."""
+    return f"{getattr(ws, 'spreadsheet_id', '')}/{ws.title}"
+
+
+def _key(value) -> str:
+    return str(value or "").strip()
+
+
+class StateStore:
+    """SQLite mirror of one or more worksheets, keyed by (sheet_key(ws), row number)."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.join(STATE_DIR, "sheets.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db   = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(rows)")}
+            if "dirty_cols" not in columns:  # mirrors created without the push path
+                self._db.execute("ALTER TABLE rows ADD COLUMN dirty_cols TEXT")
+
+    # --- local reads ------------------------------------------------------
+
+    def headers(self, ws) -> list[str]:
+        row = self._db.execute("SELECT headers FROM sheets WHERE name = ?", (sheet_key(ws),)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _as_dict(self, headers: list[str], data: str) -> dict:
+        values = json.loads(data)
+        return {h: (values[i] if i < len(values) else "") for i, h in enumerate(headers)}
+
+    def values(self, ws) -> list[list[str]]:
+        """Header + every mirrored row as lists of strings (like ws.get_all_values())."""
+        headers = self.headers(ws)
+        if not headers:
+            return []
+        cur = self._db.execute("SELECT data FROM rows WHERE sheet = ? ORDER BY row_idx", (sheet_key(ws),))
+        return [headers] + [json.loads(data) for (data,) in cur]
+
+    def records(self, ws, numericise: bool = False) -> list[dict]:
+        """
+        All mirrored rows as dicts, in sheet order starting at row 2 (like read_all_records).
+        numericise=True converts numbers the way gspread's get_all_records() does.
+        """
+        headers = self.headers(ws)
+        cur = self._db.execute("SELECT data FROM rows WHERE sheet = ? ORDER BY row_idx", (sheet_key(ws),))
+        if not numericise:
+            return [self._as_dict(headers, data) for (data,) in cur]
+        from gspread.utils import numericise_all
+        return [
+            dict(zip(headers, numericise_all(self._pad(json.loads(data), len(headers)), default_blank="")))
+            for (data,) in cur
+        ]
+
+    @staticmethod
+    def _pad(values: list, n: int) -> list:
+        return (values + [""] * n)[:n]
+
+    def pending(self, ws, done_statuses=DONE_STATUSES) -> list[tuple[int, dict]]:
+        """
+        (row_idx, row) for rows without a done status and without a submission_id,
+        using the status index.
+        """
+        headers = self.headers(ws)
+        marks = ",".join("?" * len(done_statuses))
+        cur = self._db.execute(
+            f"SELECT row_idx, data FROM rows WHERE sheet = ? "
+            f"AND lower(coalesce(status, '')) NOT IN ({marks}) "
+            f"AND coalesce(submission_id, '') = '' ORDER BY row_idx",
+            (sheet_key(ws), *done_statuses),
+        )
+        return [(row_idx, self._as_dict(headers, data)) for row_idx, data in cur]
+
+    def find(self, ws, sep_num: str | None = None, receipt_num: str | None = None) -> list[tuple[int, dict]]:
+        """Rows matching sep_num and/or receipt_num (indexed lookups)."""
+        where, args = ["sheet = ?"], [sheet_key(ws)]
+        if sep_num is not None:
+            where.append("sep_num = ?")
+            args.append(_key(sep_num))
+        if receipt_num is not None:
+            where.append("receipt_num = ?")
+            args.append(_key(receipt_num))
+        headers = self.headers(ws)
+        cur = self._db.execute(
+            f"SELECT row_idx, data FROM rows WHERE {' AND '.join(where)} ORDER BY row_idx", args
+        )
+        return [(row_idx, self._as_dict(headers, data)) for row_idx, data in cur]
+
+    # --- local writes -----------------------------------------------------
+
+    def _upsert(self, sheet: str, headers: list[str], row_idx: int, values: list, dirty_cols: list | None = None):
+        rec = {h: (values[i] if i < len(values) else "") for i, h in enumerate(headers)}
+        self._db.execute(
+            "INSERT OR REPLACE INTO rows (sheet, row_idx, sep_num, receipt_num, status, submission_id, data, dirty_cols) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                sheet, row_idx,
+                _key(rec.get("sep_num")), _key(rec.get("receipt_num")),
+                _key(rec.get("status")), _key(rec.get("submission_id")),
+                json.dumps(list(values), ensure_ascii=False),
+                json.dumps(dirty_cols) if dirty_cols else None,
+            ),
+        )
+
+    def update(self, ws, row_idx: int, changes: dict, dirty: bool = True):
+        """
+        Apply {header: value} to a mirrored row. With dirty=True the cells are
+        written to the sheet by the next push(); use dirty=False when the same
+        values were already written, so the next run sees them without a re-pull.
+        """
+        sheet   = sheet_key(ws)
+        headers = self.headers(ws)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT data, dirty_cols FROM rows WHERE sheet = ? AND row_idx = ?", (sheet, row_idx)
+            ).fetchone()
+            values     = json.loads(row[0]) if row else []
+            dirty_cols = json.loads(row[1]) if row and row[1] else []
+            values += [""] * (len(headers) - len(values))
+            for h, v in changes.items():
+                if h in headers:
+                    values[headers.index(h)] = "" if v is None else str(v)
+                    if dirty and h not in dirty_cols:
+                        dirty_cols.append(h)
+                    elif not dirty and h in dirty_cols:
+                        dirty_cols.remove(h)
+            self._upsert(sheet, headers, row_idx, values, dirty_cols)
+
+    def dirty_count(self, ws) -> int:
+        """Rows with local changes not pushed yet."""
+        return self._db.execute(
+            "SELECT count(*) FROM rows WHERE sheet = ? AND dirty_cols IS NOT NULL", (sheet_key(ws),)
+        ).fetchone()[0]
+
+    # --- sync with Sheets -------------------------------------------------
+
+    def pull(self, ws, full: bool = False, watch=WATCH_COLUMNS) -> int:
+        """
+        Bring the mirror up to date with `ws`.
+        First pull (or full=True) loads the whole sheet once. Later pulls fetch
+        the header row, rows appended since the last sync and the watched
+        columns of the existing rows, in one batch_get. The sheet is loaded in
+        full again when its header row changed or a known row now holds another
+        sep_num / receipt_num (rows inserted or deleted above it); rows past the
+        last non-empty one are dropped when the sheet was cut short. Dirty cells
+        are never overwritten (push() them first; sync() does). Returns the
+        number of rows refreshed.
+        """
+        sheet   = sheet_key(ws)
+        headers = self.headers(ws)
+        known   = self._db.execute("SELECT row_count FROM sheets WHERE name = ?", (sheet,)).fetchone()
+
+        if full or not headers or not known:
+            return self._pull_full(ws, sheet)
+
+        row_count = known[0]
+        last_col  = col_letter(len(headers))
+        watched   = [(i, h) for i, h in enumerate(headers) if h in watch or h in IDENTITY_COLUMNS]
+        ranges    = ["1:1", f"A{row_count + 1}:{last_col}"]
+        ranges   += [f"{col_letter(i + 1)}2:{col_letter(i + 1)}{row_count}" for i, _ in watched]
+        results   = ws.batch_get(ranges)
+        header_row, new_rows, col_values = results[0], results[1], results[2:]
+
+        current_headers = [h.strip() for h in (header_row[0] if header_row else [])]
+        if current_headers != headers:
+            print(f"🗄️  Header row of '{ws.title}' changed — reloading it in full.")
+            return self._pull_full(ws, sheet)
+
+        with self._lock:
+            current = {
+                r: (json.loads(d), json.loads(c) if c else [])
+                for r, d, c in self._db.execute(
+                    "SELECT row_idx, data, dirty_cols FROM rows WHERE sheet = ?", (sheet,)
+                )
+            }
+        # sheet cut short: nothing is kept past its last non-empty row
+        last_seen = max(
+            [offset + 2 for column in col_values for offset, cell in enumerate(column) if cell and cell[0]],
+            default=1,
+        )
+        new_count = row_count + len(new_rows) if new_rows else last_seen
+        changed = {}
+        for row_idx in range(2, min(row_count, new_count) + 1):
+            values, dirty_cols = current.get(row_idx, ([], []))
+            values  = values + [""] * (len(headers) - len(values))
+            offset  = row_idx - 2
+            touched = False
+            for (col, name), column in zip(watched, col_values):
+                cell = column[offset][0] if offset < len(column) and column[offset] else ""
+                if values[col] == cell or name in dirty_cols:
+                    continue
+                if name in IDENTITY_COLUMNS and values[col]:
+                    print(f"🗄️  Row {row_idx} of '{ws.title}' now holds another {name} — reloading it in full.")
+                    return self._pull_full(ws, sheet)
+                values[col] = cell
+                touched = True
+            if touched:
+                changed[row_idx] = (values, dirty_cols)
+
+        with self._lock, self._db:
+            for row_idx, (values, dirty_cols) in changed.items():
+                if row_idx <= new_count:
+                    self._upsert(sheet, headers, row_idx, values, dirty_cols)
+            for offset, row in enumerate(new_rows):
+                self._upsert(sheet, headers, row_count + 1 + offset, row)
+            dropped = self._db.execute(
+                "DELETE FROM rows WHERE sheet = ? AND row_idx > ?", (sheet, new_count)
+            ).rowcount
+            self._save_sheet(sheet, headers, new_count)
+        note = f", {dropped} rows gone from the sheet dropped" if dropped else ""
+        print(f"🗄️  '{ws.title}': {len(new_rows)} new rows, {len(changed)} rows changed since last sync{note}.")
+        return len(new_rows) + len(changed)
+
+    def _pull_full(self, ws, sheet: str) -> int:
+        values = ws.get_all_values()
+        if not values:
+            return 0
+        headers = [h.strip() for h in values[0]]
+        with self._lock, self._db:
+            dirty = self._db.execute(
+                "SELECT count(*) FROM rows WHERE sheet = ? AND dirty_cols IS NOT NULL", (sheet,)
+            ).fetchone()[0]
+            if dirty:
+                print(f"⚠️ Discarding local changes of {dirty} rows of '{ws.title}' — the sheet was restructured.")
+            self._db.execute("DELETE FROM rows WHERE sheet = ?", (sheet,))
+            for row_idx, row in enumerate(values[1:], start=2):
+                self._upsert(sheet, headers, row_idx, row)
+            self._save_sheet(sheet, headers, len(values))
+        print(f"🗄️  Mirrored {len(values) - 1} rows of '{ws.title}' into {self.path}")
+        return len(values) - 1
+
+    def push(self, ws) -> int:
+        """Write every dirty cell of `ws`'s mirror back in one values_batch_update. Returns the rows pushed."""
+        sheet   = sheet_key(ws)
+        headers = self.headers(ws)
+        with self._lock:
+            dirty = self._db.execute(
+                "SELECT row_idx, data, dirty_cols FROM rows WHERE sheet = ? AND dirty_cols IS NOT NULL", (sheet,)
+            ).fetchall()
+        if not dirty:
+            return 0
+
+        data = []
+        for row_idx, values, cols in dirty:
+            values = json.loads(values)
+            for h in json.loads(cols):
+                if h not in headers:
+                    continue
+                i = headers.index(h)
+                data.append({
+                    "range":  f"{_a1_sheet(ws)}!{col_letter(i + 1)}{row_idx}",
+                    "values": [[values[i] if i < len(values) else ""]],
+                })
+        if data:
+            ws.spreadsheet.values_batch_update({"valueInputOption": "RAW", "data": data})
+
+        with self._lock, self._db:
+            # only rows whose dirty cells did not change again while pushing
+            self._db.executemany(
+                "UPDATE rows SET dirty_cols = NULL WHERE sheet = ? AND row_idx = ? AND dirty_cols = ? AND data = ?",
+                [(sheet, row_idx, cols, values) for row_idx, values, cols in dirty],
+            )
+        print(f"🗄️  Pushed {len(data)} cells from {len(dirty)} dirty rows to '{ws.title}'.")
+        return len(dirty)
+
+    def sync(self, ws) -> int:
+        """Push local changes, then pull remote ones. Returns the rows refreshed by the pull."""
+        self.push(ws)
+        return self.pull(ws)
+
+    def _save_sheet(self, sheet: str, headers: list[str], row_count: int):
+        self._db.execute(
+            "INSERT OR REPLACE INTO sheets (name, headers, row_count, synced_at) VALUES (?, ?, ?, ?)",
+            (sheet, json.dumps(headers), row_count, datetime.now().strftime("%Y-%m-%dT%H:%M:%S")),
+        )
+
+    def close(self):
+        self._db.close()
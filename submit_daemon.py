@@ -0,0 +1,158 @@
+# submit_daemon.py
+#
+# Long-running consumer of the submission queue (job_queue.py). extract_main
+# and xlsx_import queue every sep_web_driver row they append; this daemon
+# keeps N Apotek tabs open and pushes each queued row through
+# submit_to_apotek as soon as it arrives, with the same claim / commit
+# handling as submit_main (which stays the manual sweep for rows that were
+# never queued). Queue depth and wait / latency percentiles are printed
+# every --report-every seconds and on exit.
+#
+#   python submit_daemon.py --workers 2
+#   python submit_daemon.py --stats                 # print queue stats and exit
+#   python submit_daemon.py --enqueue-pending       # queue rows already pending on the sheet, then run
+
+import argparse
+import threading
+import metrics
+from apotek_runner import open_apotek_tab, close_apotek_tab, close_apotek, print_phase_report
+from config import WORKSHEET_NAME
+from job_queue import JobQueue, format_stats
+from records import SepRecord
+from sheets_handler import HOSTNAME, get_worksheet, read_columns, sep_key, sheet_headers, commit_row_result
+from submit_main import SUBMIT_COLUMNS, _process_row
+
+MAX_ATTEMPTS = 5
+
+
+def _sheet_row(ws, row_idx: int) -> SepRecord:
+    """Current state of one sheet row (one ranged read)."""
+    headers = sheet_headers(ws)
+    with metrics.timer("sheets.read"):
+        values = ws.batch_get([f"{row_idx}:{row_idx}"])[0]
+    return SepRecord.from_dict(dict(zip(headers, values[0] if values else [])), row=row_idx)
+
+
+def _handle(jobs: JobQueue, job, page, tag: str):
+    """Submit one job's row unless the sheet says it is already handled or no longer the same row."""
+    if job.attempts > MAX_ATTEMPTS:
+        jobs.fail(job.id, f"claimed {job.attempts} times without finishing")
+        print(f"{tag}❌ Job {job.id} (row {job.row}) given up after {job.attempts - 1} attempts.")
+        return
+    try:
+        ws  = get_worksheet(job.sheet)
+        rec = _sheet_row(ws, job.row)
+    except Exception as e:
+        again = jobs.retry(job.id, f"sheet read failed: {e}", max_attempts=MAX_ATTEMPTS)
+        print(f"{tag}⚠️ Job {job.id}: reading row {job.row} failed ({e}) — {'will retry' if again else 'given up'}.")
+        return
+    if sep_key(rec.sep_num, rec.receipt_num) != sep_key(job.sep_num, job.receipt_num):
+        jobs.fail(job.id, f"row {job.row} now holds SEP={rec.sep_num} receipt={rec.receipt_num}")
+        print(f"{tag}❌ Job {job.id}: row {job.row} no longer holds SEP {job.sep_num} — not submitted.")
+        return
+    if rec.done:
+        print(f"{tag}⏭ Row {job.row} already done (submission_id/status present).")
+        jobs.finish(job.id)
+        return
+    if not _process_row(ws, job.row, rec, page=page, tag=tag, commit=commit_row_result):
+        again = jobs.retry(job.id, "row not committed (claim not obtained or sheet write failed)",
+                           max_attempts=MAX_ATTEMPTS)
+        print(f"{tag}↩️  Job {job.id}: row {job.row} not committed — {'will retry' if again else 'given up'}.")
+        return
+    # finished only once the sheet itself shows the result
+    try:
+        done, reason = _sheet_row(ws, job.row).done, f"result not visible on row {job.row}"
+    except Exception as e:
+        done, reason = False, f"re-reading row {job.row} failed: {e}"
+    if done:
+        jobs.finish(job.id)
+    else:
+        again = jobs.retry(job.id, reason, max_attempts=MAX_ATTEMPTS)
+        print(f"{tag}↩️  Job {job.id}: {reason} — {'will retry' if again else 'given up'}.")
+
+
+def _worker(tab_no: int, jobs: JobQueue, stop: threading.Event, poll: float, lease: float, handled: dict):
+    """One Apotek tab: claim, submit, repeat; waits `poll` seconds when the queue is empty."""
+    tag  = f"[tab {tab_no}] "
+    name = f"{HOSTNAME}/tab-{tab_no}"
+    page = open_apotek_tab()
+    print(f"{tag}✅ Tab opened on Apotek form.")
+    try:
+        while not stop.is_set():
+            job = jobs.claim(name, lease=lease)
+            if job is None:
+                stop.wait(poll)
+                continue
+            _handle(jobs, job, page, tag)
+            handled[tab_no] = handled.get(tab_no, 0) + 1
+    finally:
+        close_apotek_tab(page)
+
+
+def enqueue_pending(jobs: JobQueue, sheet: str = WORKSHEET_NAME) -> int:
+    """Queue every row of `sheet` that has no submission_id / status yet."""
+    ws   = get_worksheet(sheet)
+    cols = read_columns(ws, SUBMIT_COLUMNS)
+    rows = [(idx, SepRecord(idx, **dict(zip(SUBMIT_COLUMNS, values)))) for idx, *values in cols.tuples(*SUBMIT_COLUMNS)]
+    return jobs.enqueue(ws.title, [(idx, rec) for idx, rec in rows if not rec.done and rec.sep_num])
+
+
+def main(workers: int = 1, poll: float = 2.0, lease: float = 900, report_every: float = 60.0,
+         queue_db: str | None = None):
+    jobs    = JobQueue(queue_db)
+    stop    = threading.Event()
+    handled = {}
+    print(f"📬 Submission queue {jobs.path}: {format_stats(jobs.stats())}")
+    threads = [
+        threading.Thread(target=_worker, args=(n, jobs, stop, poll, lease, handled), name=f"apotek-tab-{n}")
+        for n in range(1, workers + 1)
+    ]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            if stop.wait(report_every):
+                break
+            print(f"📬 {sum(handled.values())} handled — {format_stats(jobs.stats())}")
+    except KeyboardInterrupt:
+        print("\n⏹  Stopping after the rows in progress…")
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        close_apotek()
+        print(f"📬 {sum(handled.values())} handled — {format_stats(jobs.stats())}")
+        print_phase_report()
+        jobs.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Submit sep_web_driver rows to Apotek BPJS as they are queued.")
+    ap.add_argument("--workers", type=int, default=1, help="number of parallel Apotek tabs (default 1)")
+    ap.add_argument("--poll", type=float, default=2.0, help="seconds between queue checks when idle (default 2)")
+    ap.add_argument("--lease", type=float, default=900,
+                    help="seconds before a job claimed by a vanished worker is handed out again (default 900)")
+    ap.add_argument("--report-every", type=float, default=60.0, help="print queue stats this often (default 60s)")
+    ap.add_argument("--queue-db", default=None, help="queue file (default STATE_DIR/jobs.sqlite)")
+    ap.add_argument("--enqueue-pending", action="store_true",
+                    help="first queue every row of sep_web_driver that is still pending")
+    ap.add_argument("--requeue-failed", action="store_true", help="first give failed jobs another round")
+    ap.add_argument("--stats", action="store_true", help="print queue stats and exit")
+    ap.add_argument("--metrics-port", type=int, default=None,
+                    help="serve Prometheus metrics on 127.0.0.1:PORT/metrics while running")
+    args = ap.parse_args()
+
+    if args.stats or args.enqueue_pending or args.requeue_failed:
+        jobs = JobQueue(args.queue_db)
+        if args.enqueue_pending:
+            print(f"📬 Queued {enqueue_pending(jobs)} pending rows.")
+        if args.requeue_failed:
+            print(f"📬 {jobs.requeue_failed()} failed jobs queued again.")
+        print(f"📬 {format_stats(jobs.stats())}")
+        jobs.close()
+        if args.stats:
+            raise SystemExit(0)
+
+    metrics.configure("submit_daemon", prometheus_port=args.metrics_port)
+    main(workers=args.workers, poll=args.poll, lease=args.lease, report_every=args.report_every,
+         queue_db=args.queue_db)
@@ -1,61 +1,363 @@
 # submit_main.py
 
-from apotek_runner  import init_apotek, submit_to_apotek, close_apotek
-from sheets_handler import get_worksheet, read_all_records, update_sep_row, claim_row, commit_row_result
-from config import WORKSHEET_NAME
+from apotek_runner  import init_apotek, submit_to_apotek, close_apotek, open_apotek_tab, close_apotek_tab, print_phase_report, resep_listed
+from sheets_handler import get_worksheet, read_columns, claim_row, commit_row_result, ResultBuffer, claim_block, recover_result_journal
+from state_store import StateStore
+from records import SepRecord
+from checkpoint import Checkpoint
+from config import WORKSHEET_NAME, STATE_DIR
+import argparse
+import itertools
+import metrics
+import os
+import queue
+import threading
 import time
-import sys
 import uuid
 
 
-def main():
-    ws      = get_worksheet(WORKSHEET_NAME)
-    records = read_all_records(ws)
+# The only sep_web_driver columns the pending scan and _process_row need.
+SUBMIT_COLUMNS = ("sep_num", "receipt_num", "receipt_type", "submission_id", "status")
 
-    init_apotek()
-    for idx, row in enumerate(records, start=2):
-        # Skip already‐processed rows (idempotency): if submission_id or status present, skip
-        if (row.get("submission_id", "") or "").strip() or (row.get("status", "") or "").strip():
-            print(f"⏭ Row {idx} already done (submission_id/status present).")
-            continue
 
+def _process_row(ws, idx: int, row: SepRecord, page=None, tag: str = "", commit=commit_row_result, lease=None,
+                 checkpoint=None, claimed: bool = False) -> bool:
+    """
+    Claim, submit and commit one sheet row.
+    `commit` is commit_row_result or a ResultBuffer's buffered equivalent.
+    Rows inside a BlockLease are already claimed; they are marked done once committed.
+    claimed=True: the row is still ours from an interrupted run (see _reconcile).
+    The checkpoint follows the row through its phases until it is committed.
+    Returns True when a result for the row (submitted or error) was committed,
+    False when it was not: claim lost, or the commit itself failed.
+    """
+    if lease is None and not claimed:
         # Try to claim the row
-        claimed = claim_row(ws, row_idx=idx, ttl_seconds=300, max_retries=4)
-        if not claimed:
-            print(f"⏭ Row {idx} skipped (claimed by other worker).")
+        if not claim_row(ws, row_idx=idx, ttl_seconds=300, max_retries=4):
+            print(f"{tag}⏭ Row {idx} skipped (claimed by other worker).")
+            if checkpoint:
+                checkpoint.hold(idx)  # not ours to finish; a resume looks at it again
+            return False
+    elif lease is not None:
+        _commit = commit
+
+        def commit(*args, **kwargs):
+            _commit(*args, **kwargs)
+            lease.done(idx)
+
+    if checkpoint:
+        _commit_row = commit
+
+        def commit(ws, idx, *args, **kwargs):
+            _commit_row(ws, idx, *args, **kwargs)
+            checkpoint.done(idx)
+
+    try:
+        rec_type = row.receipt_type
+        if not rec_type:
+            commit(ws, idx, "error", "missing receipt_type", submission_id=None)
+            print(f"{tag}⚠️ Row {idx} missing receipt_type — marked error.")
+            return True
+
+        sep_num, receipt_num = row.sep_num, row.receipt_num
+
+        print(f"{tag}▶️  Submitting row {idx}: SEP={sep_num}, Receipt={receipt_num}, Type={rec_type}")
+        on_phase = None
+        if checkpoint:
+            checkpoint.begin(idx, "claimed", sep_num=sep_num, receipt_num=receipt_num)
+            on_phase = lambda phase: checkpoint.phase(idx, phase)
+        status, note = submit_to_apotek(sep_num, receipt_num, rec_type, page=page, on_phase=on_phase)
+
+        # Create submission_id for idempotency tracing
+        submission_id = str(uuid.uuid4())
+        commit(ws, idx, status, note, submission_id=submission_id)
+
+        print(f"{tag}✅ Row {idx} updated: status={status}, note={note}")
+        print(f"____________________________________________________________________")
+        return True
+
+    except Exception as e:
+        # Ensure we commit an error and clear the claim
+        print(f"{tag}❌ Row {idx} failed with exception: {e}")
+        try:
+            commit(ws, idx, "error", str(e), submission_id=None)
+        except Exception:
+            return False
+        return True
+
+
+def _leased_blocks(ws, pending: list, lease_block: int, checkpoint=None):
+    """
+    Yield (lease, [(idx, row), ...]) work blocks.
+    With lease_block > 0 each block of that many pending rows is claimed in one
+    go via claim_block; otherwise everything comes back as one unleased block
+    and rows are claimed one by one in _process_row. Rows of a window held by
+    other workers are put on hold in the checkpoint, never marked done.
+    """
+    if lease_block <= 0:
+        yield None, pending
+        return
+    rows_by_idx = dict(pending)
+    remaining   = [idx for idx, _ in pending]
+    while remaining:
+        window, remaining = remaining[:lease_block], remaining[lease_block:]
+        lease = claim_block(ws, window, ttl_seconds=300)
+        held  = [idx for idx in window if lease is None or idx not in lease.rows]
+        if checkpoint:
+            for idx in held:
+                checkpoint.hold(idx)
+        if lease is None:
+            print(f"⏭ Rows {window[0]}–{window[-1]} skipped (claimed by other workers).")
             continue
+        print(f"🔒 Leased {len(lease.rows)} rows ({window[0]}–{window[-1]}).")
+        yield lease, [(idx, rows_by_idx[idx]) for idx in lease.rows]
 
+
+def _tab_worker(tab_no: int, rows_q: queue.Queue, ws, stats: dict, commit=commit_row_result, checkpoint=None):
+    """
+    Pool worker: own Apotek tab, pulls (idx, row, lease, claimed) from the shared queue until a None sentinel.
+    A worker whose tab cannot be opened exits without taking rows; _wait_pool notices when none is left.
+    """
+    tag = f"[tab {tab_no}] "
+    try:
+        page = open_apotek_tab()
+    except Exception as e:
+        print(f"{tag}❌ Could not open an Apotek tab: {e}")
+        stats[tab_no] = (0, 0.0)
+        return
+    print(f"{tag}✅ Tab opened on Apotek form.")
+    started = time.monotonic()
+    done = 0
+    try:
+        while True:
+            item = rows_q.get()
+            try:
+                if item is None:
+                    break
+                idx, row, lease, claimed = item
+                if _process_row(ws, idx, row, page=page, tag=tag, commit=commit, lease=lease,
+                                checkpoint=checkpoint, claimed=claimed):
+                    done += 1
+            finally:
+                rows_q.task_done()
+    finally:
+        close_apotek_tab(page)
+        stats[tab_no] = (done, time.monotonic() - started)
+
+
+def _wait_pool(rows_q: queue.Queue, threads: list) -> bool:
+    """Block until every queued row is processed; False as soon as no worker is left to process them."""
+    while True:
+        with rows_q.all_tasks_done:
+            if not rows_q.unfinished_tasks:
+                return True
+            rows_q.all_tasks_done.wait(1.0)
+        if not any(t.is_alive() for t in threads):
+            return False
+
+
+def _drop_queued(rows_q: queue.Queue) -> int:
+    """Take every row nobody will process off the queue. Returns how many."""
+    dropped = 0
+    while True:
         try:
-            rec_type = row.get("receipt_type", "").strip()
-            if not rec_type:
-                commit_row_result(ws, idx, "error", "missing receipt_type", submission_id=None)
-                print(f"⚠️ Row {idx} missing receipt_type — marked error.")
+            item = rows_q.get_nowait()
+        except queue.Empty:
+            return dropped
+        if item is not None:
+            print(f"⏭ Row {item[0]} skipped (no Apotek tab left).")
+            dropped += 1
+        rows_q.task_done()
+
+
+def _store_commit(store: StateStore, commit):
+    """Wrap a commit function so the local mirror learns each result without a re-pull."""
+    def _commit(ws, idx, status, note, submission_id=None):
+        commit(ws, idx, status, note, submission_id=submission_id)
+        store.update(ws, idx, {
+            "processing_by": "", "processing_started": "",
+            "submission_id": submission_id or "", "status": status or "", "note": note or "-",
+        }, dirty=False)
+    return _commit
+
+
+def _reconcile(ws, checkpoint: Checkpoint, pending: list, commit) -> tuple[list, list]:
+    """
+    Settle the rows an interrupted run left in flight before anything is resubmitted.
+    Rows that never reached Simpan are simply redone; for rows that did, the
+    Daftar Resep grid decides: listed → committed as submitted, not listed →
+    redone, unknown → committed as error instead of risking a duplicate.
+    Returns (reclaimed, rest): rows to redo under the claim they still hold, and the other pending rows.
+    """
+    rows_by_idx = dict(pending)
+    reclaimed, settled, page = [], set(), None
+    try:
+        for idx, info in sorted(checkpoint.in_flight.items()):
+            row = rows_by_idx.get(idx)
+            if row is None:
+                print(f"♻️  Row {idx} was in flight but is already committed.")
+                checkpoint.done(idx)
                 continue
+            if info.get("phase") != "save":
+                print(f"♻️  Row {idx} stopped in phase '{info.get('phase')}' before Simpan — redoing it.")
+                reclaimed.append((idx, row))
+                continue
+            if page is None:
+                page = open_apotek_tab()
+            receipt_num = row.receipt_num
+            listed = resep_listed(receipt_num, page=page)
+            if listed:
+                print(f"♻️  Row {idx}: resep {receipt_num} is on Daftar Resep — committing it as submitted.")
+                commit(ws, idx, "normal", "Simpan Berhasil (confirmed on Daftar Resep after restart)",
+                       submission_id=str(uuid.uuid4()))
+                checkpoint.done(idx)
+                settled.add(idx)
+            elif listed is False:
+                print(f"♻️  Row {idx}: resep {receipt_num} not on Daftar Resep — resubmitting it.")
+                reclaimed.append((idx, row))
+            else:
+                commit(ws, idx, "error", "interrupted during Simpan; Daftar Resep check failed — not resubmitted",
+                       submission_id=None)
+                checkpoint.done(idx)
+                settled.add(idx)
+    finally:
+        if page is not None:
+            close_apotek_tab(page)
+    skip = settled | {idx for idx, _ in reclaimed}
+    return reclaimed, [(idx, row) for idx, row in pending if idx not in skip]
 
-            sep_num     = str(row.get("sep_num", "")).strip()
-            receipt_num = str(row.get("receipt_num", "")).strip()
 
-            print(f"▶️  Submitting row {idx}: SEP={sep_num}, Receipt={receipt_num}, Type={rec_type}")
-            status, note = submit_to_apotek(sep_num, receipt_num, rec_type)
+def main(workers: int = 1, buffer_rows: int = 0, buffer_seconds: float = 30.0, lease_block: int = 0,
+         state_db: str | None = None, resume: bool = True):
+    ws      = get_worksheet(WORKSHEET_NAME)
+    # Results a crashed buffered run journaled but never wrote back go to the
+    # sheet first, whatever the buffer flags of this run are.
+    recovered = recover_result_journal(ws)
+    if recovered:
+        print(f"♻️  Wrote {recovered} journaled results of an interrupted run to the sheet.")
+    # Buffered write-back: results go to a local journal and reach the sheet in
+    # one batch per `buffer_rows` rows / `buffer_seconds`, instead of 2 calls per row.
+    buffer  = ResultBuffer(ws, flush_rows=buffer_rows, flush_seconds=buffer_seconds) if buffer_rows > 0 else None
+    commit  = buffer.commit_row_result if buffer else commit_row_result
 
-            # Create submission_id for idempotency tracing
-            submission_id = str(uuid.uuid4())
-            commit_row_result(ws, idx, status, note, submission_id=submission_id)
+    # Resume point of an interrupted run: rows before it are finished, so they are not read again.
+    checkpoint = Checkpoint("submit_main", scope=ws.title)
+    if not resume:
+        checkpoint.clear()
+    start = checkpoint.resume_from() or 2
+    if start > 2 or checkpoint.in_flight:
+        print(f"♻️  Resuming from row {start} ({len(checkpoint.in_flight)} rows were in flight).")
 
-            print(f"✅ Row {idx} updated: status={status}, note={note}")
-            print(f"____________________________________________________________________")
+    if state_db:
+        # Local SQLite mirror: incremental pull, then an indexed pending query.
+        store   = StateStore(state_db)
+        store.pull(ws)
+        rows    = (SepRecord.from_dict(row, row=idx) for idx, row in store.pending(ws) if idx >= start)
+        pending = [(rec.row, rec) for rec in rows if not rec.done]
+        commit  = _store_commit(store, commit)
+        print(f"🗄️  {len(pending)} pending rows from local state store.")
+    else:
+        cols    = read_columns(ws, SUBMIT_COLUMNS, after_row=start - 1)
+        pending = []
+        for idx, *values in cols.tuples(*SUBMIT_COLUMNS):
+            row = SepRecord(idx, **dict(zip(SUBMIT_COLUMNS, values)))
+            # Skip already‐processed rows (idempotency): if submission_id or status present, skip
+            if row.done:
+                print(f"⏭ Row {idx} already done (submission_id/status present).")
+                continue
+            pending.append((idx, row))
 
-        except Exception as e:
-            # Ensure we commit an error and clear the claim
-            try:
-                commit_row_result(ws, idx, "error", str(e), submission_id=None)
-            except Exception:
-                pass
-            print(f"❌ Row {idx} failed with exception: {e}")
+    reclaimed = []
+    if checkpoint.in_flight:
+        reclaimed, pending = _reconcile(ws, checkpoint, pending, commit)
+    claimed = {idx for idx, _ in reclaimed}
+    # rows still held from the interrupted run go first, outside any block lease
+    blocks  = itertools.chain([(None, reclaimed)] if reclaimed else [], _leased_blocks(ws, pending, lease_block, checkpoint))
 
+    if workers <= 1:
+        init_apotek()
+        for lease, block in blocks:
+            try:
+                checkpoint.expect(idx for idx, _ in block)
+                for idx, row in block:
+                    _process_row(ws, idx, row, commit=commit, lease=lease,
+                                 checkpoint=checkpoint, claimed=idx in claimed)
+            finally:
+                # release whatever is unfinished (e.g. on Ctrl-C)
+                if lease:
+                    lease.close()
+        close_apotek()
+        if buffer:
+            buffer.close()
+        checkpoint.clear()
+        print("✅ All submissions complete.")
+        print_phase_report()
+        return
 
+    # Parallel pool: N tabs in the same CDP context share one row queue, so the
+    # dialog / card-number waits on one tab overlap with work on the others.
+    # claim_row / the block lease still guard every row against double submission.
+    rows_q  = queue.Queue()
+    stats   = {}
+    threads = [
+        threading.Thread(target=_tab_worker, args=(n, rows_q, ws, stats, commit, checkpoint), name=f"apotek-tab-{n}")
+        for n in range(1, workers + 1)
+    ]
+    for t in threads:
+        t.start()
+    try:
+        for lease, block in blocks:
+            checkpoint.expect(idx for idx, _ in block)
+            for idx, row in block:
+                rows_q.put((idx, row, lease, idx in claimed))
+            # block finished by the pool before its lease is closed
+            finished = _wait_pool(rows_q, threads)
+            if lease:
+                lease.close()
+            if not finished:
+                dropped = _drop_queued(rows_q)
+                close_apotek()
+                if buffer:
+                    buffer.close()
+                # the checkpoint is kept, so the next run resumes at these rows
+                raise RuntimeError(f"every Apotek tab failed; {dropped} queued rows were not submitted")
+    finally:
+        for _ in threads:
+            rows_q.put(None)
+        for t in threads:
+            t.join()
     close_apotek()
+    if buffer:
+        buffer.close()
+    checkpoint.clear()
+
     print("✅ All submissions complete.")
+    total = 0
+    for tab_no in sorted(stats):
+        done, elapsed = stats[tab_no]
+        total += done
+        rate = done / (elapsed / 60) if elapsed > 0 else 0.0
+        print(f"📊 Tab {tab_no}: {done} rows in {elapsed:.0f}s ({rate:.1f} rows/min)")
+    print(f"📊 Pool total: {total} rows across {workers} tabs")
+    print_phase_report()
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    ap = argparse.ArgumentParser(description="Submit pending sep_web_driver rows to Apotek BPJS.")
+    ap.add_argument("--workers", type=int, default=1, help="number of parallel Apotek tabs (default 1)")
+    ap.add_argument("--buffer-rows", type=int, default=0,
+                    help="buffer results and flush every N rows (0 = write each row immediately)")
+    ap.add_argument("--buffer-seconds", type=float, default=30.0,
+                    help="flush buffered results at least this often (default 30s)")
+    ap.add_argument("--lease-block", type=int, default=0,
+                    help="claim pending rows in leased blocks of N (0 = claim_row per row)")
+    ap.add_argument("--state-db", nargs="?", const=os.path.join(STATE_DIR, "sheets.sqlite"), default=None,
+                    help="find pending rows through the local SQLite mirror (optional path)")
+    ap.add_argument("--fresh", action="store_true",
+                    help="ignore the checkpoint of an interrupted run and scan every row")
+    ap.add_argument("--metrics-port", type=int, default=None,
+                    help="serve Prometheus metrics on 127.0.0.1:PORT/metrics while running")
+    args = ap.parse_args()
+    metrics.configure("submit_main", prometheus_port=args.metrics_port)
+    main(workers=args.workers, buffer_rows=args.buffer_rows, buffer_seconds=args.buffer_seconds,
+         lease_block=args.lease_block, state_db=args.state_db, resume=not args.fresh)
@@ -0,0 +1,165 @@
+# xlsx_import.py
+#
+# Bulk import of SEP lists kept as workbooks (documents/list_sep.xlsx,
+# list_sep1-13Aprill.xlsx, ...) without hand-copying them through Google
+# Sheets first. Workbooks are streamed with openpyxl in read-only mode, so
+# memory stays bounded by one chunk plus the dedupe keys, whatever the file
+# size. Rows are normalised to the SEP_SHEET_HEADERS field names, deduped on
+# sep_key and handed to a sink one chunk at a time — by default one batched
+# append to sep_web_driver per chunk.
+#
+#   python xlsx_import.py documents/list_sep.xlsx documents/list_sep1-13Aprill.xlsx
+#   python xlsx_import.py documents/list_sep.xlsx --sheets 22 --dry-run
+#   python xlsx_import.py documents/list_sep.xlsx --enqueue      # submit_daemon picks the rows up
+
+import argparse
+import itertools
+import openpyxl
+import time
+from datetime import date, datetime
+import metrics
+from config import SEP_SHEET_HEADERS, WORKSHEET_NAME
+from job_queue import JobQueue
+from records import SepRecord
+from sheets_handler import append_sep_records, get_worksheet, sep_key
+
+# Workbook column header → sep_web_driver field
+HEADER_ALIASES = {
+    "dttm":          "sep_dttm",
+    "dttm_sep":      "sep_dttm",
+    "tgl_sep":       "sep_dttm",
+    "no_rm":         "mrn",
+    "no_sep":        "sep_num",
+    "no_resep":      "receipt_num",
+    "jenis_resep":   "receipt_type",
+    "status_cd":     "status",
+    "error_message": "note",
+    "message":       "note",
+}
+
+DEFAULT_RECEIPT_TYPE = "Obat Kronis Blm Stabil"
+
+
+def _field(header) -> str | None:
+    name = str(header or "").strip().lower().replace(" ", "_")
+    name = HEADER_ALIASES.get(name, name)
+    return name if name in SEP_SHEET_HEADERS else None
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def iter_xlsx_records(path: str, sheets: list[str] | None = None, stats: dict | None = None):
+    """
+    Yield one SepRecord per data row of every worksheet (or just `sheets`) that
+    has a sep_num column. The first non-empty
+    row of a worksheet is its header; rows without sep_num or receipt_num are
+    skipped and counted in stats["incomplete"].
+    """
+    stats = stats if stats is not None else {}
+    try:
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"⚠️ Skipping {path}: not a readable workbook ({e})")
+        stats["unreadable"] = stats.get("unreadable", 0) + 1
+        return
+    try:
+        for ws in wb.worksheets:
+            if sheets and ws.title not in sheets:
+                continue
+            rows = ws.iter_rows(values_only=True)
+            columns = None
+            for values in rows:
+                if any(v not in (None, "") for v in values):
+                    columns = [(i, f) for i, f in enumerate(map(_field, values)) if f]
+                    break
+            if not columns or "sep_num" not in {f for _, f in columns}:
+                continue
+            for values in rows:
+                rec = dict.fromkeys(SEP_SHEET_HEADERS, "")
+                for i, f in columns:
+                    if i < len(values) and not rec[f]:
+                        rec[f] = _cell(values[i])
+                if not rec["sep_num"] or not rec["receipt_num"]:
+                    if any(v not in (None, "") for v in values):
+                        stats["incomplete"] = stats.get("incomplete", 0) + 1
+                    continue
+                rec["receipt_type"] = rec["receipt_type"] or DEFAULT_RECEIPT_TYPE
+                stats["read"] = stats.get("read", 0) + 1
+                yield SepRecord.from_dict(rec)
+    finally:
+        wb.close()
+
+
+def import_xlsx(paths: list[str], sink, chunk_rows: int = 5000, sheets: list[str] | None = None,
+                dedupe: bool = True) -> dict:
+    """
+    Stream every workbook in `paths` into sink(records) -> (inserted, skipped),
+    `chunk_rows` records per call. With dedupe=True repeats across files are
+    dropped here (the sink dedupes against what it already holds).
+    Returns counters: read, incomplete, duplicate, inserted, skipped, chunks, unreadable.
+    """
+    stats = {"read": 0, "incomplete": 0, "duplicate": 0, "inserted": 0, "skipped": 0, "chunks": 0, "unreadable": 0}
+    seen = set()
+
+    def records():
+        for path in paths:
+            for rec in iter_xlsx_records(path, sheets, stats):
+                if dedupe:
+                    key = sep_key(rec.sep_num, rec.receipt_num)
+                    if key in seen:
+                        stats["duplicate"] += 1
+                        continue
+                    seen.add(key)
+                yield rec
+
+    it = records()
+    while True:
+        chunk = list(itertools.islice(it, chunk_rows))
+        if not chunk:
+            break
+        with metrics.timer("xlsx.chunk"):
+            inserted, skipped = sink(chunk)
+        stats["chunks"] += 1
+        stats["inserted"] += inserted
+        stats["skipped"] += skipped
+        print(f"📥 Chunk {stats['chunks']}: {inserted} appended, {skipped} already present "
+              f"({stats['read']} rows read so far)")
+    return stats
+
+
+def sheet_sink(ws_sep, dedupe: bool = True, jobs=None):
+    """Sink that appends each chunk to sep_web_driver in one append_rows call (and queues it into `jobs`)."""
+    return lambda records: append_sep_records(ws_sep, records, dedupe=dedupe, jobs=jobs)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Import SEP lists from .xlsx workbooks into sep_web_driver.")
+    ap.add_argument("paths", nargs="+", help="workbooks to import")
+    ap.add_argument("--sheets", nargs="*", default=None, help="only these worksheet names")
+    ap.add_argument("--chunk-rows", type=int, default=5000, help="rows per batched append (default 5000)")
+    ap.add_argument("--no-dedupe", action="store_true", help="append every row, even if already present")
+    ap.add_argument("--dry-run", action="store_true", help="read and count only, write nothing")
+    ap.add_argument("--enqueue", action="store_true", help="queue the appended rows for submit_daemon")
+    args = ap.parse_args()
+    metrics.configure("xlsx_import")
+
+    if args.dry_run:
+        sink = lambda records: (len(records), 0)
+    else:
+        jobs = JobQueue() if args.enqueue else None
+        sink = sheet_sink(get_worksheet(WORKSHEET_NAME), dedupe=not args.no_dedupe, jobs=jobs)
+    t0 = time.perf_counter()
+    stats = import_xlsx(args.paths, sink, chunk_rows=args.chunk_rows, sheets=args.sheets, dedupe=not args.no_dedupe)
+    print(f"✅ {stats['read']} rows read in {time.perf_counter() - t0:.1f}s: {stats['inserted']} appended, "
+          f"{stats['skipped']} already on the sheet, {stats['duplicate']} duplicates across files, "
+          f"{stats['incomplete']} without sep_num/receipt_num.")